@@ -16,6 +16,8 @@
 
 from __future__ import absolute_import
 
+import sys
+
 from .proc_enums import ExitCodes
 
 from .exceptions import (
@@ -31,6 +33,7 @@ from .exec_result import ExecResult
 from .ssh_auth import SSHAuth
 from .ssh_client import SSHClient
 from .subprocess_runner import Subprocess  # nosec  # Expected
+from .shell_session import ShellSession  # nosec  # Expected
 
 __all__ = (
     'ExecHelperError',
@@ -42,10 +45,16 @@ __all__ = (
     'SSHClient',
     'SSHAuth',
     'Subprocess',
+    'ShellSession',
     'ExitCodes',
     'ExecResult',
 )
 
+if sys.version_info >= (3, 5):  # pragma: no cover
+    from .async_subprocess import AsyncSubprocess  # nosec  # Expected
+
+    __all__ += ('AsyncSubprocess',)
+
 __version__ = '1.1.2'
 __author__ = "Alexey Stepanov"
 __author_email__ = 'penguinolog@gmail.com'
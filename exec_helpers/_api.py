@@ -22,14 +22,170 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import logging  # noqa  # pylint: disable=unused-import
+import os
 import re
+import shlex
 import threading
+import typing
+
+import six
+
+try:
+    import pathlib  # py3.4+
+except ImportError:  # pragma: no cover
+    pathlib = None
 
 from exec_helpers import constants
 from exec_helpers import exceptions
+from exec_helpers import exec_result  # noqa  # pylint: disable=unused-import
 from exec_helpers import proc_enums
 from exec_helpers import _log_templates
 
+_type_command = typing.Union[str, typing.Sequence[str]]
+_type_stdin = typing.Union[
+    six.text_type, six.binary_type, bytearray, typing.IO, typing.Iterable, None
+]
+_type_exit_codes = typing.Union[int, proc_enums.ExitCodes]
+_type_expected = typing.Optional[typing.Iterable[_type_exit_codes]]
+
+# Chunk size for stdin read from file
+_STDIN_CHUNK = 65536
+
+# Command without shell syntax: words of safe characters only
+_SIMPLE_COMMAND = re.compile(r'^[\w@+=:,./\- ]+\Z', re.UNICODE)
+
+
+def command_to_str(
+    command  # type: typing.Union[str, typing.Sequence[str]]
+):  # type: (...) -> str
+    """Get command string: argv is joined with shell quoting.
+
+    :param command: command string or argv
+    :type command: typing.Union[str, typing.Sequence[str]]
+    :rtype: str
+
+    .. versionadded:: 1.2.0
+    """
+    if isinstance(command, six.string_types):
+        return command
+    return ' '.join(six.moves.shlex_quote(arg) for arg in command)
+
+
+def resolve_command(
+    command,  # type: typing.Union[str, typing.Sequence[str]]
+    shell=None,  # type: typing.Union[bool, str, None]
+):  # type: (...) -> typing.Tuple[typing.Union[str, typing.List[str]], bool]
+    """Get arguments for execution with or without shell.
+
+    :param command: command string or argv
+    :type command: typing.Union[str, typing.Sequence[str]]
+    :param shell: execute via shell: True, False, 'auto' or None
+                  (shell for command string, direct exec for argv).
+                  'auto' execs command string directly, if it has no
+                  shell syntax and does not start from variable assignment.
+    :type shell: typing.Union[bool, str, None]
+    :return: command string for shell or argv and shell usage flag
+    :rtype: typing.Tuple[typing.Union[str, typing.List[str]], bool]
+    :raises ValueError: unknown shell mode
+
+    .. versionadded:: 1.2.0
+    """
+    if shell not in (True, False, None, 'auto'):
+        raise ValueError(
+            'shell should be bool, None or \'auto\', got {!r}'.format(shell)
+        )
+    is_str = isinstance(command, six.string_types)
+    if shell is None:
+        shell = is_str
+    if shell is True:
+        return command_to_str(command), True
+    if not is_str:
+        return list(command), False
+    if shell is False:
+        return shlex.split(command), False
+    # auto
+    argv = command.split()
+    if _SIMPLE_COMMAND.match(command) and argv and '=' not in argv[0]:
+        return argv, False
+    return command, True
+
+
+def stdin_chunks(
+    stdin  # type: _type_stdin
+):  # type: (...) -> typing.Iterator[bytes]
+    """Get STDIN data as iterator of bytes chunks.
+
+    Text is encoded as utf-8. Files and paths are read by chunks,
+    so data is not loaded to the memory. String is data, not path:
+    path should be passed as os.PathLike (pathlib.Path) or opened file.
+    File object is read from the current position and is not closed,
+    file of path is opened before execution and closed after reading.
+
+    :param stdin: data, file object, path or iterable of data chunks
+    :type stdin: typing.Union[
+        str, bytes, bytearray, typing.IO, os.PathLike, typing.Iterable
+    ]
+    :rtype: typing.Iterator[bytes]
+    :raises TypeError: unsupported STDIN type
+
+    .. versionadded:: 1.2.0
+    """
+    def encode(chunk):  # type: (typing.Union[str, bytes]) -> bytes
+        """Get chunk as bytes."""
+        if isinstance(chunk, six.text_type):
+            return chunk.encode(encoding='utf-8')
+        return bytes(chunk)
+
+    def read_file(src):  # type: (typing.IO) -> typing.Iterator[bytes]
+        """Read file by chunks."""
+        for chunk in iter(lambda: src.read(_STDIN_CHUNK), src.read(0)):
+            yield encode(chunk)
+
+    def read_own_file(src):  # type: (typing.IO) -> typing.Iterator[bytes]
+        """Read file by chunks and close it."""
+        with src:
+            for chunk in read_file(src):
+                yield chunk
+
+    def read_chunks(src):  # type: (typing.Iterable) -> typing.Iterator[bytes]
+        """Get not empty chunks from iterable."""
+        for chunk in src:
+            if chunk:
+                yield encode(chunk)
+
+    if isinstance(stdin, (six.text_type, six.binary_type, bytearray)):
+        return iter([encode(stdin)] if stdin else [])
+    if hasattr(stdin, '__fspath__') or (
+        pathlib is not None and isinstance(stdin, pathlib.PurePath)
+    ):  # Open now: fail before execution
+        path = getattr(os, 'fspath', str)(stdin)  # PurePath on python < 3.6
+        return read_own_file(open(path, 'rb'))
+    if hasattr(stdin, 'read'):
+        return read_file(stdin)
+    if hasattr(stdin, '__iter__'):
+        return read_chunks(stdin)
+    raise TypeError(
+        'stdin should be data, file, path or iterable, got {!r}'.format(stdin)
+    )
+
+
+def stopped_on_match(
+    result  # type: exec_result.ExecResult
+):  # type: (...) -> bool
+    """Execution has been stopped on the expected state output.
+
+    Exit code of command stopped by stop_on watcher is not checked:
+    command is killed (or detached) in the expected state.
+
+    :type result: ExecResult
+    :rtype: bool
+
+    .. versionadded:: 1.2.0
+    """
+    match = result.watch_match
+    return match is not None and match[0] == 'stop_on'
+
 
 class ExecHelper(object):
     """ExecHelper global API."""
@@ -126,6 +282,77 @@ class ExecHelper(object):
 
         return cmd
 
+    def _check_exit_code(
+        self,
+        result,  # type: exec_result.ExecResult
+        error_info,  # type: typing.Optional[str]
+        expected,  # type: typing.List[typing.Union[int, proc_enums.ExitCodes]]
+        raise_on_err,  # type: bool
+    ):  # type: (...) -> None
+        """Check exit code of executed command.
+
+        Exit code of command stopped on stop_on match is not checked.
+
+        :type result: ExecResult
+        :param error_info: Text for error details, if fail happens
+        :type error_info: typing.Optional[str]
+        :param expected: expected return codes
+        :type expected: typing.List[typing.Union[int, ExitCodes]]
+        :param raise_on_err: Raise exception on unexpected return code
+        :type raise_on_err: bool
+        :raises CalledProcessError: Unexpected exit code
+
+        .. versionadded:: 1.2.0
+        """
+        if result['exit_code'] in expected or stopped_on_match(result):
+            return
+        message = (
+            _log_templates.CMD_UNEXPECTED_EXIT_CODE.format(
+                append=error_info + '\n' if error_info else '',
+                result=result,
+                expected=expected
+            ))
+        self.logger.error(message)
+        if raise_on_err:
+            raise exceptions.CalledProcessError(
+                result=result,
+                expected=expected,
+            )
+
+    def _check_stderr(
+        self,
+        result,  # type: exec_result.ExecResult
+        error_info,  # type: typing.Optional[str]
+        expected,  # type: _type_expected
+        raise_on_err,  # type: bool
+    ):  # type: (...) -> None
+        """Check, that executed command STDERR is empty.
+
+        :type result: ExecResult
+        :param error_info: Text for error details, if fail happens
+        :type error_info: typing.Optional[str]
+        :param expected: expected return codes for error details
+        :type expected: typing.Optional[typing.Iterable[int]]
+        :param raise_on_err: Raise exception on STDERR presents
+        :type raise_on_err: bool
+        :raises CalledProcessError: STDERR presents
+
+        .. versionadded:: 1.2.0
+        """
+        if not result['stderr']:
+            return
+        message = (
+            _log_templates.CMD_UNEXPECTED_STDERR.format(
+                append=error_info + '\n' if error_info else '',
+                result=result,
+            ))
+        self.logger.error(message)
+        if raise_on_err:
+            raise exceptions.CalledProcessError(
+                result=result,
+                expected=expected,
+            )
+
     def execute(
         self,
         command,  # type: str
@@ -135,7 +362,8 @@ class ExecHelper(object):
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command and wait for return code.
 
-        Timeout limitation: read tick is 100 ms.
+        Timeout limitation: SSHClient reads output with 100 ms tick,
+        Subprocess output and exit are handled on arrival.
 
         :param command: Command for execution
         :type command: str
@@ -162,7 +390,8 @@ class ExecHelper(object):
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command and check for return code.
 
-        Timeout limitation: read tick is 100 ms.
+        Timeout limitation: SSHClient reads output with 100 ms tick,
+        Subprocess output and exit are handled on arrival.
 
         :param command: Command for execution
         :type command: str
@@ -181,22 +410,11 @@ class ExecHelper(object):
         :raises CalledProcessError: Unexpected exit code
 
         .. versionchanged:: 1.2.0 default timeout 1 hour
+        .. versionchanged:: 1.2.0 exit code is not checked on stop_on match
         """
         expected = proc_enums.exit_codes_to_enums(expected)
         ret = self.execute(command, verbose, timeout, **kwargs)
-        if ret['exit_code'] not in expected:
-            message = (
-                _log_templates.CMD_UNEXPECTED_EXIT_CODE.format(
-                    append=error_info + '\n' if error_info else '',
-                    result=ret,
-                    expected=expected
-                ))
-            self.logger.error(message)
-            if raise_on_err:
-                raise exceptions.CalledProcessError(
-                    result=ret,
-                    expected=expected,
-                )
+        self._check_exit_code(ret, error_info, expected, raise_on_err)
         return ret
 
     def check_stderr(
@@ -210,7 +428,8 @@ class ExecHelper(object):
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command expecting return code 0 and empty STDERR.
 
-        Timeout limitation: read tick is 100 ms.
+        Timeout limitation: SSHClient reads output with 100 ms tick,
+        Subprocess output and exit are handled on arrival.
 
         :param command: Command for execution
         :type command: str
@@ -231,16 +450,6 @@ class ExecHelper(object):
         ret = self.check_call(
             command, verbose, timeout=timeout,
             error_info=error_info, raise_on_err=raise_on_err, **kwargs)
-        if ret['stderr']:
-            message = (
-                _log_templates.CMD_UNEXPECTED_STDERR.format(
-                    append=error_info + '\n' if error_info else '',
-                    result=ret,
-                ))
-            self.logger.error(message)
-            if raise_on_err:
-                raise exceptions.CalledProcessError(
-                    result=ret,
-                    expected=kwargs.get('expected'),
-                )
+        self._check_stderr(
+            ret, error_info, kwargs.get('expected'), raise_on_err)
         return ret
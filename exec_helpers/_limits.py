@@ -0,0 +1,349 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Resource limits, priorities and cgroup placement of started process.
+
+Limits are applied from the parent process by pid just after process
+creation (prlimit, setpriority, ioprio_set, cgroup.procs write), so
+preexec_fn is not required and posix_spawn could be used.
+Command is started via shell, which waits for the line in STDIN before
+command execution: command does not run without limits.
+Shell start and limits applying cost about 0.7 ms per command.
+Executable of argv command is checked before start: shell would hide
+missing executable as exit code 127.
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import ctypes
+import errno
+import os
+import platform
+import subprocess  # noqa  # nosec  # pylint: disable=unused-import
+import sys
+import typing  # noqa  # pylint: disable=unused-import
+
+import six
+
+try:
+    import resource  # posix only
+except ImportError:  # pragma: no cover
+    resource = None
+
+__all__ = ('ProcessLimits', 'check_executable')
+
+_prlimit = getattr(resource, 'prlimit', None)  # python 3.4+, Linux only
+_setpriority = getattr(os, 'setpriority', None)  # python 3.3+
+
+_CGROUP_ROOT = '/sys/fs/cgroup'
+
+_SHELL = '/bin/sh'
+# Wait for limits applying: exit without command start on STDIN close
+_GATE = 'IFS= read -r _ || exit 125'
+
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_CLASSES = {'none': 0, 'rt': 1, 'be': 2, 'idle': 3}
+
+# ioprio_set is not available in python: call it via libc syscall() (Linux)
+_IOPRIO_SET_SYSCALLS = {
+    'x86_64': 251,
+    'amd64': 251,
+    'i386': 289,
+    'i686': 289,
+    'aarch64': 30,
+    'arm64': 30,
+    'ppc64le': 273,
+    'ppc64': 273,
+    's390x': 282,
+}
+
+
+def _ioprio_set(pid, value):  # type: (int, int) -> None
+    """Set IO scheduling class and priority of the process.
+
+    :type pid: int
+    :param value: ioprio value: class << 13 | level
+    :type value: int
+    :raises OSError: syscall failed
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    number = _IOPRIO_SET_SYSCALLS[platform.machine()]
+    if libc.syscall(number, _IOPRIO_WHO_PROCESS, pid, value) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def _check_cgroup(path):  # type: (str) -> None
+    """Check, that directory is (or will be created) in cgroup v2 hierarchy.
+
+    :param path: cgroup directory
+    :type path: str
+    :raises ValueError: the nearest existing directory is not cgroup v2
+    """
+    existing = path
+    while not os.path.isdir(existing):
+        existing = os.path.dirname(existing)
+    if not os.path.isfile(os.path.join(existing, 'cgroup.procs')):
+        raise ValueError(
+            '{!r} is not in cgroup v2 hierarchy'.format(path)
+        )
+
+
+def check_executable(
+    name,  # type: str
+    env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    cwd=None,  # type: typing.Optional[str]
+):  # type: (...) -> None
+    """Check, that executable could be started like exec does.
+
+    Name without path separator is searched in PATH of the environment.
+
+    :param name: executable name or path
+    :type name: str
+    :param env: process environment (current by default)
+    :type env: typing.Optional[typing.Dict[str, typing.Any]]
+    :param cwd: process working directory (current by default)
+    :type cwd: typing.Optional[str]
+    :raises OSError: executable is not found (ENOENT)
+                     or is not executable (EACCES)
+    """
+    if os.sep in name:
+        candidates = [os.path.join(cwd or os.curdir, name)]
+    else:
+        path = (os.environ if env is None else env).get('PATH', os.defpath)
+        candidates = [
+            os.path.join(directory or os.curdir, name)
+            for directory in path.split(os.pathsep)
+        ]
+    error = errno.ENOENT
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            if os.access(candidate, os.X_OK):
+                return
+            error = errno.EACCES
+    raise OSError(error, os.strerror(error), name)
+
+
+class ProcessLimits(object):
+    """Resource limits, priorities and cgroup placement for process."""
+
+    __slots__ = (
+        '__rlimits',
+        '__nice',
+        '__ioprio',
+        '__cgroup',
+        '__cgroup_limits',
+        '__created',
+    )
+
+    def __init__(
+        self,
+        rlimits=None,  # type: typing.Optional[typing.Dict]
+        nice=None,  # type: typing.Optional[int]
+        ionice=None,  # type: typing.Union[str, typing.Tuple[str, int], None]
+        cgroup=None,  # type: typing.Optional[str]
+        cgroup_limits=None,  # type: typing.Optional[typing.Dict[str, str]]
+    ):  # type: (...) -> None
+        """Resource limits, priorities and cgroup placement for process.
+
+        Arguments are validated here: nothing is started with wrong limits.
+
+        :param rlimits: resource limits: name ('cpu', 'as', 'nofile', etc.)
+                        or resource.RLIMIT_* constant as key,
+                        limit or (soft, hard) as value. None is unlimited.
+        :type rlimits: typing.Optional[typing.Dict[
+            typing.Union[str, int],
+            typing.Union[int, None, typing.Tuple[typing.Optional[int], ...]]
+        ]]
+        :param nice: niceness increment relative to the current process
+        :type nice: typing.Optional[int]
+        :param ionice: IO scheduling class ('rt', 'be', 'idle')
+                       or (class, level) tuple
+        :type ionice: typing.Union[str, typing.Tuple[str, int], None]
+        :param cgroup: cgroup v2 directory (relative to /sys/fs/cgroup
+                       or absolute), created if not exists
+                       and removed by release()
+        :type cgroup: typing.Optional[str]
+        :param cgroup_limits: cgroup control files content,
+                              for example {'memory.max': '512M'}
+        :type cgroup_limits: typing.Optional[typing.Dict[str, str]]
+        :raises ValueError: unknown limit, IO scheduling class or cgroup
+        :raises NotImplementedError: limit is not supported on the platform
+        """
+        self.__rlimits = self.__parse_rlimits(rlimits or {})
+        self.__nice = nice
+        if nice is not None and _setpriority is None:
+            raise NotImplementedError('nice is not supported on this platform')
+        self.__ioprio = None if ionice is None else self.__parse_ionice(ionice)
+        if cgroup_limits and cgroup is None:
+            raise ValueError('cgroup_limits requires cgroup')
+        self.__cgroup = (
+            None if cgroup is None else os.path.join(_CGROUP_ROOT, cgroup)
+        )
+        if self.__cgroup is not None:
+            _check_cgroup(self.__cgroup)
+        self.__cgroup_limits = cgroup_limits or {}
+        # cgroup directories, created by apply: the deepest is the first
+        self.__created = []  # type: typing.List[str]
+
+    @staticmethod
+    def __parse_rlimits(
+        rlimits,  # type: typing.Dict
+    ):  # type: (...) -> typing.List[typing.Tuple[int, typing.Tuple[int, int]]]
+        """Convert limits to the prlimit arguments.
+
+        :rtype: typing.List[typing.Tuple[int, typing.Tuple[int, int]]]
+        :raises ValueError: unknown limit
+        :raises NotImplementedError: prlimit is not available
+        """
+        if not rlimits:
+            return []
+        if _prlimit is None:
+            raise NotImplementedError(
+                'rlimits are not supported on this platform'
+            )
+        result = []
+        for name, value in rlimits.items():
+            if isinstance(name, six.string_types):
+                limit = getattr(resource, 'RLIMIT_' + name.upper(), None)
+                if limit is None:
+                    raise ValueError('Unknown rlimit: {!r}'.format(name))
+            else:
+                limit = name
+            if isinstance(value, (tuple, list)):
+                soft, hard = value
+            else:
+                soft = hard = value
+            result.append((
+                limit,
+                tuple(
+                    resource.RLIM_INFINITY if val is None else val
+                    for val in (soft, hard)
+                )
+            ))
+        return result
+
+    @staticmethod
+    def __parse_ionice(
+        ionice,  # type: typing.Union[str, typing.Tuple[str, int]]
+    ):  # type: (...) -> int
+        """Convert IO scheduling class and level to the ioprio value.
+
+        :rtype: int
+        :raises ValueError: unknown class or level
+        :raises NotImplementedError: ioprio_set is not available
+        """
+        if isinstance(ionice, six.string_types):
+            name, level = ionice, 0
+        else:
+            name, level = ionice
+        if name not in _IOPRIO_CLASSES:
+            raise ValueError(
+                'IO scheduling class {!r} is not in {!r}'.format(
+                    name, sorted(_IOPRIO_CLASSES)
+                )
+            )
+        if not 0 <= level <= 7:
+            raise ValueError('IO priority level should be in range 0-7')
+        if (
+            not sys.platform.startswith('linux') or
+            platform.machine() not in _IOPRIO_SET_SYSCALLS
+        ):
+            raise NotImplementedError(
+                'ionice is not supported on this platform'
+            )
+        return _IOPRIO_CLASSES[name] << _IOPRIO_CLASS_SHIFT | level
+
+    @staticmethod
+    def gate(
+        args,  # type: typing.Union[str, typing.List[str]]
+        shell,  # type: bool
+    ):  # type: (...) -> typing.List[str]
+        """Get argv of command, which waits for apply call before start.
+
+        Shell command is executed by the same shell, argv is executed
+        via exec in the shell.
+
+        :param args: command string for shell or argv
+        :type args: typing.Union[str, typing.List[str]]
+        :param shell: args is command string for shell
+        :type shell: bool
+        :return: argv for execution without shell
+        :rtype: typing.List[str]
+        """
+        if shell:
+            return [_SHELL, '-c', _GATE + '\n' + args]
+        return [_SHELL, '-c', _GATE + '; exec "$@"', _SHELL] + list(args)
+
+    def apply(
+        self,
+        process,  # type: subprocess.Popen
+    ):  # type: (...) -> None
+        """Apply limits to the started (and not reaped) process.
+
+        Process, started with gate command, is allowed to continue.
+        Already ended process is skipped: limits are not required for it.
+
+        :param process: started process with STDIN pipe
+        :type process: subprocess.Popen
+        :raises OSError: limit could not be applied (permissions, etc.)
+        """
+        try:
+            self.__apply(process.pid)
+            os.write(process.stdin.fileno(), b'\n')
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.ESRCH, errno.EPIPE):
+                raise
+
+    def release(self):  # type: () -> None
+        """Remove cgroup directories, created by apply, after process end.
+
+        Directory is kept, if it is still used: background children
+        of the process are running or other process is moved to it.
+        """
+        created, self.__created = self.__created, []
+        for path in created:
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    return  # Used: parents are not empty too
+
+    def __apply(self, pid):  # type: (int) -> None
+        """Apply limits to the process."""
+        if self.__cgroup is not None:
+            # The first: children of the process are created in cgroup
+            path = self.__cgroup
+            while not os.path.isdir(path):
+                self.__created.append(path)
+                path = os.path.dirname(path)
+            if self.__created:
+                os.makedirs(self.__cgroup)
+            for name, value in self.__cgroup_limits.items():
+                with open(os.path.join(self.__cgroup, name), 'w') as control:
+                    control.write(value)
+            with open(os.path.join(self.__cgroup, 'cgroup.procs'), 'w') as f:
+                f.write(str(pid))
+        for limit, value in self.__rlimits:
+            _prlimit(pid, limit, value)
+        if self.__nice is not None:
+            current = os.getpriority(os.PRIO_PROCESS, 0)
+            _setpriority(os.PRIO_PROCESS, pid, current + self.__nice)
+        if self.__ioprio is not None:
+            _ioprio_set(pid, self.__ioprio)
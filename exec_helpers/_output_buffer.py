@@ -0,0 +1,964 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Output storage for execution results.
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import array
+import bisect
+import collections
+import hashlib
+import mmap
+import struct
+import tempfile
+import typing  # noqa  # pylint: disable=unused-import
+import zlib
+
+try:
+    import lzma  # py3 only
+except ImportError:  # pragma: no cover
+    lzma = None
+
+import six
+
+__all__ = ('OutputBuffer', 'OUTPUT_STRATEGIES', 'COMPRESSION_METHODS')
+
+# array typecode for unsigned 64 bit offsets ('Q' is not available on py2)
+OFFSET_TYPECODE = 'Q' if six.PY3 else 'L'
+
+# Strategies for bounded output capture
+OUTPUT_STRATEGIES = ('head', 'tail', 'head+tail')
+
+# Compression methods for frozen buffers: name -> (compress, decompress)
+COMPRESSION_METHODS = {
+    'zlib': (zlib.compress, zlib.decompress),
+}
+if lzma is not None:
+    COMPRESSION_METHODS['lzma'] = (lzma.compress, lzma.decompress)
+
+# Serialized state: max_lines, max_bytes (-1 if not set), strategy index,
+# head is full flag, dropped lines, dropped bytes, head and tail chunks count,
+# content digest size (0 if unknown)
+_STATE = struct.Struct(str('!qqB?QQQQB'))
+
+
+def _new_digest():  # type: () -> typing.Any
+    """Content digest object: blake2b if available (python 3.6+).
+
+    :rtype: typing.Any
+    """
+    if hasattr(hashlib, 'blake2b'):
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.sha256()  # pragma: no cover
+
+
+class _Storage(object):
+    """Stored in-memory chunks and index of chunk ends and line starts.
+
+    Storage of frozen buffer is not changed (only cached views are set):
+    it is replaced as a whole on compression, decompression and joining,
+    so readers without lock always see consistent data.
+
+    Joined storage keeps data as single binary (chunks and tail are None):
+    chunks are sliced by chunk ends.
+    """
+
+    __slots__ = (
+        'chunks',
+        'tail',
+        'head_bytes',
+        'tail_bytes',
+        'ends',
+        'line_starts',
+        'tuple',
+        'joined',
+        'head_count',
+    )
+
+    def __init__(self, bounded):  # type: (bool) -> None
+        """Empty storage.
+
+        :param bounded: output limits are set: index is not maintained
+        :type bounded: bool
+        """
+        self.chunks = []  # type: typing.List[bytes]
+        self.tail = (
+            collections.deque() if bounded else None
+        )  # type: typing.Optional[typing.Deque[bytes]]
+        self.head_bytes = 0
+        self.tail_bytes = 0
+        self.ends = (
+            array.array(OFFSET_TYPECODE) if not bounded else None
+        )  # type: typing.Optional[array.array]
+        self.line_starts = (
+            array.array(OFFSET_TYPECODE) if not bounded else None
+        )  # type: typing.Optional[array.array]
+        self.tuple = None  # type: typing.Optional[typing.Tuple[bytes]]
+        self.joined = None  # type: typing.Optional[bytes]
+        # Number of chunks before dropped data in joined bounded storage
+        self.head_count = 0
+
+    @classmethod
+    def from_joined(
+        cls,
+        joined,  # type: bytes
+        ends,  # type: array.array
+        line_starts,  # type: typing.Optional[array.array]
+        head_count,  # type: int
+    ):  # type: (...) -> _Storage
+        """Storage of single binary.
+
+        :param joined: stored data
+        :type joined: bytes
+        :param ends: chunk ends
+        :type ends: array.array
+        :param line_starts: line starts (None for bounded output)
+        :type line_starts: typing.Optional[array.array]
+        :param head_count: number of chunks before dropped data
+        :type head_count: int
+        :rtype: _Storage
+        """
+        storage = cls(bounded=True)
+        storage.chunks = storage.tail = None
+        storage.ends = ends
+        storage.line_starts = line_starts
+        storage.joined = joined
+        storage.head_count = head_count
+        return storage
+
+
+class OutputBuffer(object):
+    """Append-only chunked storage for single output stream.
+
+    Chunks are stored in the list, so append is amortized O(1).
+    Tuple view is materialized on demand and cached until the next append.
+    Read-only sequence protocol (len, iteration, index and slice access)
+    is supported, so buffer can be used in place of chunks tuple.
+
+    If spill threshold is set and stored data exceeds it, data is moved to
+    the temporary file and only chunk boundaries are kept in memory.
+    After freeze spilled data is accessible via read-only memory map.
+
+    If output limits are set, only first and/or last chunks are stored
+    (depends on strategy) and dropped chunks are counted.
+    Limits are applied to whole chunks: chunk is never split.
+
+    For not bounded output compact index of chunk ends and line starts is
+    maintained, so any line or lines range is accessible without joining.
+    When frozen in-memory data is joined, single binary replaces chunks:
+    chunks and lines are sliced from it, so data is not stored twice.
+
+    If chunks interning is enabled, equal chunks (repeated lines) of
+    not bounded in-memory output are stored as single object, so memory
+    usage is proportional to distinct content.
+    """
+
+    __slots__ = (
+        '__storage',
+        '__nbytes',
+        '__nlines',
+        '__tail_open',
+        '__frozen',
+        '__spill_threshold',
+        '__file',
+        '__mmap',
+        '__max_lines',
+        '__max_bytes',
+        '__strategy',
+        '__head_full',
+        '__dropped_lines',
+        '__dropped_bytes',
+        '__digest',
+        '__digest_value',
+        '__interned',
+    )
+
+    def __init__(
+        self,
+        chunks=None,  # type: typing.Optional[typing.Iterable[bytes]]
+        spill_threshold=None,  # type: typing.Optional[int]
+        max_lines=None,  # type: typing.Optional[int]
+        max_bytes=None,  # type: typing.Optional[int]
+        strategy='head+tail',  # type: str
+        intern_chunks=False,  # type: bool
+    ):
+        """Append-only chunked storage for single output stream.
+
+        :param chunks: initial data
+        :type chunks: typing.Optional[typing.Iterable[bytes]]
+        :param spill_threshold: size in bytes to move data to temporary file
+        :type spill_threshold: typing.Optional[int]
+        :param max_lines: maximum stored chunks (lines)
+        :type max_lines: typing.Optional[int]
+        :param max_bytes: maximum stored bytes
+        :type max_bytes: typing.Optional[int]
+        :param strategy: which part of output to keep: head, tail, head+tail
+        :type strategy: str
+        :param intern_chunks: store equal chunks as single object
+                              (not bounded in-memory output only)
+        :type intern_chunks: bool
+        :raises ValueError: incorrect strategy or incompatible options
+        """
+        if strategy not in OUTPUT_STRATEGIES:
+            raise ValueError(
+                'Output strategy {!r} is not in {!r}'.format(
+                    strategy, OUTPUT_STRATEGIES
+                )
+            )
+        bounded = max_lines is not None or max_bytes is not None
+        if bounded and spill_threshold is not None:
+            raise ValueError(
+                'spill_threshold is not compatible with output limits'
+            )
+        # Stored data or (compression method, compressed serialized data)
+        self.__storage = _Storage(
+            bounded
+        )  # type: typing.Union[_Storage, typing.Tuple[str, bytes]]
+        self.__nbytes = 0
+        self.__nlines = 0
+        self.__tail_open = False  # last line is not terminated by EOL
+        self.__frozen = False
+        self.__spill_threshold = spill_threshold
+        self.__file = None  # type: typing.Optional[typing.IO[bytes]]
+        self.__mmap = None  # type: typing.Optional[mmap.mmap]
+
+        self.__max_lines = max_lines
+        self.__max_bytes = max_bytes
+        self.__strategy = strategy
+        self.__head_full = bounded and strategy == 'tail'
+        self.__dropped_lines = 0
+        self.__dropped_bytes = 0
+        # Incremental digest of received data and final digest value
+        self.__digest = _new_digest()
+        self.__digest_value = None  # type: typing.Optional[bytes]
+        # Chunk -> stored equal chunk. Not used for bounded output:
+        # dropped chunks should not be held in memory.
+        self.__interned = (
+            {} if intern_chunks and not bounded else None
+        )  # type: typing.Optional[typing.Dict[bytes, bytes]]
+
+        if chunks is not None:
+            self.extend(chunks)
+
+    @staticmethod
+    def _to_bytes(chunk):  # type: (typing.Any) -> bytes
+        """Convert chunk to the immutable binary.
+
+        :type chunk: typing.Union[six.text_type, bytes, bytearray]
+        :rtype: bytes
+        """
+        if isinstance(chunk, six.binary_type):
+            return chunk
+        if isinstance(chunk, six.text_type):
+            return chunk.encode('utf-8')
+        return six.binary_type(chunk)
+
+    @staticmethod
+    def _split_lines(data):  # type: (bytes) -> typing.List[bytes]
+        """Split data by EOL (b'\\n' only) keeping line terminators.
+
+        :type data: bytes
+        :rtype: typing.List[bytes]
+        """
+        lines = [line + b'\n' for line in data.split(b'\n')]
+        lines[-1] = lines[-1][:-1]  # Last part is not terminated
+        if not lines[-1]:
+            lines.pop()
+        return lines
+
+    def append(self, chunk):  # type: (bytes) -> None
+        """Append chunk to the buffer.
+
+        :type chunk: bytes
+        :raises RuntimeError: buffer is frozen
+        """
+        if self.__frozen:
+            raise RuntimeError('Output buffer is frozen.')
+        chunk = self._to_bytes(chunk)
+        storage = self.__storage
+        if storage.tail is not None:
+            self.__append_bounded(storage, chunk)
+        else:
+            if self.__file is not None:
+                self.__file.write(chunk)
+            elif self.__interned is not None:
+                chunk = self.__interned.setdefault(chunk, chunk)
+                storage.chunks.append(chunk)
+            else:
+                storage.chunks.append(chunk)
+            storage.ends.append(self.__nbytes + len(chunk))
+            self.__index_lines(storage, chunk)
+        if chunk:
+            if self.__digest is not None:
+                self.__digest.update(chunk)
+            else:  # Restored buffer: digest of previous data is unknown
+                self.__digest_value = None
+            self.__nbytes += len(chunk)
+            self.__nlines += chunk.count(b'\n')
+            self.__tail_open = not chunk.endswith(b'\n')
+        storage.tuple = None
+
+        if (
+            self.__file is None and
+            self.__spill_threshold is not None and
+            self.__nbytes > self.__spill_threshold
+        ):
+            self.__spill()
+
+    def __index_lines(
+        self,
+        storage,  # type: _Storage
+        chunk,  # type: bytes
+    ):  # type: (...) -> None
+        """Add line starts from the new chunk to the index.
+
+        :type storage: _Storage
+        :type chunk: bytes
+        """
+        if not chunk:
+            return
+        base = self.__nbytes
+        line_starts = storage.line_starts
+        if not self.__tail_open:  # Previous data is terminated by EOL
+            line_starts.append(base)
+        last = len(chunk) - 1
+        pos = chunk.find(b'\n')
+        while 0 <= pos < last:
+            line_starts.append(base + pos + 1)
+            pos = chunk.find(b'\n', pos + 1)
+
+    def __limits(
+        self,
+        storage,  # type: _Storage
+        head,  # type: bool
+    ):  # type: (...) -> typing.Tuple[float, float]
+        """Get lines and bytes limits for head or tail part.
+
+        :type storage: _Storage
+        :param head: get limits for the head part
+        :type head: bool
+        :rtype: typing.Tuple[float, float]
+        """
+        unlimited = float('inf')
+        max_lines = self.__max_lines
+        max_bytes = self.__max_bytes
+        if head:
+            if self.__strategy == 'head+tail':
+                # Head part takes upper half of the limit
+                if max_lines is not None:
+                    max_lines = (max_lines + 1) // 2
+                if max_bytes is not None:
+                    max_bytes = (max_bytes + 1) // 2
+        else:
+            if max_lines is not None:
+                max_lines -= len(storage.chunks)
+            if max_bytes is not None:
+                max_bytes -= storage.head_bytes
+        return (
+            unlimited if max_lines is None else max_lines,
+            unlimited if max_bytes is None else max_bytes,
+        )
+
+    def __drop(self, chunk):  # type: (bytes) -> None
+        """Count dropped chunk.
+
+        :type chunk: bytes
+        """
+        self.__dropped_lines += 1
+        self.__dropped_bytes += len(chunk)
+
+    def __append_bounded(
+        self,
+        storage,  # type: _Storage
+        chunk,  # type: bytes
+    ):  # type: (...) -> None
+        """Store chunk according to the limits.
+
+        :type storage: _Storage
+        :type chunk: bytes
+        """
+        if not self.__head_full:
+            max_lines, max_bytes = self.__limits(storage, head=True)
+            if (
+                len(storage.chunks) < max_lines and
+                storage.head_bytes + len(chunk) <= max_bytes
+            ):
+                storage.chunks.append(chunk)
+                storage.head_bytes += len(chunk)
+                return
+            # Keep order: after the first overflow head is never extended
+            self.__head_full = True
+
+        if self.__strategy == 'head':
+            self.__drop(chunk)
+            return
+
+        tail = storage.tail
+        tail.append(chunk)
+        storage.tail_bytes += len(chunk)
+        max_lines, max_bytes = self.__limits(storage, head=False)
+        while tail and (
+            len(tail) > max_lines or storage.tail_bytes > max_bytes
+        ):
+            dropped = tail.popleft()
+            storage.tail_bytes -= len(dropped)
+            self.__drop(dropped)
+
+    def extend(self, chunks):  # type: (typing.Iterable[bytes]) -> None
+        """Append multiple chunks to the buffer.
+
+        :type chunks: typing.Iterable[bytes]
+        :raises RuntimeError: buffer is frozen
+        """
+        for chunk in chunks:
+            self.append(chunk)
+
+    def __spill(self):  # type: () -> None
+        """Move stored chunks to the temporary file."""
+        self.__file = tempfile.TemporaryFile(prefix='exec_helpers_')
+        storage = self.__storage
+        for chunk in storage.chunks:
+            self.__file.write(chunk)
+        storage.chunks = []
+        self.__interned = None
+
+    def freeze(self):  # type: () -> None
+        """Mark buffer as final: no more data will be appended."""
+        if self.__digest is not None:
+            self.__digest_value = self.__digest.digest()
+            self.__digest = None
+        self.__interned = None  # Stored chunks keep references
+        self.__frozen = True
+        if self.__file is not None and self.__mmap is None:
+            self.__file.flush()
+            self.__mmap = mmap.mmap(
+                self.__file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+    @property
+    def digest(self):  # type: () -> typing.Optional[bytes]
+        """Digest of received data (including dropped).
+
+        :return: digest or None if it is unknown (restored and appended)
+        :rtype: typing.Optional[bytes]
+        """
+        if self.__digest is not None:
+            return self.__digest.digest()
+        return self.__digest_value
+
+    @property
+    def frozen(self):  # type: () -> bool
+        """Buffer is final.
+
+        :rtype: bool
+        """
+        return self.__frozen
+
+    @property
+    def spilled(self):  # type: () -> bool
+        """Data is stored in the temporary file.
+
+        :rtype: bool
+        """
+        return self.__file is not None
+
+    @property
+    def bounded(self):  # type: () -> bool
+        """Output limits are set.
+
+        :rtype: bool
+        """
+        return self.__max_lines is not None or self.__max_bytes is not None
+
+    @property
+    def nbytes(self):  # type: () -> int
+        """Total size of received data in bytes (including dropped).
+
+        :rtype: int
+        """
+        return self.__nbytes
+
+    @property
+    def line_count(self):  # type: () -> int
+        """Number of lines in received data (including dropped).
+
+        Not terminated last line is counted.
+
+        :rtype: int
+        """
+        return self.__nlines + (1 if self.__tail_open else 0)
+
+    @property
+    def dropped_lines(self):  # type: () -> int
+        """Number of chunks (lines) dropped due to output limits.
+
+        :rtype: int
+        """
+        return self.__dropped_lines
+
+    @property
+    def dropped_bytes(self):  # type: () -> int
+        """Number of bytes dropped due to output limits.
+
+        :rtype: int
+        """
+        return self.__dropped_bytes
+
+    def __load(self):  # type: () -> _Storage
+        """Get stored data, decompress it if compressed.
+
+        Decompressed storage replaces compressed data as a whole,
+        so concurrent readers of frozen buffer see complete state.
+
+        :rtype: _Storage
+        """
+        storage = self.__storage
+        if isinstance(storage, _Storage):
+            return storage
+        method, data = storage
+        restored, _ = self.from_bytes(COMPRESSION_METHODS[method][1](data))
+        storage = restored.__storage
+        self.__storage = storage
+        return storage
+
+    def __read(
+        self,
+        storage,  # type: _Storage
+        start,  # type: int
+        end,  # type: int
+    ):  # type: (...) -> bytes
+        """Read stored data range (not bounded or joined storage only).
+
+        :type storage: _Storage
+        :type start: int
+        :type end: int
+        :rtype: bytes
+        """
+        if storage.joined is not None:
+            return storage.joined[start:end]
+        if not self.spilled:
+            chunks, ends = storage.chunks, storage.ends
+            parts = []
+            idx = bisect.bisect_right(ends, start)
+            pos = start
+            while pos < end:
+                chunk = chunks[idx]
+                chunk_start = ends[idx] - len(chunk)
+                parts.append(chunk[pos - chunk_start:end - chunk_start])
+                pos = ends[idx]
+                idx += 1
+            return b''.join(parts)
+        if self.__mmap is not None:
+            return self.__mmap[start:end]
+        self.__file.flush()
+        self.__file.seek(start)
+        data = self.__file.read(end - start)
+        self.__file.seek(0, 2)  # Restore append position
+        return data
+
+    def __sliced(self, storage):  # type: (_Storage) -> bool
+        """Chunks are read by chunk ends: data is spilled or joined.
+
+        :type storage: _Storage
+        :rtype: bool
+        """
+        return storage.chunks is None or self.spilled
+
+    def __sliced_chunk(
+        self,
+        storage,  # type: _Storage
+        index,  # type: int
+    ):  # type: (...) -> bytes
+        """Read spilled or joined chunk by normalized index.
+
+        :type storage: _Storage
+        :type index: int
+        :rtype: bytes
+        """
+        start = storage.ends[index - 1] if index else 0
+        return self.__read(storage, start, storage.ends[index])
+
+    @staticmethod
+    def __lengths(storage):  # type: (_Storage) -> typing.List[int]
+        """Stored chunks lengths.
+
+        :type storage: _Storage
+        :rtype: typing.List[int]
+        """
+        if storage.ends is None:  # Bounded not joined
+            return [
+                len(chunk)
+                for part in (storage.chunks, storage.tail)
+                for chunk in part
+            ]
+        lengths = []
+        start = 0
+        for end in storage.ends:
+            lengths.append(end - start)
+            start = end
+        return lengths
+
+    def __head_count(self, storage):  # type: (_Storage) -> int
+        """Number of stored chunks before dropped data.
+
+        :type storage: _Storage
+        :rtype: int
+        """
+        if storage.chunks is None:
+            return storage.head_count
+        if self.bounded:
+            return len(storage.chunks)
+        return len(self)
+
+    def as_tuple(self):  # type: () -> typing.Tuple[bytes]
+        """Stored chunks as tuple.
+
+        Tuple of spilled data is not cached to not hold data in memory.
+
+        :rtype: typing.Tuple[bytes]
+        """
+        storage = self.__load()
+        if self.spilled:
+            return tuple(self)
+        result = storage.tuple
+        if result is None:
+            if storage.chunks is None:  # Joined: sliced once
+                result = tuple(self)
+            elif storage.tail:
+                result = tuple(storage.chunks) + tuple(storage.tail)
+            else:
+                result = tuple(storage.chunks)
+            storage.tuple = result
+        return result
+
+    def join(self):  # type: () -> bytes
+        """Stored data as single binary.
+
+        For frozen in-memory data single binary replaces stored chunks.
+
+        :rtype: bytes
+        """
+        storage = self.__load()
+        if storage.joined is not None:
+            return storage.joined
+        if self.spilled:
+            return self.__read(storage, 0, self.__nbytes)
+        if storage.tail:
+            joined = b''.join(storage.chunks) + b''.join(storage.tail)
+        else:
+            joined = b''.join(storage.chunks)
+        if self.__frozen:
+            if storage.ends is not None:
+                ends = storage.ends
+            else:
+                ends = array.array(OFFSET_TYPECODE)
+                end = 0
+                for length in self.__lengths(storage):
+                    end += length
+                    ends.append(end)
+            joined_storage = _Storage.from_joined(
+                joined,
+                ends=ends,
+                line_starts=storage.line_starts,
+                head_count=self.__head_count(storage),
+            )
+            joined_storage.tuple = storage.tuple  # Keep cached view
+            self.__storage = joined_storage
+        return joined
+
+    def view(self):  # type: () -> memoryview
+        """Read-only memory view of stored data.
+
+        For frozen data view is made over memory mapped file (spilled data)
+        or over joined binary, so no data is copied.
+
+        :rtype: memoryview
+        """
+        if self.__mmap is not None:
+            return memoryview(self.__mmap)
+        return memoryview(self.join())
+
+    @property
+    def stored_line_count(self):  # type: () -> int
+        """Number of stored lines.
+
+        :rtype: int
+        """
+        if not self.bounded:  # All received lines are stored
+            return self.line_count
+        return len(self._split_lines(self.join()))
+
+    def get_lines(
+        self,
+        start,  # type: int
+        stop,  # type: int
+    ):  # type: (...) -> typing.List[bytes]
+        """Get stored lines range with line terminators.
+
+        :param start: first line index (normalized)
+        :type start: int
+        :param stop: index of line after last one (normalized)
+        :type stop: int
+        :rtype: typing.List[bytes]
+        """
+        storage = self.__load()
+        if start >= stop:
+            return []
+        line_starts = storage.line_starts
+        if line_starts is None:
+            return self._split_lines(self.join())[start:stop]
+        begin = line_starts[start]
+        if stop < len(line_starts):
+            end = line_starts[stop]
+        else:
+            end = self.__nbytes
+        return self._split_lines(self.__read(storage, begin, end))
+
+    def iter_lines(self):  # type: () -> typing.Iterator[bytes]
+        """Iterate over stored lines with line terminators.
+
+        Data is scanned chunk by chunk without joining.
+
+        :rtype: typing.Iterator[bytes]
+        """
+        partial = []
+        for chunk in self:
+            pos = 0
+            end = chunk.find(b'\n')
+            while end >= 0:
+                partial.append(chunk[pos:end + 1])
+                yield b''.join(partial)
+                partial = []
+                pos = end + 1
+                end = chunk.find(b'\n', pos)
+            if pos < len(chunk):
+                partial.append(chunk[pos:])
+        if partial:
+            yield b''.join(partial)
+
+    def brief_parts(
+        self,
+        count  # type: int
+    ):  # type: (...) -> typing.Tuple[typing.Tuple[bytes], typing.Tuple[bytes]]
+        """First chunks before and last chunks after dropped data.
+
+        :param count: maximum chunks in each part
+        :type count: int
+        :rtype: typing.Tuple[typing.Tuple[bytes], typing.Tuple[bytes]]
+        """
+        storage = self.__load()
+        head_count = self.__head_count(storage)
+        total = len(self)
+        head = self[:min(count, head_count)]
+        if total == head_count:
+            return head, ()
+        return head, self[max(total - count, head_count):]
+
+    def compress(self, method='zlib'):  # type: (str) -> typing.Optional[int]
+        """Compress stored data of frozen buffer.
+
+        Data is decompressed on the first access. Spilled data is not
+        compressed: it is not stored in memory.
+        Compressed data replaces stored data as a whole, so concurrent
+        readers see stored or compressed data, but not partial state.
+
+        :param method: compression method: 'zlib' or 'lzma' (python 3)
+        :type method: str
+        :return: compressed size or None if data is spilled
+        :rtype: typing.Optional[int]
+        :raises RuntimeError: buffer is not frozen
+        :raises ValueError: compression method is not supported
+        """
+        if method not in COMPRESSION_METHODS:
+            raise ValueError(
+                'Compression method {!r} is not in {!r}'.format(
+                    method, sorted(COMPRESSION_METHODS)
+                )
+            )
+        if not self.__frozen:
+            raise RuntimeError('Only frozen output buffer can be compressed.')
+        if self.spilled:
+            return None
+        compressed = self.__storage
+        if isinstance(compressed, _Storage):
+            compress = COMPRESSION_METHODS[method][0]
+            compressed = method, compress(self.to_bytes())
+            self.__storage = compressed
+        return len(compressed[1])
+
+    @property
+    def compressed_size(self):  # type: () -> typing.Optional[int]
+        """Size of compressed data or None if data is not compressed.
+
+        :rtype: typing.Optional[int]
+        """
+        storage = self.__storage
+        if isinstance(storage, _Storage):
+            return None
+        return len(storage[1])
+
+    def to_bytes(self):  # type: () -> bytes
+        """Serialize stored data and limits state.
+
+        Layout: state header, content digest, chunk lengths
+        (unsigned 64 bit big endian) and stored data as single binary.
+
+        :rtype: bytes
+        """
+        storage = self.__load()
+        lengths = self.__lengths(storage)
+        head_count = self.__head_count(storage)
+        digest = self.digest or b''
+        return b''.join((
+            _STATE.pack(
+                -1 if self.__max_lines is None else self.__max_lines,
+                -1 if self.__max_bytes is None else self.__max_bytes,
+                OUTPUT_STRATEGIES.index(self.__strategy),
+                bool(self.__head_full),
+                self.__dropped_lines,
+                self.__dropped_bytes,
+                head_count,
+                len(lengths) - head_count,
+                len(digest),
+            ),
+            digest,
+            struct.pack(str('!{}Q').format(len(lengths)), *lengths),
+            self.join(),
+        ))
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data,  # type: bytes
+        offset=0,  # type: int
+    ):  # type: (...) -> typing.Tuple[OutputBuffer, int]
+        """Restore buffer serialized by to_bytes.
+
+        Spill threshold is not serialized: data is restored in memory.
+        Equal chunks are restored as single object.
+
+        :param data: serialized data
+        :type data: bytes
+        :param offset: start position in data
+        :type offset: int
+        :return: restored buffer and end position of serialized buffer
+        :rtype: typing.Tuple[OutputBuffer, int]
+        :raises ValueError: data is truncated or malformed
+        """
+        try:
+            (
+                max_lines, max_bytes, strategy, head_full,
+                dropped_lines, dropped_bytes, head_count, tail_count,
+                digest_size,
+            ) = _STATE.unpack_from(data, offset)
+            offset += _STATE.size
+            digest = data[offset:offset + digest_size]
+            offset += digest_size
+            count = head_count + tail_count
+            lengths = struct.unpack_from(
+                str('!{}Q').format(count), data, offset
+            )
+            offset += 8 * count
+            strategy = OUTPUT_STRATEGIES[strategy]
+        except (struct.error, IndexError) as e:
+            raise ValueError('Malformed output buffer data: {!s}'.format(e))
+        if offset + sum(lengths) > len(data):
+            raise ValueError('Malformed output buffer data: truncated')
+
+        chunks = []
+        interned = {}  # type: typing.Dict[bytes, bytes]
+        for length in lengths:
+            chunk = data[offset:offset + length]
+            chunks.append(interned.setdefault(chunk, chunk))
+            offset += length
+
+        buffer = cls(
+            max_lines=None if max_lines < 0 else max_lines,
+            max_bytes=None if max_bytes < 0 else max_bytes,
+            strategy=strategy,
+        )
+        if not buffer.bounded:
+            buffer.extend(chunks)
+            return buffer, offset
+
+        # Restore bounded state as is: limits are already applied
+        storage = buffer.__storage
+        storage.chunks = chunks[:head_count]
+        storage.head_bytes = sum(lengths[:head_count])
+        storage.tail.extend(chunks[head_count:])
+        storage.tail_bytes = sum(lengths[head_count:])
+        buffer.__head_full = head_full
+        buffer.__dropped_lines = dropped_lines
+        buffer.__dropped_bytes = dropped_bytes
+        buffer.__nbytes = sum(lengths) + dropped_bytes
+        buffer.__nlines = sum(chunk.count(b'\n') for chunk in chunks)
+        buffer.__nlines += dropped_lines  # Chunks are lines
+        last = next((chunk for chunk in reversed(chunks) if chunk), b'\n')
+        buffer.__tail_open = not last.endswith(b'\n')
+        # Dropped data is not available: digest is restored as is
+        buffer.__digest = None
+        buffer.__digest_value = digest or None
+        return buffer, offset
+
+    def __len__(self):  # type: () -> int
+        """Number of stored chunks."""
+        storage = self.__load()
+        if self.__sliced(storage):
+            return len(storage.ends)
+        if storage.tail is not None:
+            return len(storage.chunks) + len(storage.tail)
+        return len(storage.chunks)
+
+    def __iter__(self):  # type: () -> typing.Iterator[bytes]
+        """Iterate over stored chunks."""
+        storage = self.__load()
+        if self.__sliced(storage):
+            return (
+                self.__sliced_chunk(storage, idx)
+                for idx in range(len(storage.ends))
+            )
+        if storage.tail:
+            return iter(self.as_tuple())
+        chunks = storage.chunks
+        return iter(chunks[:] if not self.__frozen else chunks)
+
+    def __getitem__(
+        self,
+        item  # type: typing.Union[int, slice]
+    ):  # type: (...) -> typing.Union[bytes, typing.Tuple[bytes]]
+        """Chunk by index or tuple of chunks by slice."""
+        storage = self.__load()
+        if not self.__sliced(storage):
+            if storage.tail:
+                return self.as_tuple()[item]
+            if isinstance(item, slice):
+                return tuple(storage.chunks[item])
+            return storage.chunks[item]
+
+        count = len(storage.ends)
+        if isinstance(item, slice):
+            return tuple(
+                self.__sliced_chunk(storage, idx)
+                for idx in range(*item.indices(count))
+            )
+        index = item + count if item < 0 else item
+        if not 0 <= index < count:
+            raise IndexError('Output buffer index out of range')
+        return self.__sliced_chunk(storage, index)
@@ -0,0 +1,1340 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Shared reactor for output and exit of local processes (posix only).
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import collections
+import concurrent.futures
+import errno
+import logging
+import os
+import signal
+import subprocess  # noqa  # nosec  # pylint: disable=unused-import
+import threading
+import time
+import typing  # noqa  # pylint: disable=unused-import
+
+try:
+    import fcntl  # posix only: reactor is not used on windows
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+try:
+    import selectors  # py3.4+
+except ImportError:  # pragma: no cover
+    import selectors2 as selectors  # pylint: disable=import-error
+
+__all__ = (
+    'Reactor',
+    'PipeReader',
+    'PipeWriter',
+    'LineSplitter',
+    'open_pidfd',
+    'reap',
+    'get_reactor',
+)
+
+logger = logging.getLogger(__name__)
+
+# Maximum data size for single pipe read
+_READ_SIZE = 65536
+# Not terminated line is flushed as is, if exceeds this size
+_MAX_CARRY = 1 << 20
+# Process exit check interval bounds, if exit notification is not available
+_EXIT_POLL_MIN = 0.001
+_EXIT_POLL_MAX = 0.1
+# Maximal exit check interval with SIGCHLD notification (last resort)
+_EXIT_POLL_SIGNAL_MAX = 1.0
+# Idle thread of callbacks or stdin pool exits after this time
+_POOL_THREAD_IDLE = 10
+
+_monotonic = getattr(time, 'monotonic', time.time)
+_wait4 = getattr(os, 'wait4', None)
+
+
+def open_pidfd(pid):  # type: (int) -> typing.Optional[int]
+    """Open process file descriptor for exit notification.
+
+    Available on Linux 5.3+ with python 3.9+.
+
+    :param pid: process id
+    :type pid: int
+    :return: file descriptor, readable after process exit or None
+    :rtype: typing.Optional[int]
+    """
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:  # pragma: no cover
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:  # pragma: no cover
+        return None
+
+
+def reap(process):  # type: (subprocess.Popen) -> typing.Optional[typing.Any]
+    """Collect exit code of the ended process with resource usage.
+
+    Process is reaped via os.wait4 (if available) instead of process.poll(),
+    exit code is stored to process.returncode.
+    Process waitpid lock (if any) is held, so concurrent process.poll()
+    can not get ECHILD and guess exit code between wait4 and store.
+
+    :param process: started process
+    :type process: subprocess.Popen
+    :return: resource.struct_rusage, if process is ended and reaped here
+    :rtype: typing.Optional[resource.struct_rusage]
+    :raises OSError: process is reaped outside of the process object
+                     (SIGCHLD is ignored): exit code is unknown (ECHILD)
+    """
+    if process.returncode is not None or _wait4 is None:
+        process.poll()
+        return None
+    lock = getattr(process, '_waitpid_lock', None)
+    if lock is not None and not lock.acquire(False):
+        return None  # Other thread waits for the process: check later
+    try:
+        if process.returncode is not None:
+            return None
+        pid, status, rusage = _wait4(process.pid, os.WNOHANG)
+        if pid != process.pid:
+            return None
+        if os.WIFSIGNALED(status):
+            process.returncode = -os.WTERMSIG(status)
+        else:
+            process.returncode = os.WEXITSTATUS(status)
+        return rusage
+    except (IOError, OSError) as e:
+        if e.errno != errno.ECHILD or process.returncode is None:
+            raise  # Do not report made up exit code
+        return None  # Reaped by process.poll() without waitpid lock (py2)
+    finally:
+        if lock is not None:
+            lock.release()
+
+
+def _set_nonblocking(descriptor):  # type: (int) -> None
+    """Set file descriptor non-blocking.
+
+    :type descriptor: int
+    """
+    flags = fcntl.fcntl(descriptor, fcntl.F_GETFL)
+    fcntl.fcntl(descriptor, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class _ChildSignal(object):
+    """SIGCHLD notification pipe: exit notification without pidfd.
+
+    Signal handler can be installed only from the main thread, previous
+    python handler is called from it. Signal is not installed, if it is
+    ignored (children are reaped by system) or handled outside of python.
+    Pipe is written by the interpreter via signal.set_wakeup_fd (if it is
+    not used by other code), so notification does not wait for the main
+    thread, and by the handler.
+    """
+
+    __slots__ = (
+        '__lock',
+        '__pid',
+        '__read',
+        '__write',
+        '__previous',
+    )
+
+    def __init__(self):  # type: () -> None
+        """SIGCHLD notification pipe: exit notification without pidfd."""
+        self.__lock = threading.Lock()
+        self.__pid = None  # type: typing.Optional[int]
+        self.__read = None  # type: typing.Optional[int]
+        self.__write = None  # type: typing.Optional[int]
+        self.__previous = None  # type: typing.Any
+
+    @property
+    def active(self):  # type: () -> bool
+        """Notification is installed in this process and not replaced.
+
+        :rtype: bool
+        """
+        return (
+            self.__pid == os.getpid() and
+            signal.getsignal(signal.SIGCHLD) == self.__handle
+        )
+
+    def fileno(self):  # type: () -> typing.Optional[int]
+        """Pipe file descriptor for selectors.
+
+        :return: file descriptor, readable after SIGCHLD or None
+        :rtype: typing.Optional[int]
+        """
+        return self.__read if self.active else None
+
+    def install(self):  # type: () -> None
+        """Install signal handler, if possible and not installed yet."""
+        if getattr(signal, 'SIGCHLD', None) is None:  # pragma: no cover
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return  # Installed: handler is not set again, if replaced
+            previous = signal.getsignal(signal.SIGCHLD)
+            if previous == signal.SIG_IGN or previous is None:
+                return
+            inherited = self.__read, self.__write  # Pipe of parent process
+            read, write = os.pipe()
+            _set_nonblocking(read)
+            _set_nonblocking(write)
+            self.__read, self.__write = read, write
+            try:
+                signal.signal(signal.SIGCHLD, self.__handle)
+            except ValueError:  # Not the main thread: try later
+                self.__read = self.__write = None
+                os.close(read)
+                os.close(write)
+                return
+            if previous != self.__handle:  # Not inherited after fork
+                self.__previous = previous
+            signal.siginterrupt(signal.SIGCHLD, False)
+            self.__pid = os.getpid()
+            self.__set_wakeup_fd(write, inherited[1])
+            for fd in inherited:
+                if fd is not None:
+                    os.close(fd)
+
+    @staticmethod
+    def __set_wakeup_fd(
+        write,  # type: int
+        inherited,  # type: typing.Optional[int]
+    ):  # type: (...) -> None
+        """Use pipe as signal wakeup file descriptor, if it is not used.
+
+        :param write: pipe file descriptor for writing
+        :type write: int
+        :param inherited: pipe of the parent process (after fork)
+        :type inherited: typing.Optional[int]
+        """
+        try:
+            previous = signal.set_wakeup_fd(write, warn_on_full_buffer=False)
+        except TypeError:  # pragma: no cover
+            previous = signal.set_wakeup_fd(write)  # python < 3.7
+        if previous not in (-1, inherited):
+            signal.set_wakeup_fd(previous)  # Used by other code (asyncio)
+
+    def __handle(self, signum, frame):  # type: (int, typing.Any) -> None
+        """Signal handler: write notification and call previous handler."""
+        write = self.__write
+        if write is not None:
+            try:
+                os.write(write, b'\0')
+            except (IOError, OSError):
+                pass  # Full pipe means pending notification
+        if callable(self.__previous):
+            self.__previous(signum, frame)
+
+    def drain(self):  # type: () -> None
+        """Read pending notifications."""
+        try:
+            while os.read(self.__read, 4096):
+                pass
+        except (IOError, OSError) as e:
+            if e.errno != errno.EAGAIN:  # pragma: no cover
+                raise
+
+
+_child_signal = _ChildSignal()
+# Selector key data for SIGCHLD notification
+_CHILD_SIGNAL = 'SIGCHLD'
+
+
+class LineSplitter(object):
+    """Split received data to lines.
+
+    Not terminated line is kept until the next data or the end of data.
+    """
+
+    __slots__ = (
+        '__carry',
+    )
+
+    def __init__(self):  # type: () -> None
+        """Split received data to lines."""
+        self.__carry = b''
+
+    def feed(self, data):  # type: (bytes) -> typing.List[bytes]
+        """Add received data.
+
+        :param data: received data
+        :type data: bytes
+        :return: complete lines with line terminators
+        :rtype: typing.List[bytes]
+        """
+        data = self.__carry + data
+        end = data.rfind(b'\n') + 1
+        if len(data) - end > _MAX_CARRY:  # Binary data or very long line
+            end = len(data)
+        self.__carry = data[end:]
+        if not end:
+            return []
+        lines = [line + b'\n' for line in data[:end].split(b'\n')]
+        lines[-1] = lines[-1][:-1]
+        if not lines[-1]:
+            lines.pop()
+        return lines
+
+    def flush(self):  # type: () -> typing.List[bytes]
+        """Get not terminated line.
+
+        :rtype: typing.List[bytes]
+        """
+        carry, self.__carry = self.__carry, b''
+        return [carry] if carry else []
+
+
+class PipeReader(object):
+    """Read available data from pipe and split it to lines.
+
+    Not terminated line is kept until the next read or the end of data.
+    """
+
+    __slots__ = (
+        '__fd',
+        '__lines',
+        '__closed',
+    )
+
+    def __init__(self, pipe):  # type: (typing.Any) -> None
+        """Read available data from pipe and split it to lines.
+
+        :param pipe: pipe file object
+        :type pipe: typing.Any
+        """
+        self.__fd = pipe.fileno()
+        self.__lines = LineSplitter()
+        self.__closed = False
+
+    def fileno(self):  # type: () -> int
+        """Pipe file descriptor for selectors.
+
+        :rtype: int
+        """
+        return self.__fd
+
+    @property
+    def closed(self):  # type: () -> bool
+        """End of data is reached.
+
+        :rtype: bool
+        """
+        return self.__closed
+
+    def read(self):  # type: () -> typing.List[bytes]
+        """Read available data (single system call).
+
+        :return: complete lines with line terminators
+        :rtype: typing.List[bytes]
+        """
+        try:
+            data = os.read(self.__fd, _READ_SIZE)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            data = b''
+        if not data:
+            self.__closed = True
+            return self.flush()
+        return self.__lines.feed(data)
+
+    def flush(self):  # type: () -> typing.List[bytes]
+        """Get not terminated line.
+
+        :rtype: typing.List[bytes]
+        """
+        return self.__lines.flush()
+
+
+class PipeWriter(object):
+    """Write data chunks to non-blocking pipe.
+
+    Pipe is written by the reactor thread, when it is ready for writing.
+    Data source is consumed outside of the reactor thread by one chunk,
+    so slow or failed source does not affect polling of other processes
+    and the next chunk is requested only after the previous one is written.
+    """
+
+    __slots__ = (
+        '__pipe',
+        '__fd',
+        '__chunks',
+        '__pending',
+        '__closed',
+        'future',
+        'source_calls',
+    )
+
+    def __init__(
+        self,
+        pipe,  # type: typing.Any
+        chunks,  # type: typing.Iterator[bytes]
+    ):  # type: (...) -> None
+        """Write data chunks to non-blocking pipe.
+
+        :param pipe: pipe file object, closed after the end of data
+        :type pipe: typing.Any
+        :param chunks: data chunks
+        :type chunks: typing.Iterator[bytes]
+        """
+        self.__pipe = pipe
+        self.__fd = pipe.fileno()
+        _set_nonblocking(self.__fd)
+        self.__chunks = chunks
+        self.__pending = memoryview(b'')
+        self.__closed = False
+        # True if all data is written, False if stopped
+        self.future = concurrent.futures.Future()
+        # Data source calls (outside of the reactor thread)
+        self.source_calls = _SerialCalls()
+
+    def fileno(self):  # type: () -> int
+        """Pipe file descriptor for selectors.
+
+        :rtype: int
+        """
+        return self.__fd
+
+    @property
+    def closed(self):  # type: () -> bool
+        """Writing is stopped.
+
+        :rtype: bool
+        """
+        return self.__closed
+
+    def fetch(self):  # type: () -> typing.Optional[bytes]
+        """Get the next data chunk from source (stdin thread).
+
+        :return: data chunk or None after the end of data
+        :rtype: typing.Optional[bytes]
+        """
+        return next(self.__chunks, None)
+
+    def feed(self, chunk):  # type: (bytes) -> None
+        """Set data for writing.
+
+        :type chunk: bytes
+        """
+        self.__pending = memoryview(chunk)
+
+    def write(self):  # type: () -> bool
+        """Write pending data without blocking.
+
+        :return: all pending data is written
+        :rtype: bool
+        :raises OSError: pipe is closed by reader (EPIPE)
+        """
+        while self.__pending:
+            try:
+                written = os.write(self.__fd, self.__pending)
+            except (IOError, OSError) as e:
+                if e.errno == errno.EAGAIN:
+                    return False
+                if e.errno == errno.EINTR:  # pragma: no cover
+                    continue
+                raise
+            self.__pending = self.__pending[written:]
+        return True
+
+    def close(self):  # type: () -> None
+        """Close pipe: data source is closed by close_source."""
+        self.__closed = True
+        self.__pending = memoryview(b'')
+        try:
+            self.__pipe.close()
+        except (IOError, OSError):
+            pass  # Broken pipe on flush
+
+    def close_source(self):  # type: () -> None
+        """Close data source (stdin thread)."""
+        close = getattr(self.__chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class _SerialCalls(object):
+    """Calls, which are called sequentially by the thread pool."""
+
+    __slots__ = (
+        'calls',
+        'scheduled',
+    )
+
+    def __init__(self):  # type: () -> None
+        """Calls, which are called sequentially by the thread pool."""
+        # Pending calls: (function, arguments)
+        self.calls = collections.deque()  # type: typing.Deque[typing.Tuple]
+        # Calls are processed by thread of the pool
+        self.scheduled = False
+
+
+class _ThreadPool(object):
+    """Shared threads, which call callbacks of processes.
+
+    Calls of single queue (process callbacks, stdin source) are called
+    sequentially in order of submission, calls of different queues are
+    called in parallel: slow or blocking callback (including nested
+    command execution) does not delay callbacks of other processes.
+    New thread is started if all threads are busy, idle thread exits
+    after timeout.
+    """
+
+    __slots__ = (
+        '__name',
+        '__pid',
+        '__condition',
+        '__ready',
+        '__idle',
+    )
+
+    def __init__(self, name):  # type: (str) -> None
+        """Shared threads, which call callbacks of processes.
+
+        :param name: threads name
+        :type name: str
+        """
+        self.__name = name
+        self.__pid = None  # type: typing.Optional[int]
+        self.__condition = threading.Condition()
+        # Queues with pending calls and without thread
+        self.__ready = collections.deque()  # type: typing.Deque[_SerialCalls]
+        self.__idle = 0
+
+    def __check_fork(self):  # type: () -> None
+        """Forget threads of the parent process (threads are not inherited)."""
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.__condition = threading.Condition()
+            self.__ready = collections.deque()
+            self.__idle = 0
+
+    def submit(
+        self,
+        queue,  # type: _SerialCalls
+        func,  # type: typing.Callable
+        *args
+    ):  # type: (...) -> None
+        """Call function after previous calls of the queue.
+
+        :type queue: _SerialCalls
+        :type func: typing.Callable
+        """
+        self.__check_fork()
+        with self.__condition:
+            queue.calls.append((func, args))
+            if queue.scheduled:
+                return  # Called by thread after the previous calls
+            queue.scheduled = True
+            self.__ready.append(queue)
+            if self.__idle >= len(self.__ready):
+                self.__condition.notify()
+                return
+        thread = threading.Thread(
+            target=self.__run,
+            args=(self.__condition, self.__ready),
+            name=self.__name,
+        )
+        thread.daemon = True
+        thread.start()
+
+    def call_after(
+        self,
+        queue,  # type: _SerialCalls
+        func,  # type: typing.Callable
+        *args
+    ):  # type: (...) -> None
+        """Call function after calls of the queue.
+
+        Function is called in the caller thread, if queue has no
+        pending calls.
+
+        :type queue: _SerialCalls
+        :type func: typing.Callable
+        """
+        self.__check_fork()
+        with self.__condition:
+            pending = queue.scheduled
+        if pending:
+            self.submit(queue, func, *args)
+        else:
+            func(*args)
+
+    def __run(
+        self,
+        condition,  # type: threading.Condition
+        ready,  # type: typing.Deque[_SerialCalls]
+    ):  # type: (...) -> None
+        """Pool thread loop.
+
+        :type condition: threading.Condition
+        :type ready: typing.Deque[_SerialCalls]
+        """
+        while True:
+            with condition:
+                deadline = _monotonic() + _POOL_THREAD_IDLE
+                while not ready:
+                    timeout = deadline - _monotonic()
+                    if timeout <= 0:
+                        return
+                    self.__idle += 1
+                    try:
+                        condition.wait(timeout)
+                    finally:
+                        self.__idle -= 1
+                queue = ready.popleft()
+            while True:
+                with condition:
+                    if not queue.calls:
+                        queue.scheduled = False
+                        break
+                    func, args = queue.calls.popleft()
+                try:
+                    func(*args)
+                except Exception:  # pylint: disable=broad-except
+                    logger.exception('Callback failed')
+
+
+class _Watch(object):
+    """Running process state in the reactor."""
+
+    __slots__ = (
+        'process',
+        'readers',
+        'writer',
+        'pidfd',
+        'on_exit',
+        'rusage',
+        'future',
+        'interval',
+        'deadline',
+        'callbacks',
+    )
+
+    def __init__(
+        self,
+        process,  # type: subprocess.Popen
+        readers,  # type: typing.List[typing.Tuple[PipeReader, typing.Any]]
+        writer,  # type: typing.Optional[PipeWriter]
+        on_exit,  # type: typing.Callable[[int, typing.Any], None]
+    ):  # type: (...) -> None
+        """Running process state in the reactor.
+
+        :type process: subprocess.Popen
+        :param readers: pipe readers with callbacks for received lines
+        :type readers: typing.List[typing.Tuple[PipeReader, typing.Callable]]
+        :param writer: stdin writer
+        :type writer: typing.Optional[PipeWriter]
+        :param on_exit: callback for exit code and resource usage
+        :type on_exit: typing.Callable[[int, typing.Any], None]
+        """
+        self.process = process
+        self.readers = readers
+        self.writer = writer
+        self.pidfd = None  # type: typing.Optional[int]
+        self.on_exit = on_exit
+        self.rusage = None  # type: typing.Any
+        self.future = concurrent.futures.Future()
+        # Exit check backoff (without exit notification)
+        self.interval = _EXIT_POLL_MIN
+        self.deadline = _monotonic()
+        # Output and exit callbacks
+        self.callbacks = _SerialCalls()
+
+    def touch(self):  # type: () -> None
+        """Reset exit check backoff on activity."""
+        self.interval = _EXIT_POLL_MIN
+        self.deadline = _monotonic() + self.interval
+
+    def backoff(self):  # type: () -> None
+        """Increase exit check interval.
+
+        With SIGCHLD notification check is the last resort (missed signal).
+        """
+        self.interval = min(
+            self.interval * 2,
+            _EXIT_POLL_SIGNAL_MAX if _child_signal.active else _EXIT_POLL_MAX,
+        )
+        self.deadline = _monotonic() + self.interval
+
+
+class Reactor(object):
+    """Single thread, which polls pipes and exit of all running processes.
+
+    Pipes and exit notifications (pidfd, if available) of all processes are
+    multiplexed in one selector, so thread count does not depend on
+    the number of running processes. Completion is reported via future.
+
+    Output and exit callbacks of each process are called sequentially in
+    order of data receiving from the shared callbacks thread pool, so
+    callbacks do not delay output processing and callbacks of other
+    processes. STDIN pipes are written by the reactor thread, when they are
+    ready for writing, data sources are read from the shared stdin threads.
+    Reactor thread failure is reported to all registered futures.
+    """
+
+    __slots__ = (
+        '__lock',
+        '__pid',
+        '__thread',
+        '__selector',
+        '__wake_read',
+        '__wake_write',
+        '__watches',
+        '__writers',
+        '__requests',
+        '__callbacks',
+        '__stdin',
+    )
+
+    def __init__(self):  # type: () -> None
+        """Single thread, which polls pipes and exit of all processes."""
+        self.__lock = threading.Lock()
+        self.__pid = None  # type: typing.Optional[int]
+        self.__thread = None  # type: typing.Optional[threading.Thread]
+        self.__selector = None  # type: typing.Optional[typing.Any]
+        self.__wake_read = None  # type: typing.Optional[int]
+        self.__wake_write = None  # type: typing.Optional[int]
+        # Future of running process -> process state
+        self.__watches = {}  # type: typing.Dict[typing.Any, _Watch]
+        # Future of pipe writing -> writer and process state (if any)
+        self.__writers = {}  # type: typing.Dict[typing.Any, typing.Tuple]
+        # Requests from other threads: (action, watch or writer, argument)
+        self.__requests = []  # type: typing.List[typing.Tuple]
+        self.__callbacks = _ThreadPool('exec_helpers.callbacks')
+        self.__stdin = _ThreadPool('exec_helpers.stdin')
+
+    def __start(self):  # type: () -> None
+        """Start reactor thread if not running in this process."""
+        if (
+            self.__pid == os.getpid() and
+            self.__thread is not None and
+            self.__thread.is_alive()
+        ):
+            return
+        # Not started, failed or forked: thread and selector are not inherited
+        self.__selector = selectors.DefaultSelector()
+        self.__wake_read, self.__wake_write = os.pipe()
+        # Wake pipe never blocks writer and reader
+        _set_nonblocking(self.__wake_read)
+        _set_nonblocking(self.__wake_write)
+        self.__selector.register(self.__wake_read, selectors.EVENT_READ)
+        self.__watches = {}
+        self.__writers = {}
+        self.__pid = os.getpid()
+        self.__thread = threading.Thread(
+            target=self.__run,
+            args=(self.__selector, self.__wake_read, self.__wake_write),
+            name='exec_helpers.reactor',
+        )
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __wake(self):  # type: () -> None
+        """Wake reactor thread to process requests."""
+        try:
+            os.write(self.__wake_write, b'\0')
+        except (IOError, OSError) as e:  # pragma: no cover
+            if e.errno != errno.EAGAIN:  # Full pipe means pending wake
+                raise
+
+    def __request(
+        self,
+        action,  # type: str
+        target,  # type: typing.Union[_Watch, PipeWriter]
+        argument=None,  # type: typing.Any
+    ):  # type: (...) -> None
+        """Request watch or writer change from other thread.
+
+        :param action: 'add', 'write', 'chunk', 'remove' or 'fail'
+        :type action: str
+        :param target: process watch ('add') or pipe writer ('write', 'chunk')
+        :type target: typing.Union[_Watch, PipeWriter]
+        :param argument: failure reason for 'fail', data chunk for 'chunk'
+        :type argument: typing.Any
+        """
+        with self.__lock:
+            if action in ('add', 'write'):
+                self.__start()
+            elif self.__thread is None:
+                return
+            self.__requests.append((action, target, argument))
+            self.__wake()
+
+    def register(
+        self,
+        process,  # type: subprocess.Popen
+        on_stdout,  # type: typing.Optional[typing.Callable]
+        on_stderr,  # type: typing.Optional[typing.Callable]
+        on_exit,  # type: typing.Callable[[int, typing.Any], None]
+        stdin=None,  # type: typing.Optional[typing.Iterator[bytes]]
+    ):  # type: (...) -> concurrent.futures.Future
+        """Start polling of process pipes and exit.
+
+        Pipes callbacks are called with list of received lines,
+        exit callback is called with exit code and resource usage
+        (resource.struct_rusage or None, if not available) after reading
+        of data available in pipes. Future is completed after exit callback.
+        STDIN data is written, when process is ready to read it,
+        stdin pipe is closed after the end of data or process exit.
+
+        :param process: started process
+        :type process: subprocess.Popen
+        :param on_stdout: callback for stdout lines (None if not opened)
+        :type on_stdout: typing.Optional[typing.Callable]
+        :param on_stderr: callback for stderr lines (None if not opened)
+        :type on_stderr: typing.Optional[typing.Callable]
+        :param on_exit: callback for exit code and resource usage
+        :type on_exit: typing.Callable[[int, typing.Any], None]
+        :param stdin: data chunks for stdin (not written if None)
+        :type stdin: typing.Optional[typing.Iterator[bytes]]
+        :return: future with exit code (None if unregistered before exit)
+        :rtype: concurrent.futures.Future
+        """
+        readers = [
+            (PipeReader(pipe), callback)
+            for pipe, callback in (
+                (process.stdout, on_stdout),
+                (process.stderr, on_stderr),
+            ) if pipe is not None and callback is not None
+        ]
+        writer = None if stdin is None else PipeWriter(process.stdin, stdin)
+        watch = _Watch(process, readers, writer, on_exit)
+        watch.pidfd = open_pidfd(process.pid)
+        if watch.pidfd is None:
+            _child_signal.install()
+        self.__request('add', watch)
+        return watch.future
+
+    def write(
+        self,
+        pipe,  # type: typing.Any
+        chunks,  # type: typing.Iterator[bytes]
+    ):  # type: (...) -> concurrent.futures.Future
+        """Start writing of data chunks to pipe (FIFO, etc).
+
+        Data is written, when pipe is ready for writing, pipe is closed
+        after the end of data or on unregister.
+
+        :param pipe: pipe file object
+        :type pipe: typing.Any
+        :param chunks: data chunks
+        :type chunks: typing.Iterator[bytes]
+        :return: future with True if all data is written, False if stopped
+                 (pipe is closed by reader or unregistered),
+                 exception on data source failure
+        :rtype: concurrent.futures.Future
+        """
+        writer = PipeWriter(pipe, chunks)
+        self.__request('write', writer)
+        return writer.future
+
+    def unregister(
+        self,
+        future,  # type: concurrent.futures.Future
+    ):  # type: (...) -> None
+        """Stop polling of process or pipe writing.
+
+        Future of process is completed with None, future of writing
+        is completed with False.
+
+        :param future: future returned by register or write
+        :type future: concurrent.futures.Future
+        """
+        with self.__lock:
+            if self.__thread is None or future.done():
+                return
+            for target in (
+                list(self.__watches.values()) +
+                [writer for writer, _ in list(self.__writers.values())] +
+                [request[1] for request in self.__requests]
+            ):
+                if target.future is future:
+                    self.__requests.append(('remove', target, None))
+                    self.__wake()
+                    return
+
+    def __process_requests(
+        self,
+        selector,  # type: selectors.BaseSelector
+        wake_read,  # type: int
+    ):  # type: (...) -> None
+        """Process watches and writers changes requested from other threads.
+
+        :type selector: selectors.BaseSelector
+        :type wake_read: int
+        """
+        try:
+            while os.read(wake_read, 4096):
+                pass
+        except (IOError, OSError) as e:  # pragma: no cover
+            if e.errno != errno.EAGAIN:
+                raise
+        with self.__lock:
+            requests, self.__requests = self.__requests, []
+        for action, target, argument in requests:
+            if action == 'add':
+                self.__add(selector, target)
+            elif action == 'write':
+                self.__start_writer(target, None)
+            elif target.future in self.__writers:
+                if action == 'chunk':
+                    self.__feed(selector, target, argument)
+                else:
+                    self.__stop_writer(selector, target, argument)
+            elif target.future not in self.__watches:
+                continue  # Already finished
+            elif action == 'remove':
+                self.__finish(selector, target, None)
+            else:
+                self.__fail(selector, target, argument)
+
+    def __add(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+    ):  # type: (...) -> None
+        """Start polling of watch pipes and exit notification.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        """
+        self.__watches[watch.future] = watch
+        for reader, callback in watch.readers:
+            selector.register(
+                reader, selectors.EVENT_READ, (watch, callback)
+            )
+        if watch.pidfd is not None:
+            selector.register(
+                watch.pidfd, selectors.EVENT_READ, (watch, None)
+            )
+        else:
+            self.__watch_child_signal(selector)
+        if watch.writer is not None:
+            self.__start_writer(watch.writer, watch)
+        watch.touch()
+
+    def __start_writer(
+        self,
+        writer,  # type: PipeWriter
+        watch,  # type: typing.Optional[_Watch]
+    ):  # type: (...) -> None
+        """Start writing: the first chunk is requested from data source.
+
+        :type writer: PipeWriter
+        :param watch: process state for stdin writer
+        :type watch: typing.Optional[_Watch]
+        """
+        self.__writers[writer.future] = writer, watch
+        self.__stdin.submit(writer.source_calls, self.__fetch, writer)
+
+    def __fetch(self, writer):  # type: (PipeWriter) -> None
+        """Get the next data chunk for writer (stdin thread).
+
+        :type writer: PipeWriter
+        """
+        if writer.closed:
+            return
+        try:
+            chunk = writer.fetch()
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Data source failed')
+            self.__request('fail', writer, e)
+        else:
+            self.__request('chunk', writer, chunk)
+
+    def __feed(
+        self,
+        selector,  # type: selectors.BaseSelector
+        writer,  # type: PipeWriter
+        chunk,  # type: typing.Optional[bytes]
+    ):  # type: (...) -> None
+        """Write received data chunk.
+
+        :type selector: selectors.BaseSelector
+        :type writer: PipeWriter
+        :param chunk: data chunk or None after the end of data
+        :type chunk: typing.Optional[bytes]
+        """
+        if chunk is None:
+            self.__stop_writer(selector, writer, None, completed=True)
+            return
+        writer.feed(chunk)
+        self.__write(selector, writer)
+
+    def __write(
+        self,
+        selector,  # type: selectors.BaseSelector
+        writer,  # type: PipeWriter
+    ):  # type: (...) -> None
+        """Write pending data while pipe is ready for writing.
+
+        The next chunk is requested after writing of pending data.
+
+        :type selector: selectors.BaseSelector
+        :type writer: PipeWriter
+        """
+        try:
+            written = writer.write()
+        except (IOError, OSError):  # Pipe is closed by reader (EPIPE)
+            self.__stop_writer(selector, writer, None)
+            return
+        registered = writer.fileno() in selector.get_map()
+        if written:
+            if registered:
+                selector.unregister(writer)
+            self.__stdin.submit(writer.source_calls, self.__fetch, writer)
+        elif not registered:
+            selector.register(writer, selectors.EVENT_WRITE, writer)
+
+    def __stop_writer(
+        self,
+        selector,  # type: selectors.BaseSelector
+        writer,  # type: PipeWriter
+        exception,  # type: typing.Optional[Exception]
+        completed=False,  # type: bool
+    ):  # type: (...) -> None
+        """Close writer pipe and data source and complete writer future.
+
+        Data source failure is reported to the process watch.
+
+        :type selector: selectors.BaseSelector
+        :type writer: PipeWriter
+        :param exception: data source failure
+        :type exception: typing.Optional[Exception]
+        :param completed: all data is written
+        :type completed: bool
+        """
+        _, watch = self.__writers.pop(writer.future)
+        if writer.fileno() in selector.get_map():
+            selector.unregister(writer)
+        writer.close()
+        # Closed after the running data source call
+        self.__stdin.submit(writer.source_calls, writer.close_source)
+        if exception is None:
+            writer.future.set_result(completed)
+            return
+        writer.future.set_exception(exception)
+        if watch is not None:
+            self.__fail(selector, watch, exception)
+
+    @staticmethod
+    def __watch_child_signal(
+        selector,  # type: selectors.BaseSelector
+    ):  # type: (...) -> None
+        """Poll SIGCHLD notification pipe, if available.
+
+        :type selector: selectors.BaseSelector
+        """
+        fd = _child_signal.fileno()
+        if fd is not None and fd not in selector.get_map():
+            selector.register(fd, selectors.EVENT_READ, _CHILD_SIGNAL)
+
+    def __remove(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+    ):  # type: (...) -> None
+        """Stop polling of watch pipes and exit notification.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        """
+        del self.__watches[watch.future]
+        for reader, _ in watch.readers:
+            if reader.fileno() in selector.get_map():
+                selector.unregister(reader)
+        writer = watch.writer
+        if writer is not None and writer.future in self.__writers:
+            self.__stop_writer(selector, writer, None)
+        if watch.pidfd is not None:
+            selector.unregister(watch.pidfd)
+            os.close(watch.pidfd)
+
+    def __finish(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+        exit_code,  # type: typing.Optional[int]
+    ):  # type: (...) -> None
+        """Stop watch and complete future after already received data.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        :param exit_code: exit code or None if unregistered
+        :type exit_code: typing.Optional[int]
+        """
+        self.__remove(selector, watch)
+        # Completed in the reactor thread, if no pending callbacks
+        self.__callbacks.call_after(
+            watch.callbacks, self.__complete, watch, exit_code
+        )
+
+    @staticmethod
+    def __complete(
+        watch,  # type: _Watch
+        exit_code,  # type: typing.Optional[int]
+    ):  # type: (...) -> None
+        """Call exit callback and complete future.
+
+        :type watch: _Watch
+        :param exit_code: exit code or None if unregistered
+        :type exit_code: typing.Optional[int]
+        """
+        if watch.future.done():  # Failed by callback
+            return
+        try:
+            if exit_code is not None:
+                watch.on_exit(exit_code, watch.rusage)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Process exit processing failed')
+            watch.future.set_exception(e)
+        else:
+            watch.future.set_result(exit_code)
+
+    def __callback(
+        self,
+        watch,  # type: _Watch
+        callback,  # type: typing.Callable
+        lines,  # type: typing.List[bytes]
+    ):  # type: (...) -> None
+        """Call output callback (callbacks thread).
+
+        On failure future is completed with exception and polling is stopped.
+
+        :type watch: _Watch
+        :type callback: typing.Callable
+        :type lines: typing.List[bytes]
+        """
+        if watch.future.done():  # Failed by previous callback
+            return
+        try:
+            callback(lines)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Process output processing failed')
+            watch.future.set_exception(e)
+            self.__request('remove', watch)
+
+    def __read(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+        reader,  # type: PipeReader
+        callback,  # type: typing.Callable
+    ):  # type: (...) -> None
+        """Read data from ready pipe.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        :type reader: PipeReader
+        :type callback: typing.Callable
+        """
+        lines = reader.read()
+        if lines:
+            self.__callbacks.submit(
+                watch.callbacks, self.__callback, watch, callback, lines
+            )
+        if reader.closed:
+            selector.unregister(reader)
+
+    def __check_exit(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+    ):  # type: (...) -> None
+        """Complete watch, if process is ended.
+
+        Data already in pipes is read without waiting for the end of data:
+        pipes can be held open by background child processes.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        """
+        watch.rusage = reap(watch.process)
+        if watch.process.returncode is None:
+            watch.backoff()
+            return
+        for reader, callback in watch.readers:
+            if reader.closed:
+                continue
+            pipe_selector = selectors.DefaultSelector()
+            pipe_selector.register(reader, selectors.EVENT_READ)
+            lines = []
+            try:
+                while not reader.closed and pipe_selector.select(0):
+                    lines.extend(reader.read())
+            finally:
+                pipe_selector.close()
+            lines.extend(reader.flush())
+            if lines:
+                self.__callbacks.submit(
+                    watch.callbacks, self.__callback, watch, callback, lines
+                )
+        self.__finish(selector, watch, watch.process.returncode)
+
+    def __timeout(self):  # type: () -> typing.Optional[float]
+        """Wait time until the nearest exit check.
+
+        :return: timeout or None if all watches have exit notification
+        :rtype: typing.Optional[float]
+        """
+        deadlines = [
+            watch.deadline for watch in self.__watches.values()
+            if watch.pidfd is None
+        ]
+        if not deadlines:
+            return None
+        return max(min(deadlines) - _monotonic(), 0)
+
+    def __run(
+        self,
+        selector,  # type: selectors.BaseSelector
+        wake_read,  # type: int
+        wake_write,  # type: int
+    ):  # type: (...) -> None
+        """Reactor thread: loop and failure reporting.
+
+        On reactor failure all registered and requested futures are
+        completed with exception, the next registration starts new thread.
+
+        :type selector: selectors.BaseSelector
+        :type wake_read: int
+        :type wake_write: int
+        """
+        try:
+            self.__loop(selector, wake_read)
+        except BaseException as e:  # pylint: disable=broad-except
+            logger.exception('Process reactor failed')
+            with self.__lock:
+                watches = list(self.__watches.values())
+                writers = [writer for writer, _ in self.__writers.values()]
+                for action, target, _ in self.__requests:
+                    if action == 'add':
+                        watches.append(target)
+                    elif action == 'write':
+                        writers.append(target)
+                self.__requests = []
+                self.__thread = None
+            writers.extend(
+                watch.writer for watch in watches
+                if watch.writer is not None and
+                watch.writer.future not in self.__writers
+            )
+            for writer in writers:
+                writer.close()
+                self.__stdin.submit(writer.source_calls, writer.close_source)
+                self.__set_exception(writer, e)
+            for watch in watches:
+                if watch.pidfd is not None:
+                    os.close(watch.pidfd)
+                self.__set_exception(watch, e)
+            selector.close()
+            os.close(wake_read)
+            os.close(wake_write)
+
+    @staticmethod
+    def __set_exception(
+        target,  # type: typing.Union[_Watch, PipeWriter]
+        exception,  # type: BaseException
+    ):  # type: (...) -> None
+        """Complete future with exception.
+
+        :type target: typing.Union[_Watch, PipeWriter]
+        :type exception: BaseException
+        """
+        if not target.future.done():
+            target.future.set_exception(exception)
+
+    def __loop(
+        self,
+        selector,  # type: selectors.BaseSelector
+        wake_read,  # type: int
+    ):  # type: (...) -> None
+        """Reactor loop.
+
+        :type selector: selectors.BaseSelector
+        :type wake_read: int
+        """
+        while True:
+            for key, _ in selector.select(self.__timeout()):
+                if key.data is None:  # Wake pipe
+                    self.__process_requests(selector, wake_read)
+                    continue
+                if key.data is _CHILD_SIGNAL:
+                    _child_signal.drain()
+                    for watch in self.__watches.values():
+                        if watch.pidfd is None:
+                            watch.deadline = 0  # Check exit now
+                    continue
+                if isinstance(key.data, PipeWriter):  # Ready for writing
+                    self.__write(selector, key.data)
+                    continue
+                watch, callback = key.data
+                if watch.future not in self.__watches:
+                    continue  # Finished by previous event
+                try:
+                    if callback is None:  # Exit notification
+                        self.__check_exit(selector, watch)
+                    else:
+                        self.__read(selector, watch, key.fileobj, callback)
+                        watch.touch()
+                except Exception as e:  # pylint: disable=broad-except
+                    logger.exception('Process output processing failed')
+                    self.__fail(selector, watch, e)
+
+            now = _monotonic()
+            for watch in list(self.__watches.values()):
+                if watch.pidfd is None and watch.deadline <= now:
+                    try:
+                        self.__check_exit(selector, watch)
+                    except Exception as e:  # pylint: disable=broad-except
+                        logger.exception('Process exit processing failed')
+                        self.__fail(selector, watch, e)
+
+    def __fail(
+        self,
+        selector,  # type: selectors.BaseSelector
+        watch,  # type: _Watch
+        exception,  # type: Exception
+    ):  # type: (...) -> None
+        """Stop watch after failure: future is completed with exception.
+
+        :type selector: selectors.BaseSelector
+        :type watch: _Watch
+        :type exception: Exception
+        """
+        if watch.future in self.__watches:
+            self.__remove(selector, watch)
+            self.__set_exception(watch, exception)
+
+
+_reactor = Reactor()
+
+
+def get_reactor():  # type: () -> Reactor
+    """Get shared reactor.
+
+    :rtype: Reactor
+    """
+    return _reactor
@@ -0,0 +1,281 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""posix_spawn based process creation (python 3.8+, posix only).
+
+fork() copies page tables of the parent process, so process creation from
+the huge parent process is slow. posix_spawn uses vfork-like creation
+(glibc: clone with CLONE_VM | CLONE_VFORK), which does not depend on the
+parent memory size.
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import errno
+import os
+import shutil
+import signal
+import sys
+import subprocess  # nosec  # Expected usage
+import threading
+import time
+import typing  # noqa  # pylint: disable=unused-import
+
+__all__ = (
+    'SpawnProcess',
+    'spawn_supported',
+)
+
+_posix_spawn = getattr(os, 'posix_spawn', None)
+_posix_spawnp = getattr(os, 'posix_spawnp', None)
+
+# Enable posix_spawn usage if supported (could be changed globally).
+# python 3.10+ Popen uses vfork itself, so spawn is not required.
+SPAWN_ENABLED = _posix_spawn is not None and sys.version_info < (3, 10)
+
+# Signals ignored by python interpreter: restore in the child, as Popen does
+_DEFAULT_SIGNALS = tuple(
+    getattr(signal, name)
+    for name in ('SIGPIPE', 'SIGXFSZ')
+    if hasattr(signal, name)
+)
+
+_SHELL = '/bin/sh'
+_FD_DIR = '/proc/self/fd'
+
+
+def spawn_supported(
+    cwd=None,  # type: typing.Optional[str]
+):  # type: (...) -> bool
+    """Check, that process could be created via posix_spawn.
+
+    posix_spawn does not support working directory change in python.
+
+    :param cwd: working directory for the process
+    :type cwd: typing.Optional[str]
+    :rtype: bool
+    """
+    return SPAWN_ENABLED and cwd is None
+
+
+def _inheritable_fds():  # type: () -> typing.List[int]
+    """Get inheritable file descriptors except std streams.
+
+    Descriptors, created by python, are not inheritable (PEP 446), so usually
+    list is empty and close_fds costs single directory listing.
+
+    :rtype: typing.List[int]
+    """
+    try:
+        descriptors = [int(name) for name in os.listdir(_FD_DIR)]
+    except OSError:  # pragma: no cover
+        return []  # No procfs: leave cloexec descriptors handling only
+    result = []
+    for descriptor in descriptors:
+        if descriptor <= 2:
+            continue
+        try:
+            if os.get_inheritable(descriptor):
+                result.append(descriptor)
+        except OSError:
+            pass  # Descriptor of listdir itself, already closed
+    return result
+
+
+class SpawnProcess(object):
+    """Process, created via posix_spawn.
+
+    Implements subset of subprocess.Popen API, which is used by Subprocess.
+    """
+
+    __slots__ = (
+        'args',
+        'pid',
+        'stdin',
+        'stdout',
+        'stderr',
+        'returncode',
+        '_waitpid_lock',
+    )
+
+    def __init__(
+        self,
+        args,  # type: typing.Union[str, typing.List[str]]
+        shell=False,  # type: bool
+        stdin=None,  # type: typing.Any
+        stdout=None,  # type: typing.Any
+        stderr=None,  # type: typing.Any
+        env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    ):  # type: (...) -> None
+        """Create process via posix_spawn.
+
+        :param args: command string or argv (like Popen)
+        :type args: typing.Union[str, typing.List[str]]
+        :param shell: execute command string via /bin/sh
+        :type shell: bool
+        :param stdin: subprocess.PIPE, file object or None (inherit)
+        :param stdout: subprocess.PIPE, file object or None (inherit)
+        :param stderr: subprocess.PIPE, file object or None (inherit)
+        :param env: environment variables (current if None)
+        :type env: typing.Optional[typing.Dict[str, typing.Any]]
+        :raises OSError: process creation failed
+        """
+        self.args = args
+        self.pid = None  # type: typing.Optional[int]
+        self.stdin = self.stdout = self.stderr = None
+        self.returncode = None  # type: typing.Optional[int]
+        # Same as subprocess.Popen: reactor reaps the process under it
+        self._waitpid_lock = threading.Lock()
+
+        file_actions = []
+        parent_fds = []  # Pipe ends for the parent process
+        child_fds = []  # Pipe ends, which should be closed after spawn
+        try:
+            for target, stream in enumerate((stdin, stdout, stderr)):
+                if stream is None:
+                    continue
+                if stream == subprocess.PIPE:
+                    read_fd, write_fd = os.pipe()
+                    if target == 0:
+                        parent_fd, child_fd = write_fd, read_fd
+                    else:
+                        parent_fd, child_fd = read_fd, write_fd
+                    parent_fds.append((target, parent_fd))
+                    child_fds.append(child_fd)
+                else:
+                    child_fd = stream.fileno()
+                # dup2 result is inheritable, source is closed on exec
+                file_actions.append((os.POSIX_SPAWN_DUP2, child_fd, target))
+
+            file_actions.extend(
+                (os.POSIX_SPAWN_CLOSE, descriptor)
+                for descriptor in _inheritable_fds()
+            )
+
+            argv = [args] if isinstance(args, (str, bytes)) else list(args)
+            if shell:
+                spawn, path, argv = _posix_spawn, _SHELL, [_SHELL, '-c'] + argv
+            elif env is not None and os.sep not in argv[0]:
+                # posix_spawnp searches PATH of the parent: use env like Popen
+                spawn, path = _posix_spawn, shutil.which(
+                    argv[0], path=env.get('PATH', os.defpath)
+                )
+                if path is None:
+                    raise OSError(
+                        errno.ENOENT, os.strerror(errno.ENOENT), argv[0]
+                    )
+            else:
+                spawn, path = _posix_spawnp, argv[0]
+
+            self.pid = spawn(
+                path,
+                argv,
+                os.environ if env is None else env,
+                file_actions=file_actions,
+                setsigdef=_DEFAULT_SIGNALS,
+            )
+        except BaseException:
+            for _, descriptor in parent_fds:
+                os.close(descriptor)
+            raise
+        finally:
+            for descriptor in child_fds:
+                os.close(descriptor)
+
+        for target, descriptor in parent_fds:
+            if target == 0:
+                self.stdin = os.fdopen(descriptor, 'wb')
+            elif target == 1:
+                self.stdout = os.fdopen(descriptor, 'rb')
+            else:
+                self.stderr = os.fdopen(descriptor, 'rb')
+
+    def __repr__(self):  # type: () -> str
+        """Representation for debug purposes."""
+        return '<{cls}: returncode: {rc} args: {args!r}>'.format(
+            cls=self.__class__.__name__,
+            rc=self.returncode,
+            args=self.args,
+        )
+
+    def __handle_status(self, status):  # type: (int) -> None
+        """Decode wait status to the return code like Popen.
+
+        :type status: int
+        """
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+
+    def poll(self):  # type: () -> typing.Optional[int]
+        """Check if child process has terminated.
+
+        :return: return code or None, if process is running
+        :rtype: typing.Optional[int]
+        :raises OSError: process is reaped outside of the process object
+                         (SIGCHLD is ignored): exit code is unknown (ECHILD)
+        """
+        if self.returncode is not None:
+            return self.returncode
+        if not self._waitpid_lock.acquire(False):
+            return None  # Other thread waits for the process
+        try:
+            if self.returncode is None:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+                if pid == self.pid:
+                    self.__handle_status(status)
+        finally:
+            self._waitpid_lock.release()
+        return self.returncode
+
+    def wait(
+        self,
+        timeout=None,  # type: typing.Optional[float]
+    ):  # type: (...) -> int
+        """Wait for child process to terminate.
+
+        :param timeout: timeout in seconds
+        :type timeout: typing.Optional[float]
+        :rtype: int
+        :raises subprocess.TimeoutExpired: timeout exceeded
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        delay = 0.0005
+        while self.poll() is None:
+            if deadline is not None and time.time() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        return self.returncode
+
+    def send_signal(self, sig):  # type: (int) -> None
+        """Send signal to the process, if it is running.
+
+        :type sig: int
+        """
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):  # type: () -> None
+        """Terminate the process with SIGTERM."""
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):  # type: () -> None
+        """Kill the process with SIGKILL."""
+        self.send_signal(signal.SIGKILL)
@@ -27,11 +27,13 @@ import concurrent.futures
 import copy
 import logging
 import platform
+import re
 import stat
 import sys
 import threading
 import time
 import typing
+import uuid
 import warnings
 
 import advanced_descriptors
@@ -71,6 +73,123 @@ _type_execute_async = typing.Tuple[
 
 CPYTHON = 'CPython' == platform.python_implementation()
 
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Remote resource usage report: GNU time format.
+# wall, user, system time; max RSS; fs inputs, outputs; context switches
+_USAGE_COMMAND = '/usr/bin/time -f {fmt} "${{SHELL:-/bin/sh}}" -c {command}'
+_USAGE_FORMAT = '{marker} %e %U %S %M %I %O %w %c'
+# Printed by GNU time before the report
+_USAGE_STATUS = re.compile(
+    br'^Command (exited with non-zero status|terminated by signal) \d+\n?$'
+)
+
+
+# Wait time for remote command end after kill signal
+_KILL_WAIT = 5
+
+
+def _signal_channel(
+    channel,  # type: paramiko.Channel
+    signal_name,  # type: str
+):  # type: (...) -> None
+    """Send signal to the remote command via channel request (RFC 4254).
+
+    Signal requests are supported by OpenSSH 7.9+ (except forced commands).
+    paramiko does not process exit-signal report: channel is closed
+    without exit status after the command is killed by signal.
+
+    :type channel: paramiko.Channel
+    :param signal_name: signal name without SIG prefix (KILL, TERM, ...)
+    :type signal_name: str
+    """
+    message = paramiko.Message()
+    message.add_byte(paramiko.common.cMSG_CHANNEL_REQUEST)
+    message.add_int(channel.remote_chanid)
+    message.add_string('signal')
+    message.add_boolean(False)
+    message.add_string(signal_name)
+    # pylint: disable=protected-access
+    channel.transport._send_user_message(message)
+    # pylint: enable=protected-access
+
+
+def _usage_command(command):  # type: (str) -> typing.Tuple[str, str]
+    """Wrap command by GNU time with unique report marker.
+
+    :param command: Command for execution
+    :type command: str
+    :return: report marker and command for remote execution
+    :rtype: typing.Tuple[str, str]
+    """
+    marker = '__exec_helpers_usage_{}__'.format(uuid.uuid4().hex)
+    return marker, _USAGE_COMMAND.format(
+        fmt=six.moves.shlex_quote(_USAGE_FORMAT.format(marker=marker)),
+        command=six.moves.shlex_quote(command),
+    )
+
+
+class _UsageReport(object):
+    """Remote resource usage report filter for STDERR.
+
+    Report line (and command status line of GNU time before it) is not
+    passed to the result.
+    """
+
+    __slots__ = ('__stream', '__marker', '__held', 'wall_time', 'usage')
+
+    def __init__(
+        self,
+        stream,  # type: paramiko.ChannelFile
+        marker,  # type: str
+    ):  # type: (...) -> None
+        """Remote resource usage report filter for STDERR.
+
+        :param stream: STDERR stream
+        :type stream: paramiko.ChannelFile
+        :param marker: unique report marker
+        :type marker: str
+        """
+        self.__stream = stream
+        self.__marker = marker.encode('ascii')
+        self.__held = None  # type: typing.Optional[bytes]
+        self.wall_time = None  # type: typing.Optional[float]
+        self.usage = None  # type: typing.Optional[exec_result.ResourceUsage]
+
+    def __iter__(self):  # type: () -> typing.Iterator[bytes]
+        """Read STDERR lines except the report."""
+        for line in self.__stream:
+            if line.startswith(self.__marker):
+                self.__held = None
+                self.__parse(line[len(self.__marker):].split())
+                continue
+            if self.__held is not None:
+                yield self.__held
+                self.__held = None
+            if _USAGE_STATUS.match(line):
+                self.__held = line
+                continue
+            yield line
+
+    def __parse(self, fields):  # type: (typing.List[bytes]) -> None
+        """Parse report fields."""
+        try:
+            wall, user, system = (float(field) for field in fields[:3])
+            counters = [int(field) for field in fields[3:8]]
+        except ValueError:  # pragma: no cover
+            logger.warning('Malformed resource usage report: %r', fields)
+            return
+        self.wall_time = wall
+        self.usage = exec_result.ResourceUsage(user, system, *counters)
+
+    def flush(self):  # type: () -> typing.List[bytes]
+        """Get held status line, if report is not received.
+
+        :rtype: typing.List[bytes]
+        """
+        held, self.__held = self.__held, None
+        return [held] if held is not None else []
+
 
 class _MemorizedSSH(type):
     """Memorize metaclass for SSHClient.
@@ -570,6 +689,17 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
         timeout,  # type: int
         verbose=False,  # type: bool
         log_mask_re=None,  # type: typing.Optional[str]
+        spill_threshold=None,  # type: typing.Optional[int]
+        max_output_lines=None,  # type: typing.Optional[int]
+        max_output_bytes=None,  # type: typing.Optional[int]
+        output_strategy='head+tail',  # type: str
+        stdout_json_callback=None,  # type: typing.Optional[typing.Callable]
+        record_timeline=False,  # type: bool
+        stop_on=None,  # type: exec_result._type_watch_patterns
+        fail_on=None,  # type: exec_result._type_watch_patterns
+        watch_action='kill',  # type: str
+        intern_lines=False,  # type: bool
+        usage_marker=None,  # type: typing.Optional[str]
     ):  # type: (...) -> exec_result.ExecResult
         """Get exit status from channel with timeout.
 
@@ -582,11 +712,60 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
         :param log_mask_re: regex lookup rule to mask command for logger.
                             all MATCHED groups will be replaced by '<*masked*>'
         :type log_mask_re: typing.Optional[str]
+        :param spill_threshold: output size in bytes per stream,
+                                after which output is stored in temporary file
+        :type spill_threshold: typing.Optional[int]
+        :param max_output_lines: maximum stored lines per stream
+        :type max_output_lines: typing.Optional[int]
+        :param max_output_bytes: maximum stored bytes per stream
+        :type max_output_bytes: typing.Optional[int]
+        :param output_strategy: part of output to keep if limits are set:
+                                'head', 'tail' or 'head+tail'
+        :type output_strategy: str
+        :param stdout_json_callback: callback for JSON records from stdout
+        :type stdout_json_callback: typing.Optional[typing.Callable]
+        :param record_timeline: record arrival time of output chunks
+        :type record_timeline: bool
+        :param stop_on: pattern(s) in output to stop waiting (expected state)
+        :type stop_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param fail_on: pattern(s) in output to stop waiting (failure)
+        :type fail_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param watch_action: action on pattern match: 'kill' (SIGKILL via
+                             channel, exit code is EX_SIGKILL if exit status
+                             is not received) or 'detach'
+        :type watch_action: str
+        :param intern_lines: store repeated output lines as single object
+        :type intern_lines: bool
+        :param usage_marker: marker of remote resource usage report in STDERR
+        :type usage_marker: typing.Optional[str]
         :rtype: ExecResult
         :raises ExecHelperTimeoutError: Timeout exceeded
+        :raises ValueError: unknown watch_action
 
         .. versionchanged:: 1.2.0 log_mask_re regex rule for masking cmd
+        .. versionchanged:: 1.2.0 spill_threshold for huge outputs
+        .. versionchanged:: 1.2.0 bounded output capture
+        .. versionchanged:: 1.2.0 stdout_json_callback for streaming JSON
+        .. versionchanged:: 1.2.0 record_timeline for output timeline
+        .. versionchanged:: 1.2.0 stop_on and fail_on output watchers
+        .. versionchanged:: 1.2.0 intern_lines for repeated lines
+        .. versionchanged:: 1.2.0 wall time and remote resource usage
         """
+        if watch_action not in constants.WATCH_ACTIONS:
+            raise ValueError(
+                'watch_action {!r} is not in {!r}'.format(
+                    watch_action, constants.WATCH_ACTIONS
+                )
+            )
+        started = _monotonic()
+        usage_report = None
+        if usage_marker is not None and stderr is not None:
+            stderr = usage_report = _UsageReport(stderr, usage_marker)
+
         def poll_streams(
             result,  # type: exec_result.ExecResult
             channel,  # type: paramiko.channel.Channel
@@ -613,6 +792,7 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             stderr,  # type:  paramiko.channel.ChannelFile
             result,  # type: exec_result.ExecResult
             stop,  # type: threading.Event
+            done,  # type: threading.Event
             channel  # type: paramiko.channel.Channel
         ):
             """Polling task for FIFO buffers.
@@ -621,6 +801,7 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             :type stderr: paramiko.channel.ChannelFile
             :type result: ExecResult
             :type stop: Event
+            :type done: Event
             :type channel: paramiko.channel.Channel
             """
             while not stop.isSet():
@@ -643,9 +824,20 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
                         log=self.logger,
                         verbose=verbose
                     )
+                    result.wall_time = _monotonic() - started
+                    if usage_report is not None:
+                        result.read_stderr(
+                            src=usage_report.flush(),
+                            log=self.logger,
+                            verbose=verbose
+                        )
+                        if usage_report.usage is not None:
+                            result.wall_time = usage_report.wall_time
+                            result.resource_usage = usage_report.usage
                     result.exit_code = channel.exit_status
 
                     stop.set()
+                    done.set()
 
         # channel.status_event.wait(timeout)
         cmd_for_log = self._mask_command(
@@ -653,10 +845,24 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             log_mask_re=log_mask_re
         )
 
-        # Store command with hidden data
-        result = exec_result.ExecResult(cmd=cmd_for_log)
-
         stop_event = threading.Event()
+        # Set on command end or on output watcher match
+        done_event = threading.Event()
+
+        # Store command with hidden data
+        result = exec_result.ExecResult(
+            cmd=cmd_for_log,
+            spill_threshold=spill_threshold,
+            max_output_lines=max_output_lines,
+            max_output_bytes=max_output_bytes,
+            output_strategy=output_strategy,
+            stdout_json_callback=stdout_json_callback,
+            record_timeline=record_timeline,
+            stop_on=stop_on,
+            fail_on=fail_on,
+            watch_callback=lambda _: done_event.set(),
+            intern_lines=intern_lines,
+        )
 
         # pylint: disable=assignment-from-no-return
         future = poll_pipes(
@@ -664,11 +870,12 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             stderr=stderr,
             result=result,
             stop=stop_event,
+            done=done_event,
             channel=channel
         )  # type: concurrent.futures.Future
         # pylint: enable=assignment-from-no-return
 
-        concurrent.futures.wait([future], timeout)
+        done_event.wait(timeout)
 
         # Process closed?
         if stop_event.isSet():
@@ -676,6 +883,20 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             channel.close()
             return result
 
+        if result.watch_match is not None:
+            if watch_action == 'detach':
+                # Polling continues until remote command end
+                return result
+            exit_code = self.__kill(channel)
+            stop_event.set()
+            concurrent.futures.wait([future], _KILL_WAIT)
+            channel.close()
+            with result.lock:
+                if not result.timestamp:  # Not finalized by polling
+                    result.wall_time = _monotonic() - started
+                    result.exit_code = exit_code
+            return result
+
         stop_event.set()
         channel.close()
         future.cancel()
@@ -687,6 +908,42 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
         self.logger.debug(wait_err_msg)
         raise exceptions.ExecHelperTimeoutError(wait_err_msg)
 
+    def __kill(
+        self,
+        channel,  # type: paramiko.channel.Channel
+    ):  # type: (...) -> typing.Union[int, proc_enums.ExitCodes]
+        """Kill remote command by SIGKILL and wait for its end.
+
+        Exit status is received, if command ends before signal.
+        Command killed by signal closes channel without exit status
+        (exit-signal is not supported by paramiko): EX_SIGKILL is reported.
+        If signal is not supported by server, channel is closed
+        (command gets hangup or end of input): EX_SIGHUP is reported.
+
+        :type channel: paramiko.channel.Channel
+        :return: exit status or code reported instead of it
+        :rtype: typing.Union[int, proc_enums.ExitCodes]
+        """
+        try:
+            _signal_channel(channel, 'KILL')
+        except (paramiko.SSHException, EOFError, EnvironmentError):
+            pass  # Transport is closed: channel end is not waited
+        deadline = _monotonic() + _KILL_WAIT
+        while not (
+            channel.status_event.is_set() or
+            channel.eof_received or
+            channel.closed
+        ) and _monotonic() < deadline:
+            channel.status_event.wait(0.1)
+        if channel.status_event.is_set():
+            return channel.exit_status
+        if channel.eof_received or channel.closed:
+            return proc_enums.ExitCodes.EX_SIGKILL
+        self.logger.warning(
+            'Remote command has not been stopped by signal: channel is closed'
+        )
+        return proc_enums.ExitCodes.EX_SIGHUP
+
     def execute(
         self,
         command,  # type: str
@@ -696,6 +953,11 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command and wait for return code.
 
+        With resource_usage=True keyword argument command is executed
+        via GNU time (/usr/bin/time is required on remote): remote wall time
+        and resource usage are stored to the result,
+        report is removed from STDERR.
+
         :param command: Command for execution
         :type command: str
         :param verbose: Produce log.info records for command call and output
@@ -706,14 +968,19 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
         :raises ExecHelperTimeoutError: Timeout exceeded
 
         .. versionchanged:: 1.2.0 default timeout 1 hour
+        .. versionchanged:: 1.2.0 resource_usage
         """
+        usage_marker = None
+        remote_command = command
+        if kwargs.pop('resource_usage', False):
+            usage_marker, remote_command = _usage_command(command)
         (
             chan,  # type: paramiko.channel.Channel
             _,
             stderr,  # type: paramiko.channel.ChannelFile
             stdout,  # type: paramiko.channel.ChannelFile
         ) = self.execute_async(
-            command,
+            remote_command,
             verbose=verbose,
             **kwargs
         )
@@ -722,6 +989,17 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             command, chan, stdout, stderr, timeout,
             verbose=verbose,
             log_mask_re=kwargs.get('log_mask_re', None),
+            spill_threshold=kwargs.get('spill_threshold', None),
+            max_output_lines=kwargs.get('max_output_lines', None),
+            max_output_bytes=kwargs.get('max_output_bytes', None),
+            output_strategy=kwargs.get('output_strategy', 'head+tail'),
+            stdout_json_callback=kwargs.get('stdout_json_callback', None),
+            record_timeline=kwargs.get('record_timeline', False),
+            stop_on=kwargs.get('stop_on', None),
+            fail_on=kwargs.get('fail_on', None),
+            watch_action=kwargs.get('watch_action', 'kill'),
+            intern_lines=kwargs.get('intern_lines', False),
+            usage_marker=usage_marker,
         )
         message = _log_templates.CMD_RESULT.format(result=result)
         self.logger.log(
@@ -743,6 +1021,10 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command on remote host through currently connected host.
 
+        With resource_usage=True keyword argument command is executed
+        via GNU time (/usr/bin/time is required on target),
+        same as for :py:meth:`execute`.
+
         :param hostname: target hostname
         :type hostname: str
         :param command: Command for execution
@@ -762,7 +1044,12 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
 
         .. versionchanged:: 1.2.0 default timeout 1 hour
         .. versionchanged:: 1.2.0 log_mask_re regex rule for masking cmd
+        .. versionchanged:: 1.2.0 resource_usage
         """
+        usage_marker = None
+        remote_command = command
+        if kwargs.pop('resource_usage', False):
+            usage_marker, remote_command = _usage_command(command)
         cmd_for_log = self._mask_command(
             cmd=command,
             log_mask_re=kwargs.get('log_mask_re', None)
@@ -798,12 +1085,23 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
         stdout = channel.makefile('rb')
         stderr = channel.makefile_stderr('rb')
 
-        channel.exec_command(command)  # nosec  # Sanitize on caller side
+        channel.exec_command(remote_command)  # nosec  # Sanitize on caller
 
         # noinspection PyDictCreation
         result = self.__exec_command(
             command, channel, stdout, stderr, timeout, verbose=verbose,
             log_mask_re=kwargs.get('log_mask_re', None),
+            spill_threshold=kwargs.get('spill_threshold', None),
+            max_output_lines=kwargs.get('max_output_lines', None),
+            max_output_bytes=kwargs.get('max_output_bytes', None),
+            output_strategy=kwargs.get('output_strategy', 'head+tail'),
+            stdout_json_callback=kwargs.get('stdout_json_callback', None),
+            record_timeline=kwargs.get('record_timeline', False),
+            stop_on=kwargs.get('stop_on', None),
+            fail_on=kwargs.get('fail_on', None),
+            watch_action=kwargs.get('watch_action', 'kill'),
+            intern_lines=kwargs.get('intern_lines', False),
+            usage_marker=usage_marker,
         )
 
         intermediate_channel.close()
@@ -822,6 +1120,10 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
     ):  # type: (...) -> _type_multiple_results
         """Execute command on multiple remotes in async mode.
 
+        With resource_usage=True keyword argument command is executed
+        via GNU time (/usr/bin/time is required on remotes),
+        same as for :py:meth:`execute`.
+
         :param remotes: Connections to execute on
         :type remotes: typing.Iterable[SSHClientBase]
         :param command: Command for execution
@@ -838,10 +1140,26 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             Unexpected any code at lest on one target
         :raises ParallelCallExceptions:
             At lest one exception raised during execution (including timeout)
+        :raises NotImplementedError: output watchers are set
 
         .. versionchanged:: 1.2.0 default timeout 1 hour
         .. versionchanged:: 1.2.0 log_mask_re regex rule for masking cmd
+        .. versionchanged:: 1.2.0 resource_usage
         """
+        # Output is read after the command end: watchers can not stop it
+        watchers = sorted(
+            set(kwargs) & {'stop_on', 'fail_on', 'watch_action'}
+        )
+        if watchers:
+            raise NotImplementedError(
+                'Output watchers are not supported by execute_together: '
+                '{}'.format(', '.join(watchers))
+            )
+        usage_marker = None
+        remote_command = command
+        if kwargs.pop('resource_usage', False):
+            usage_marker, remote_command = _usage_command(command)
+
         @threaded.threadpooled
         def get_result(
             remote  # type: SSHClientBase
@@ -852,7 +1170,9 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
                 _,
                 stderr,  # type: paramiko.channel.ChannelFile
                 stdout,  # type: paramiko.channel.ChannelFile
-            ) = remote.execute_async(command, **kwargs)
+            ) = remote.execute_async(remote_command, **kwargs)
+            if usage_marker is not None:
+                stderr = usage_report = _UsageReport(stderr, usage_marker)
 
             chan.status_event.wait(timeout)
             exit_code = chan.recv_exit_status()
@@ -864,9 +1184,23 @@ class SSHClientBase(six.with_metaclass(_MemorizedSSH, _api.ExecHelper)):
             )
             # pylint: enable=protected-access
 
-            result = exec_result.ExecResult(cmd=cmd_for_log)
+            result = exec_result.ExecResult(
+                cmd=cmd_for_log,
+                spill_threshold=kwargs.get('spill_threshold', None),
+                max_output_lines=kwargs.get('max_output_lines', None),
+                max_output_bytes=kwargs.get('max_output_bytes', None),
+                output_strategy=kwargs.get('output_strategy', 'head+tail'),
+                stdout_json_callback=kwargs.get('stdout_json_callback', None),
+                record_timeline=kwargs.get('record_timeline', False),
+                intern_lines=kwargs.get('intern_lines', False),
+            )
             result.read_stdout(src=stdout)
             result.read_stderr(src=stderr)
+            if usage_marker is not None:
+                result.read_stderr(src=usage_report.flush())
+                if usage_report.usage is not None:
+                    result.wall_time = usage_report.wall_time
+                    result.resource_usage = usage_report.usage
             result.exit_code = exit_code
 
             chan.close()
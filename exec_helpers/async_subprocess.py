@@ -0,0 +1,411 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""asyncio based subprocess helper (python 3.5+).
+
+.. versionadded:: 1.2.0
+"""
+
+import asyncio
+import logging
+import subprocess  # nosec  # Expected usage
+import time
+import typing  # noqa  # pylint: disable=unused-import
+
+from exec_helpers import _api
+from exec_helpers import constants
+from exec_helpers import exceptions
+from exec_helpers import exec_result
+from exec_helpers import proc_enums
+from exec_helpers import _log_templates
+from exec_helpers import _reactor
+
+__all__ = ('AsyncSubprocess',)
+
+logger = logging.getLogger(__name__)
+
+# Maximum data size for single stream read
+_READ_SIZE = 65536
+
+
+class AsyncSubprocess(_api.ExecHelper):
+    """asyncio based subprocess helper with timeouts.
+
+    Commands are executed without threads, so many commands can run
+    concurrently on one event loop. Methods are coroutines.
+    """
+
+    __slots__ = (
+        '__max_concurrency',
+        '__semaphore',
+    )
+
+    def __init__(
+        self,
+        log_mask_re=None,  # type: typing.Optional[str]
+        max_concurrency=None,  # type: typing.Optional[int]
+    ):
+        """asyncio based subprocess helper with timeouts.
+
+        :param log_mask_re: regex lookup rule to mask command for logger.
+                            all MATCHED groups will be replaced by '<*masked*>'
+        :type log_mask_re: typing.Optional[str]
+        :param max_concurrency: maximum simultaneous executions
+                                (not limited if None)
+        :type max_concurrency: typing.Optional[int]
+        :raises ValueError: max_concurrency is less than 1
+        """
+        super(AsyncSubprocess, self).__init__(
+            logger=logger,
+            log_mask_re=log_mask_re
+        )
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(
+                'max_concurrency should be positive, got {!r}'.format(
+                    max_concurrency
+                )
+            )
+        self.__max_concurrency = max_concurrency
+        # Created on the first use: semaphore is bound to the event loop
+        self.__semaphore = None  # type: typing.Optional[asyncio.Semaphore]
+
+    @property
+    def max_concurrency(self):  # type: () -> typing.Optional[int]
+        """Maximum simultaneous executions (not limited if None).
+
+        :rtype: typing.Optional[int]
+        """
+        return self.__max_concurrency
+
+    async def __read_stream(
+        self,
+        stream,  # type: asyncio.StreamReader
+        read,  # type: typing.Callable
+        verbose,  # type: bool
+    ):  # type: (...) -> None
+        """Read stream to the result until the end of data.
+
+        :param stream: process output stream
+        :type stream: asyncio.StreamReader
+        :param read: result method for received lines
+        :type read: typing.Callable
+        :type verbose: bool
+        """
+        splitter = _reactor.LineSplitter()
+        while True:
+            data = await stream.read(_READ_SIZE)
+            lines = splitter.feed(data) if data else splitter.flush()
+            if lines:
+                read(src=lines, log=self.logger, verbose=verbose)
+            if not data:
+                return
+
+    @staticmethod
+    async def __write_stdin(
+        process,  # type: asyncio.subprocess.Process
+        chunks,  # type: typing.Iterator[bytes]
+    ):  # type: (...) -> None
+        """Write stdin data chunks with flow control and close stdin.
+
+        On STDIN source failure process is killed and waited.
+
+        :type process: asyncio.subprocess.Process
+        :param chunks: STDIN data chunks
+        :type chunks: typing.Iterator[bytes]
+        """
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Process does not read stdin
+        except BaseException:
+            # STDIN source failed: process should not wait for data forever
+            try:
+                process.kill()  # kill -9
+            except ProcessLookupError:
+                pass  # Process has been completed
+            await process.wait()
+            raise
+        finally:
+            process.stdin.close()
+
+    async def __exec_command(
+        self,
+        command,  # type: _api._type_command
+        cwd=None,  # type: typing.Optional[str]
+        env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        verbose=False,  # type: bool
+        log_mask_re=None,  # type: typing.Optional[str]
+        stdin=None,  # type: _api._type_stdin
+        open_stdout=True,  # type: bool
+        open_stderr=True,  # type: bool
+        spill_threshold=None,  # type: typing.Optional[int]
+        max_output_lines=None,  # type: typing.Optional[int]
+        max_output_bytes=None,  # type: typing.Optional[int]
+        output_strategy='head+tail',  # type: str
+        stdout_json_callback=None,  # type: typing.Optional[typing.Callable]
+        record_timeline=False,  # type: bool
+        stop_on=None,  # type: exec_result._type_watch_patterns
+        fail_on=None,  # type: exec_result._type_watch_patterns
+        watch_action='kill',  # type: str
+        intern_lines=False,  # type: bool
+        shell=None,  # type: typing.Union[bool, str, None]
+    ):  # type: (...) -> exec_result.ExecResult
+        """Command executor helper.
+
+        Parameters are the same as for Subprocess.
+
+        :rtype: ExecResult
+        :raises ExecHelperTimeoutError: Timeout exceeded
+        :raises ValueError: unknown watch_action or shell mode
+        """
+        if watch_action not in constants.WATCH_ACTIONS:
+            raise ValueError(
+                'watch_action {!r} is not in {!r}'.format(
+                    watch_action, constants.WATCH_ACTIONS
+                )
+            )
+        args, use_shell = _api.resolve_command(command, shell)
+        chunks = None if stdin is None else _api.stdin_chunks(stdin)
+
+        cmd_for_log = self._mask_command(
+            cmd=_api.command_to_str(command),
+            log_mask_re=log_mask_re
+        )
+
+        # Set on output watcher match
+        matched = asyncio.Event()
+
+        # Store command with hidden data
+        result = exec_result.ExecResult(
+            cmd=cmd_for_log,
+            spill_threshold=spill_threshold,
+            max_output_lines=max_output_lines,
+            max_output_bytes=max_output_bytes,
+            output_strategy=output_strategy,
+            stdout_json_callback=stdout_json_callback,
+            record_timeline=record_timeline,
+            stop_on=stop_on,
+            fail_on=fail_on,
+            watch_callback=lambda _: matched.set(),
+            intern_lines=intern_lines,
+        )
+
+        self.logger.log(
+            level=logging.INFO if verbose else logging.DEBUG,
+            msg=_log_templates.CMD_EXEC.format(cmd=cmd_for_log)
+        )
+
+        started = time.monotonic()
+        kwargs = dict(
+            stdout=subprocess.PIPE if open_stdout else subprocess.DEVNULL,
+            stderr=subprocess.PIPE if open_stderr else subprocess.DEVNULL,
+            stdin=subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+        )
+        if use_shell:
+            process = await asyncio.create_subprocess_shell(args, **kwargs)
+        else:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args, **kwargs
+                )
+            except OSError:
+                if shell != 'auto':
+                    raise
+                # Not an executable (shell builtin, etc): use shell
+                process = await asyncio.create_subprocess_shell(
+                    command, **kwargs
+                )
+
+        tasks = []
+        if chunks is not None:
+            tasks.append(self.__write_stdin(process, chunks))
+        if open_stdout:
+            tasks.append(
+                self.__read_stream(process.stdout, result.read_stdout, verbose)
+            )
+        if open_stderr:
+            tasks.append(
+                self.__read_stream(process.stderr, result.read_stderr, verbose)
+            )
+
+        async def finish():  # type: () -> None
+            """Read output until the end of data and store exit code."""
+            await asyncio.gather(*tasks)
+            exit_code = await process.wait()
+            result.wall_time = time.monotonic() - started
+            result.exit_code = exit_code
+
+        finished = asyncio.ensure_future(finish())
+        watcher = asyncio.ensure_future(matched.wait())
+        try:
+            await asyncio.wait(
+                [finished, watcher],
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            watcher.cancel()
+
+        # Process closed?
+        if finished.done():
+            finished.result()  # Raise output processing error if any
+            return result
+
+        if result.watch_match is not None:
+            if watch_action == 'kill':
+                await self.__kill(process, finished)
+            # detach: reading continues until process end
+            return result
+
+        await self.__kill(process, finished)
+        wait_err_msg = _log_templates.CMD_WAIT_ERROR.format(
+            result=result,
+            timeout=timeout
+        )
+        self.logger.debug(wait_err_msg)
+        raise exceptions.ExecHelperTimeoutError(wait_err_msg)
+
+    async def __kill(
+        self,
+        process,  # type: asyncio.subprocess.Process
+        finished,  # type: asyncio.Future
+    ):  # type: (...) -> None
+        """Kill process and wait for exit code.
+
+        :type process: asyncio.subprocess.Process
+        :param finished: output reading and exit code task
+        :type finished: asyncio.Future
+        """
+        try:
+            process.kill()  # kill -9
+        except ProcessLookupError:
+            self.logger.warning(
+                "Process has been completed just after timeout: "
+                "please validate timeout."
+            )
+        # Pipes can be held open by background child processes
+        done, _ = await asyncio.wait([finished], timeout=5)
+        if not done:
+            finished.cancel()
+
+    async def execute(
+        self,
+        command,  # type: _api._type_command
+        verbose=False,  # type: bool
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        **kwargs
+    ):  # type: (...) -> exec_result.ExecResult
+        """Execute command and wait for return code.
+
+        :param command: Command for execution: string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
+        :param verbose: Produce log.info records for command call and output
+        :type verbose: bool
+        :param timeout: Timeout for command execution.
+        :type timeout: typing.Optional[int]
+        :rtype: ExecResult
+        :raises ExecHelperTimeoutError: Timeout exceeded
+        """
+        if self.__max_concurrency is not None and self.__semaphore is None:
+            self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        if self.__semaphore is not None:
+            async with self.__semaphore:
+                result = await self.__exec_command(
+                    command=command, timeout=timeout, verbose=verbose,
+                    **kwargs
+                )
+        else:
+            result = await self.__exec_command(
+                command=command, timeout=timeout, verbose=verbose, **kwargs
+            )
+        message = _log_templates.CMD_RESULT.format(result=result)
+        self.logger.log(
+            level=logging.INFO if verbose else logging.DEBUG,
+            msg=message
+        )
+        return result
+
+    async def check_call(
+        self,
+        command,  # type: _api._type_command
+        verbose=False,  # type: bool
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        error_info=None,  # type: typing.Optional[str]
+        expected=None,  # type: typing.Optional[typing.Iterable[int]]
+        raise_on_err=True,  # type: bool
+        **kwargs
+    ):  # type: (...) -> exec_result.ExecResult
+        """Execute command and check for return code.
+
+        :param command: Command for execution: string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
+        :param verbose: Produce log.info records for command call and output
+        :type verbose: bool
+        :param timeout: Timeout for command execution.
+        :type timeout: typing.Optional[int]
+        :param error_info: Text for error details, if fail happens
+        :type error_info: typing.Optional[str]
+        :param expected: expected return codes (0 by default)
+        :type expected: typing.Optional[typing.Iterable[int]]
+        :param raise_on_err: Raise exception on unexpected return code
+        :type raise_on_err: bool
+        :rtype: ExecResult
+        :raises ExecHelperTimeoutError: Timeout exceeded
+        :raises CalledProcessError: Unexpected exit code
+
+        .. versionchanged:: 1.2.0 exit code is not checked on stop_on match
+        """
+        expected = proc_enums.exit_codes_to_enums(expected)
+        ret = await self.execute(command, verbose, timeout, **kwargs)
+        self._check_exit_code(ret, error_info, expected, raise_on_err)
+        return ret
+
+    async def check_stderr(
+        self,
+        command,  # type: _api._type_command
+        verbose=False,  # type: bool
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        error_info=None,  # type: typing.Optional[str]
+        raise_on_err=True,  # type: bool
+        **kwargs
+    ):  # type: (...) -> exec_result.ExecResult
+        """Execute command expecting return code 0 and empty STDERR.
+
+        :param command: Command for execution: string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
+        :param verbose: Produce log.info records for command call and output
+        :type verbose: bool
+        :param timeout: Timeout for command execution.
+        :type timeout: typing.Optional[int]
+        :param error_info: Text for error details, if fail happens
+        :type error_info: typing.Optional[str]
+        :param raise_on_err: Raise exception on unexpected return code
+        :type raise_on_err: bool
+        :rtype: ExecResult
+        :raises ExecHelperTimeoutError: Timeout exceeded
+        :raises CalledProcessError: Unexpected exit code or stderr presents
+
+        .. note:: expected return codes can be overridden via kwargs.
+        """
+        ret = await self.check_call(
+            command, verbose, timeout=timeout,
+            error_info=error_info, raise_on_err=raise_on_err, **kwargs)
+        self._check_stderr(
+            ret, error_info, kwargs.get('expected'), raise_on_err)
+        return ret
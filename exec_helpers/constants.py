@@ -25,3 +25,6 @@ HOUR = 60 * MINUTE
 
 # Default command timeout
 DEFAULT_TIMEOUT = 1 * HOUR
+
+# Actions on output watcher match: kill command or leave it running
+WATCH_ACTIONS = ('kill', 'detach')
@@ -20,22 +20,686 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import array
+import binascii
+import codecs
+import collections
 import datetime
 import json
 import logging
+import re
+import struct
+import sys
 import threading
+import time
 import typing
 
 import six
-import yaml
 
 from exec_helpers import exceptions
+from exec_helpers import parsers
 from exec_helpers import proc_enums
+from exec_helpers import _output_buffer
 
-__all__ = ('ExecResult', )
+__all__ = ('ExecResult', 'OutputLines', 'OutputTimeline', 'ResourceUsage')
 
 logger = logging.getLogger(__name__)
+
+# Serialized ExecResult header: magic, format version, exit code,
+# timestamp in microseconds since epoch (-1 if not set),
+# cmd length and stdin length (-1 if not set)
+_HEADER = struct.Struct(str('!4sBqqQq'))
+_MAGIC = b'EXRS'
+_FORMAT_VERSION = 3
+# Version 2 has no optional fields section
+_FORMAT_VERSIONS = (2, 3)
+# Optional field after output buffers: tag and payload size.
+# Fields with unknown tags are skipped on restore.
+_FIELD = struct.Struct(str('!BQ'))
+_FIELD_TIMELINE = 1
+_FIELD_WATCH_MATCH = 2
+_FIELD_WALL_TIME = 3
+_FIELD_RESOURCE_USAGE = 4
+_WALL_TIME = struct.Struct(str('!d'))
+# CPU times, then counters in ResourceUsage fields order
+_RESOURCE_USAGE = struct.Struct(str('!2d5q'))
+# Watch match payload: kind and stream name sizes, then matched data
+_WATCH_MATCH = struct.Struct(str('!HH'))
+# Timeline payload: wall time and chunks count, then chunk records arrays
+_TIMELINE = struct.Struct(str('!dQ'))
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Monotonic clock is not available on python 2
+_monotonic = getattr(time, 'monotonic', time.time)
 _type_exit_codes = typing.Union[int, proc_enums.ExitCodes]
+_type_watch_patterns = typing.Union[
+    str, bytes, typing.Pattern, typing.Iterable, None
+]
+
+
+class _JSONStreamDecoder(object):
+    """Incremental decoder for NDJSON and JSON text sequences (RFC 7464).
+
+    Data is fed by chunks, record is decoded as soon as its line is complete.
+    Pretty printed (multi-line) values are accumulated until the line, which
+    starts from closing bracket.
+    """
+
+    __slots__ = ('__partial', '__pending')
+
+    def __init__(self):
+        """Incremental decoder for NDJSON and JSON text sequences."""
+        self.__partial = []  # type: typing.List[bytes]
+        self.__pending = []  # type: typing.List[bytes]
+
+    def __decode_pending(self):  # type: () -> typing.Tuple[bool, typing.Any]
+        """Try to decode accumulated record.
+
+        :return: decode success and decoded value
+        :rtype: typing.Tuple[bool, typing.Any]
+        """
+        text = b''.join(self.__pending).decode('utf-8', errors='replace')
+        try:
+            return True, json.loads(text)
+        except ValueError:
+            return False, None
+
+    def __flush(self):  # type: () -> typing.List[typing.Any]
+        """Decode accumulated record, it should be complete.
+
+        :rtype: typing.List[typing.Any]
+        :raises ValueError: accumulated data is not valid JSON
+        """
+        if not self.__pending:
+            return []
+        success, value = self.__decode_pending()
+        if not success:
+            text = b''.join(self.__pending)
+            self.__pending = []
+            raise ValueError('Not valid JSON record: {!r}'.format(text))
+        self.__pending = []
+        return [value]
+
+    def __feed_line(self, line):  # type: (bytes) -> typing.List[typing.Any]
+        """Process complete line.
+
+        :type line: bytes
+        :rtype: typing.List[typing.Any]
+        :raises ValueError: previous record is not valid JSON
+        """
+        records = []
+        if line.startswith(b'\x1e'):  # Record separator: new record started
+            records.extend(self.__flush())
+            line = line.lstrip(b'\x1e')
+        elif self.__pending and line[:1] in (b'{', b'['):
+            # New top level value started: previous one should be complete
+            records.extend(self.__flush())
+
+        if not self.__pending and not line.strip():
+            return records
+        self.__pending.append(line)
+        if len(self.__pending) == 1 or line[:1] in (b'}', b']'):
+            success, value = self.__decode_pending()
+            if success:
+                records.append(value)
+                self.__pending = []
+        return records
+
+    def feed(self, data):  # type: (bytes) -> typing.List[typing.Any]
+        """Feed data chunk and get decoded records.
+
+        :type data: bytes
+        :rtype: typing.List[typing.Any]
+        :raises ValueError: not valid JSON record found
+        """
+        records = []
+        start = 0
+        end = data.find(b'\n')
+        while end >= 0:
+            self.__partial.append(data[start:end + 1])
+            line = b''.join(self.__partial)
+            self.__partial = []
+            records.extend(self.__feed_line(line))
+            start = end + 1
+            end = data.find(b'\n', start)
+        if start < len(data):
+            self.__partial.append(data[start:])
+        return records
+
+    def close(self):  # type: () -> typing.List[typing.Any]
+        """Finish decoding: process not terminated data.
+
+        :rtype: typing.List[typing.Any]
+        :raises ValueError: not valid JSON record found
+        """
+        records = []
+        if self.__partial:
+            line = b''.join(self.__partial)
+            self.__partial = []
+            records.extend(self.__feed_line(line))
+        records.extend(self.__flush())
+        return records
+
+
+class _FrozenLock(object):
+    """No-op lock for finalized execution results: data is immutable."""
+
+    __slots__ = ()
+
+    def acquire(
+        self,
+        blocking=True,  # type: bool
+        timeout=-1,  # type: float
+    ):  # type: (...) -> bool
+        """Acquire: always succeeds immediately.
+
+        :rtype: bool
+        """
+        return True
+
+    def release(self):  # type: () -> None
+        """Release: nothing to do."""
+
+    def __enter__(self):  # type: () -> bool
+        """Context manager usage."""
+        return True
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Context manager usage."""
+
+
+_FROZEN_LOCK = _FrozenLock()
+
+
+class _TextView(object):
+    """Incrementally decoded text of single output stream.
+
+    Only new chunks are decoded on access: decoded parts are kept as list
+    and joined once per access with new data (text of finalized output
+    is joined and stripped once and cached).
+    Whitespace is stripped only at the view boundary.
+    """
+
+    __slots__ = ('__decoder', '__parts', '__position', '__cache')
+
+    __spaces = ' \t\n\r\x0b\x0c'
+
+    def __init__(self):
+        """Incrementally decoded text of single output stream."""
+        self.__decoder = self.__make_decoder()
+        self.__parts = []  # type: typing.List[str]
+        self.__position = 0  # Number of decoded chunks
+        # Size of decoded data and stripped text: replaced at once
+        self.__cache = None  # type: typing.Optional[typing.Tuple[int, str]]
+
+    @staticmethod
+    def __make_decoder():  # type: () -> codecs.IncrementalDecoder
+        """Create UTF-8 incremental decoder.
+
+        :rtype: codecs.IncrementalDecoder
+        """
+        return codecs.getincrementaldecoder('utf-8')(errors='backslashreplace')
+
+    def get(
+        self,
+        buffer  # type: _output_buffer.OutputBuffer
+    ):  # type: (...) -> str
+        """Get stripped text of buffer, decode only not decoded data.
+
+        For frozen buffer decoder state is not changed, so it is safe to call
+        without lock.
+
+        :type buffer: _output_buffer.OutputBuffer
+        :rtype: str
+        """
+        cache = self.__cache
+        if cache is not None and cache[0] == buffer.nbytes:
+            return cache[1]
+        if buffer.bounded:
+            # Stored chunks are shifted in the bounded buffer: full decode
+            text = codecs.decode(buffer.view(), 'utf-8', 'backslashreplace')
+        elif buffer.frozen:
+            decoder = self.__make_decoder()
+            decoder.setstate(self.__decoder.getstate())
+            parts = self.__parts[:]
+            parts.extend(
+                decoder.decode(chunk) for chunk in buffer[self.__position:]
+            )
+            parts.append(decoder.decode(b'', final=True))
+            text = ''.join(parts)
+        else:
+            count = len(buffer)
+            self.__parts.extend(
+                self.__decoder.decode(chunk)
+                for chunk in buffer[self.__position:count]
+            )
+            self.__position = count
+            # Incomplete character at the end is shown as escaped bytes
+            pending = self.__decoder.getstate()[0]
+            text = ''.join(self.__parts)
+            if pending:
+                text += pending.decode('utf-8', errors='backslashreplace')
+        view = text.strip(self.__spaces)
+        self.__cache = (buffer.nbytes, view)
+        return view
+
+
+class _OutputWatcher(object):
+    """Pattern watcher for output streams.
+
+    Pattern is searched in the rolling window: tail of previous data
+    is kept, so match on chunks boundary is found.
+    """
+
+    __slots__ = ('__kind', '__pattern', '__window', '__carry')
+
+    def __init__(
+        self,
+        kind,  # type: str
+        pattern,  # type: typing.Union[str, bytes, typing.Pattern]
+        window=4096,  # type: int
+    ):
+        """Pattern watcher for output streams.
+
+        :param kind: watcher kind: 'stop_on' or 'fail_on'
+        :type kind: str
+        :param pattern: text, binary or compiled regex
+        :type pattern: typing.Union[str, bytes, typing.Pattern]
+        :param window: size of kept previous data in bytes
+        :type window: int
+        """
+        if isinstance(pattern, six.text_type):
+            pattern = pattern.encode('utf-8')
+        if isinstance(pattern, six.binary_type):
+            pattern = re.compile(re.escape(pattern))
+        elif isinstance(pattern.pattern, six.text_type):
+            # Output is binary: text regex is converted
+            pattern = re.compile(
+                pattern.pattern.encode('utf-8'),
+                pattern.flags & ~re.UNICODE
+            )
+        self.__kind = kind
+        self.__pattern = pattern
+        self.__window = window
+        self.__carry = {}  # type: typing.Dict[int, bytes]
+
+    @property
+    def kind(self):  # type: () -> str
+        """Watcher kind: 'stop_on' or 'fail_on'.
+
+        :rtype: str
+        """
+        return self.__kind
+
+    def check(
+        self,
+        stream,  # type: int
+        chunk,  # type: bytes
+    ):  # type: (...) -> typing.Optional[bytes]
+        """Check new chunk of stream.
+
+        :param stream: OutputTimeline.STDOUT or OutputTimeline.STDERR
+        :type stream: int
+        :type chunk: bytes
+        :return: matched data if found
+        :rtype: typing.Optional[bytes]
+        """
+        data = self.__carry.get(stream, b'') + chunk
+        self.__carry[stream] = data[-self.__window:]
+        match = self.__pattern.search(data)
+        if match is not None:
+            return match.group(0)
+        return None
+
+
+class OutputLines(object):
+    """Lazy lines access for single output stream of execution result.
+
+    Lines are addressed using line starts index, so access to the part of
+    output does not join and decode full output.
+    Lines are returned decoded and without line terminators.
+    For bounded output (limits are set) only stored lines are accessible.
+
+    .. versionadded:: 1.2.0
+    """
+
+    __slots__ = ('__lock', '__buffer')
+
+    def __init__(
+        self,
+        lock,  # type: threading.RLock
+        buffer,  # type: _output_buffer.OutputBuffer
+    ):
+        """Lazy lines access for single output stream of execution result.
+
+        :param lock: execution result lock
+        :type lock: threading.RLock
+        :param buffer: output storage
+        :type buffer: _output_buffer.OutputBuffer
+        """
+        self.__lock = lock
+        self.__buffer = buffer
+
+    @staticmethod
+    def _decode(line):  # type: (bytes) -> str
+        """Decode line and strip line terminator.
+
+        :type line: bytes
+        :rtype: str
+        """
+        if line.endswith(b'\n'):
+            line = line[:-1]
+            if line.endswith(b'\r'):
+                line = line[:-1]
+        return line.decode('utf-8', errors='backslashreplace')
+
+    @property
+    def line_count(self):  # type: () -> int
+        """Number of accessible lines.
+
+        :rtype: int
+        """
+        with self.__lock:
+            return self.__buffer.stored_line_count
+
+    def __len__(self):  # type: () -> int
+        """Number of accessible lines."""
+        return self.line_count
+
+    def line(self, index):  # type: (int) -> str
+        """Get line by index.
+
+        :param index: line index, negative indexes are supported
+        :type index: int
+        :rtype: str
+        :raises IndexError: line index out of range
+        """
+        with self.__lock:
+            count = self.__buffer.stored_line_count
+            normalized = index + count if index < 0 else index
+            if not 0 <= normalized < count:
+                raise IndexError('Line index out of range')
+            return self._decode(
+                self.__buffer.get_lines(normalized, normalized + 1)[0]
+            )
+
+    def lines(
+        self,
+        key=None  # type: typing.Optional[slice]
+    ):  # type: (...) -> typing.List[str]
+        """Get lines by slice.
+
+        :param key: lines slice, all lines if None
+        :type key: typing.Optional[slice]
+        :rtype: typing.List[str]
+        """
+        if key is None:
+            key = slice(None)
+        with self.__lock:
+            start, stop, step = key.indices(self.__buffer.stored_line_count)
+            if step < 0:
+                # Reversed slice: read the covered range and reorder
+                start, stop = stop + 1, start + 1
+            lines = self.__buffer.get_lines(start, stop)
+        if step != 1:
+            lines = lines[::step] if step > 0 else lines[::-1][::-step]
+        return [self._decode(line) for line in lines]
+
+    def tail(self, count):  # type: (int) -> typing.List[str]
+        """Get last lines.
+
+        :param count: lines count
+        :type count: int
+        :rtype: typing.List[str]
+        """
+        if count <= 0:
+            return []
+        return self.lines(slice(-count, None))
+
+    def grep(
+        self,
+        pattern,  # type: typing.Union[str, bytes, typing.Pattern]
+    ):  # type: (...) -> typing.List[str]
+        """Get lines matching pattern.
+
+        Binary patterns are matched against raw lines, so only matched lines
+        are decoded.
+
+        :param pattern: regular expression
+        :type pattern: typing.Union[str, bytes, typing.Pattern]
+        :rtype: typing.List[str]
+        """
+        if isinstance(pattern, (six.text_type, six.binary_type)):
+            pattern = re.compile(pattern)
+        binary = isinstance(pattern.pattern, six.binary_type)
+        result = []
+        with self.__lock:
+            for line in self.__buffer.iter_lines():
+                if binary:
+                    if pattern.search(line.rstrip(b'\r\n')):
+                        result.append(self._decode(line))
+                    continue
+                decoded = self._decode(line)
+                if pattern.search(decoded):
+                    result.append(decoded)
+        return result
+
+    def __getitem__(
+        self,
+        item  # type: typing.Union[int, slice]
+    ):  # type: (...) -> typing.Union[str, typing.List[str]]
+        """Line by index or lines by slice."""
+        if isinstance(item, slice):
+            return self.lines(item)
+        return self.line(item)
+
+    def __iter__(self):  # type: () -> typing.Iterator[str]
+        """Iterate over lines."""
+        return iter(self.lines())
+
+
+class OutputTimeline(object):
+    """Arrival time of output chunks.
+
+    Chunk records (monotonic offset from result creation, stream, size)
+    are stored in compact arrays.
+
+    .. versionadded:: 1.2.0
+    """
+
+    __slots__ = ('__start', '__end', '__offsets', '__streams', '__sizes')
+
+    STDOUT = 0
+    STDERR = 1
+    _stream_names = ('stdout', 'stderr')
+
+    def __init__(self):
+        """Arrival time of output chunks."""
+        self.__start = _monotonic()
+        self.__end = None  # type: typing.Optional[float]
+        self.__offsets = array.array(str('d'))
+        self.__streams = array.array(str('B'))
+        self.__sizes = array.array(_output_buffer.OFFSET_TYPECODE)
+
+    def record(self, stream, size):  # type: (int, int) -> None
+        """Record chunk arrival.
+
+        :param stream: OutputTimeline.STDOUT or OutputTimeline.STDERR
+        :type stream: int
+        :param size: chunk size in bytes
+        :type size: int
+        """
+        self.__offsets.append(_monotonic() - self.__start)
+        self.__streams.append(stream)
+        self.__sizes.append(size)
+
+    def finish(self):  # type: () -> None
+        """Record exit code receive."""
+        self.__end = _monotonic() - self.__start
+
+    def __len__(self):  # type: () -> int
+        """Number of recorded chunks."""
+        return len(self.__offsets)
+
+    def __iter__(
+        self
+    ):  # type: () -> typing.Iterator[typing.Tuple[float, str, int]]
+        """Iterate over chunks records: (offset, stream name, size)."""
+        for offset, stream, size in zip(
+            self.__offsets, self.__streams, self.__sizes
+        ):
+            yield offset, self._stream_names[stream], size
+
+    @property
+    def wall_time(self):  # type: () -> float
+        """Time from result creation to exit code receive (or now).
+
+        :rtype: float
+        """
+        if self.__end is not None:
+            return self.__end
+        return _monotonic() - self.__start
+
+    @property
+    def time_to_first_byte(self):  # type: () -> typing.Optional[float]
+        """Time from result creation to first not empty chunk.
+
+        :rtype: typing.Optional[float]
+        """
+        for offset, size in zip(self.__offsets, self.__sizes):
+            if size:
+                return offset
+        return None
+
+    @property
+    def total_bytes(self):  # type: () -> int
+        """Total size of recorded chunks.
+
+        :rtype: int
+        """
+        return sum(self.__sizes)
+
+    @property
+    def throughput(self):  # type: () -> float
+        """Output throughput in bytes per second over wall time.
+
+        :rtype: float
+        """
+        wall_time = self.wall_time
+        if wall_time <= 0:
+            return 0.0
+        return self.total_bytes / wall_time
+
+    @property
+    def longest_silence(self):  # type: () -> float
+        """Longest time without output (including start and end gaps).
+
+        :rtype: float
+        """
+        previous = 0.0
+        longest = 0.0
+        for offset in self.__offsets:
+            longest = max(longest, offset - previous)
+            previous = offset
+        return max(longest, self.wall_time - previous)
+
+    def to_bytes(self):  # type: () -> bytes
+        """Serialize chunk records and wall time.
+
+        :rtype: bytes
+        """
+        count = len(self.__offsets)
+        return b''.join((
+            _TIMELINE.pack(self.wall_time, count),
+            struct.pack(str('!{}d').format(count), *self.__offsets),
+            struct.pack(str('!{}B').format(count), *self.__streams),
+            struct.pack(str('!{}Q').format(count), *self.__sizes),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):  # type: (bytes) -> OutputTimeline
+        """Restore timeline serialized by to_bytes: it is finished.
+
+        :param data: serialized timeline
+        :type data: bytes
+        :rtype: OutputTimeline
+        :raises ValueError: data is truncated or malformed
+        """
+        try:
+            wall_time, count = _TIMELINE.unpack_from(data)
+            offset = _TIMELINE.size
+            offsets = struct.unpack_from(
+                str('!{}d').format(count), data, offset
+            )
+            offset += 8 * count
+            streams = struct.unpack_from(
+                str('!{}B').format(count), data, offset
+            )
+            offset += count
+            sizes = struct.unpack_from(str('!{}Q').format(count), data, offset)
+        except struct.error as e:
+            raise ValueError('Malformed timeline data: {!s}'.format(e))
+        timeline = cls()
+        timeline.__offsets.extend(offsets)
+        timeline.__streams.extend(streams)
+        timeline.__sizes.extend(sizes)
+        timeline.__end = wall_time
+        return timeline
+
+    def __repr__(self):
+        """Representation for debugging."""
+        return (
+            '<{cls}(chunks={chunks}, bytes={nbytes}, '
+            'wall_time={wall_time:.3f})>'.format(
+                cls=self.__class__.__name__,
+                chunks=len(self),
+                nbytes=self.total_bytes,
+                wall_time=self.wall_time,
+            )
+        )
+
+
+class ResourceUsage(collections.namedtuple(str('ResourceUsage'), (
+    'user_time',
+    'system_time',
+    'max_rss',
+    'read_blocks',
+    'write_blocks',
+    'voluntary_switches',
+    'involuntary_switches',
+))):
+    """Resource usage of the command.
+
+    CPU time is in seconds, maximum resident set size is in KiB,
+    block I/O is counted in operations.
+    On Linux max_rss of the local command could include memory of the
+    parent process before exec, so small values are not precise.
+
+    .. versionadded:: 1.2.0
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_rusage(cls, rusage):  # type: (typing.Any) -> ResourceUsage
+        """Get resource usage from os.wait4 / resource.getrusage result.
+
+        :param rusage: resource.struct_rusage
+        :type rusage: typing.Any
+        :rtype: ResourceUsage
+        """
+        max_rss = rusage.ru_maxrss
+        if sys.platform == 'darwin':  # pragma: no cover
+            max_rss //= 1024  # Bytes on macOS
+        return cls(
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            max_rss=max_rss,
+            read_blocks=rusage.ru_inblock,
+            write_blocks=rusage.ru_oublock,
+            voluntary_switches=rusage.ru_nvcsw,
+            involuntary_switches=rusage.ru_nivcsw,
+        )
 
 
 class ExecResult(object):
@@ -44,8 +708,13 @@ class ExecResult(object):
     __slots__ = [
         '__cmd', '__stdin', '__stdout', '__stderr', '__exit_code',
         '__timestamp',
-        '__stdout_str', '__stderr_str', '__stdout_brief', '__stderr_brief',
-        '__lock'
+        '__stdout_text', '__stderr_text', '__stdout_brief', '__stderr_brief',
+        '__lock', '__update',
+        '__stdout_json_callback', '__stdout_json_decoder',
+        '__timeline',
+        '__watchers', '__watch_match', '__watch_callback',
+        '__parsed',
+        '__wall_time', '__resource_usage',
     ]
 
     def __init__(
@@ -54,7 +723,17 @@ class ExecResult(object):
         stdin=None,  # type: typing.Union[six.text_type, six.binary_type, None]
         stdout=None,  # type: typing.Optional[typing.Iterable[bytes]]
         stderr=None,  # type: typing.Optional[typing.Iterable[bytes]]
-        exit_code=proc_enums.ExitCodes.EX_INVALID  # type: _type_exit_codes
+        exit_code=proc_enums.ExitCodes.EX_INVALID,  # type: _type_exit_codes
+        spill_threshold=None,  # type: typing.Optional[int]
+        max_output_lines=None,  # type: typing.Optional[int]
+        max_output_bytes=None,  # type: typing.Optional[int]
+        output_strategy='head+tail',  # type: str
+        stdout_json_callback=None,  # type: typing.Optional[typing.Callable]
+        record_timeline=False,  # type: bool
+        stop_on=None,  # type: _type_watch_patterns
+        fail_on=None,  # type: _type_watch_patterns
+        watch_callback=None,  # type: typing.Optional[typing.Callable]
+        intern_lines=False,  # type: bool
     ):
         """Command execution result.
 
@@ -68,33 +747,110 @@ class ExecResult(object):
         :type stderr: typing.Optional[typing.Iterable[bytes]]
         :param exit_code: Exit code. If integer - try to convert to BASH enum.
         :type exit_code: typing.Union[int, proc_enums.ExitCodes]
+        :param spill_threshold: output size in bytes per stream,
+                                after which output is stored in temporary file
+        :type spill_threshold: typing.Optional[int]
+        :param max_output_lines: maximum stored lines per stream
+        :type max_output_lines: typing.Optional[int]
+        :param max_output_bytes: maximum stored bytes per stream
+        :type max_output_bytes: typing.Optional[int]
+        :param output_strategy: part of output to keep if limits are set:
+                                'head', 'tail' or 'head+tail'
+        :type output_strategy: str
+        :param stdout_json_callback: callback for JSON records from stdout,
+                                     called during reading (NDJSON/JSON-seq)
+        :type stdout_json_callback: typing.Optional[typing.Callable]
+        :param record_timeline: record arrival time of output chunks
+        :type record_timeline: bool
+        :param stop_on: pattern(s) in output, which mean expected state
+        :type stop_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param fail_on: pattern(s) in output, which mean failure
+        :type fail_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param watch_callback: called with result on the first pattern match
+        :type watch_callback: typing.Optional[typing.Callable]
+        :param intern_lines: store repeated lines as single object
+                             (not bounded in-memory output only)
+        :type intern_lines: bool
+        :raises ValueError: incorrect output strategy or storage options
+
+        .. versionchanged:: 1.2.0 spill_threshold for huge outputs
+        .. versionchanged:: 1.2.0 bounded output capture
+        .. versionchanged:: 1.2.0 stdout_json_callback for streaming JSON
+        .. versionchanged:: 1.2.0 record_timeline for output timeline
+        .. versionchanged:: 1.2.0 stop_on and fail_on output watchers
+        .. versionchanged:: 1.2.0 intern_lines for repeated lines
         """
-        self.__lock = threading.RLock()
+        self.__timeline = OutputTimeline() if record_timeline else None
+        self.__watchers = [
+            _OutputWatcher(kind, pattern)
+            for kind, patterns in (('fail_on', fail_on), ('stop_on', stop_on))
+            for pattern in self.__iter_patterns(patterns)
+        ]
+        self.__watch_match = None  # type: typing.Optional[typing.Tuple]
+        self.__watch_callback = watch_callback
+        self.__parsed = {}  # type: typing.Dict[str, typing.Any]
+        self.__wall_time = None  # type: typing.Optional[float]
+        self.__resource_usage = None  # type: typing.Optional[ResourceUsage]
+        if proc_enums.exit_code_to_enum(exit_code) == (
+            proc_enums.ExitCodes.EX_INVALID
+        ):
+            self.__lock = threading.RLock()
+            self.__update = threading.Condition(self.__lock)
+        else:  # Finalized on creation: lock is not required
+            self.__lock = None  # type: typing.Optional[threading.RLock]
+            self.__update = None  # type: typing.Optional[threading.Condition]
+        self.__stdout_json_callback = stdout_json_callback
+        self.__stdout_json_decoder = (
+            _JSONStreamDecoder() if stdout_json_callback is not None else None
+        )
 
         self.__cmd = cmd
         if stdin is not None and not isinstance(stdin, six.text_type):
             stdin = self._get_str_from_bin(stdin)
         self.__stdin = stdin
-        self.__stdout = tuple(stdout) if stdout is not None else ()
-        self.__stderr = tuple(stderr) if stderr is not None else ()
+        self.__stdout = _output_buffer.OutputBuffer(
+            stdout,
+            spill_threshold=spill_threshold,
+            max_lines=max_output_lines,
+            max_bytes=max_output_bytes,
+            strategy=output_strategy,
+            intern_chunks=intern_lines,
+        )
+        self.__stderr = _output_buffer.OutputBuffer(
+            stderr,
+            spill_threshold=spill_threshold,
+            max_lines=max_output_lines,
+            max_bytes=max_output_bytes,
+            strategy=output_strategy,
+            intern_chunks=intern_lines,
+        )
 
         self.__exit_code = None
         self.__timestamp = None
         self.exit_code = exit_code
 
         # By default is none:
-        self.__stdout_str = None
-        self.__stderr_str = None
+        self.__stdout_text = _TextView()
+        self.__stderr_text = _TextView()
         self.__stdout_brief = None
         self.__stderr_brief = None
 
     @property
-    def lock(self):  # type: () -> threading.RLock
+    def lock(self):  # type: () -> typing.Union[threading.RLock, _FrozenLock]
         """Lock object for thread-safe operation.
 
-        :rtype: threading.RLock
+        Finalized result is immutable, so no-op lock is returned for it.
+
+        :rtype: typing.Union[threading.RLock, _FrozenLock]
+
+        .. versionchanged:: 1.2.0 no-op lock for finalized result
         """
-        return self.__lock
+        lock = self.__lock
+        return lock if lock is not None else _FROZEN_LOCK
 
     @property
     def timestamp(self):  # type: () -> typing.Optional(datetime.datetime)
@@ -104,6 +860,58 @@ class ExecResult(object):
         """
         return self.__timestamp
 
+    @property
+    def timeline(self):  # type: () -> typing.Optional[OutputTimeline]
+        """Arrival time of output chunks, if recording is enabled.
+
+        :rtype: typing.Optional[OutputTimeline]
+
+        .. versionadded:: 1.2.0
+        """
+        return self.__timeline
+
+    @property
+    def wall_time(self):  # type: () -> typing.Optional[float]
+        """Command execution wall time in seconds (monotonic clock).
+
+        :rtype: typing.Optional[float]
+
+        .. versionadded:: 1.2.0
+        """
+        return self.__wall_time
+
+    @wall_time.setter
+    def wall_time(self, new_val):  # type: (float) -> None
+        """Command execution wall time.
+
+        :type new_val: float
+        :raises RuntimeError: exit code is already received
+        """
+        if self.timestamp:
+            raise RuntimeError('Exit code is already received.')
+        self.__wall_time = new_val
+
+    @property
+    def resource_usage(self):  # type: () -> typing.Optional[ResourceUsage]
+        """Resource usage of the command, if collected.
+
+        :rtype: typing.Optional[ResourceUsage]
+
+        .. versionadded:: 1.2.0
+        """
+        return self.__resource_usage
+
+    @resource_usage.setter
+    def resource_usage(self, new_val):  # type: (ResourceUsage) -> None
+        """Resource usage of the command.
+
+        :type new_val: ResourceUsage
+        :raises RuntimeError: exit code is already received
+        """
+        if self.timestamp:
+            raise RuntimeError('Exit code is already received.')
+        self.__resource_usage = new_val
+
     @staticmethod
     def _get_bytearray_from_array(
         src  # type: typing.Iterable[bytes]
@@ -116,12 +924,24 @@ class ExecResult(object):
         return bytearray(b''.join(src))
 
     @staticmethod
-    def _get_str_from_bin(src):  # type: (bytearray) -> str
+    def _get_str_from_bin(
+        src  # type: typing.Union[bytearray, memoryview]
+    ):  # type: (...) -> str
         """Join data in list to the string, with python 2&3 compatibility.
 
-        :type src: bytearray
+        :type src: typing.Union[bytearray, memoryview]
         :rtype: str
+
+        .. versionchanged:: 1.2.0 memoryview is decoded without copy
         """
+        if isinstance(src, memoryview):
+            spaces = b' \t\n\r\x0b\x0c'
+            start, end = 0, len(src)
+            while start < end and src[start:start + 1] in spaces:
+                start += 1
+            while end > start and src[end - 1:end] in spaces:
+                end -= 1
+            return codecs.decode(src[start:end], 'utf-8', 'backslashreplace')
         return src.strip().decode(
             encoding='utf-8',
             errors='backslashreplace'
@@ -139,6 +959,27 @@ class ExecResult(object):
             cls._get_bytearray_from_array(src)
         )
 
+    @classmethod
+    def __get_buffer_brief(
+        cls,
+        data  # type: _output_buffer.OutputBuffer
+    ):  # type: (...) -> str
+        """Get brief output with note about dropped data if any.
+
+        :type data: _output_buffer.OutputBuffer
+        :rtype: str
+        """
+        if not data.dropped_lines:
+            return cls._get_brief(data)
+        head, tail = data.brief_parts(3)
+        note = '... ({lines} lines, {size} bytes dropped)\n'.format(
+            lines=data.dropped_lines,
+            size=data.dropped_bytes
+        ).encode('utf-8')
+        return cls._get_str_from_bin(
+            cls._get_bytearray_from_array(head + (note,) + tail)
+        )
+
     @property
     def cmd(self):  # type: () -> str
         """Executed command.
@@ -160,27 +1001,43 @@ class ExecResult(object):
         """Stdout output as list of binaries.
 
         :rtype: typing.Tuple[bytes]
+
+        .. versionchanged:: 1.2.0 tuple is materialized lazily from buffer
         """
-        return self.__stdout
+        with self.lock:
+            return self.__stdout.as_tuple()
 
     @property
     def stderr(self):  # type: () -> typing.Tuple[bytes]
         """Stderr output as list of binaries.
 
         :rtype: typing.Tuple[bytes]
+
+        .. versionchanged:: 1.2.0 tuple is materialized lazily from buffer
         """
-        return self.__stderr
+        with self.lock:
+            return self.__stderr.as_tuple()
 
     @staticmethod
     def __poll_stream(
         src,  # type: typing.Iterable[bytes]
+        dst,  # type: _output_buffer.OutputBuffer
         log=None,  # type: typing.Optional[logging.Logger]
-        verbose=False  # type: bool
-    ):  # type: (...) -> typing.List[bytes]
-        dst = []
+        verbose=False,  # type: bool
+        on_chunk=None,  # type: typing.Optional[typing.Callable]
+        timeline=None,  # type: typing.Optional[OutputTimeline]
+        stream=OutputTimeline.STDOUT,  # type: int
+    ):  # type: (...) -> None
         try:
             for line in src:
-                dst.append(line)
+                if timeline is not None:
+                    size = dst.nbytes
+                    dst.append(line)
+                    timeline.record(stream, dst.nbytes - size)
+                else:
+                    dst.append(line)
+                if on_chunk is not None:
+                    on_chunk(line)
                 if log:
                     log.log(
                         level=logging.INFO if verbose else logging.DEBUG,
@@ -191,7 +1048,20 @@ class ExecResult(object):
                     )
         except IOError:
             pass
-        return dst
+
+    def __get_update(self):  # type: () -> threading.Condition
+        """Get data update condition of not finalized result.
+
+        Condition is dropped on finalization: reference should be kept
+        and exit code should be checked again under the lock.
+
+        :rtype: threading.Condition
+        :raises RuntimeError: exit code is already received
+        """
+        update = self.__update
+        if update is None or self.timestamp:
+            raise RuntimeError('Final exit code received.')
+        return update
 
     def read_stdout(
         self,
@@ -210,13 +1080,26 @@ class ExecResult(object):
 
         .. versionchanged:: 1.2.0 - src can be None
         """
-        if self.timestamp:
-            raise RuntimeError('Final exit code received.')
+        update = self.__get_update()
         if not src:
             return
-        with self.lock:
-            self.__stdout_str = self.__stdout_brief = None
-            self.__stdout += tuple(self.__poll_stream(src, log, verbose))
+        with update:
+            if self.timestamp:  # Finalized by other thread
+                raise RuntimeError('Final exit code received.')
+            self.__stdout_brief = None
+            self.__poll_stream(
+                src, self.__stdout, log, verbose,
+                on_chunk=(
+                    self.__on_stdout_chunk
+                    if (
+                        self.__stdout_json_decoder is not None or
+                        self.__watchers
+                    ) else None
+                ),
+                timeline=self.__timeline,
+                stream=OutputTimeline.STDOUT,
+            )
+            update.notify_all()
 
     def read_stderr(
         self,
@@ -235,65 +1118,177 @@ class ExecResult(object):
 
         .. versionchanged:: 1.2.0 - src can be None
         """
-        if self.timestamp:
-            raise RuntimeError('Final exit code received.')
+        update = self.__get_update()
         if not src:
             return
-        with self.lock:
-            self.__stderr_str = self.__stderr_brief = None
-            self.__stderr += tuple(self.__poll_stream(src, log, verbose))
+        with update:
+            if self.timestamp:  # Finalized by other thread
+                raise RuntimeError('Final exit code received.')
+            self.__stderr_brief = None
+            self.__poll_stream(
+                src, self.__stderr, log, verbose,
+                on_chunk=self.__on_stderr_chunk if self.__watchers else None,
+                timeline=self.__timeline,
+                stream=OutputTimeline.STDERR,
+            )
+            update.notify_all()
 
     @property
-    def stdout_bin(self):  # type: () -> bytearray
+    def stdout_bin(self):  # type: () -> typing.Union[bytearray, memoryview]
         """Stdout in binary format.
 
         Sometimes logging is used to log binary objects too (example: Session),
         and for debug purposes we can use this as data source.
-        :rtype: bytearray
+        :rtype: typing.Union[bytearray, memoryview]
+
+        .. versionchanged:: 1.2.0 read-only memoryview for spilled output
+        """
+        with self.lock:
+            if self.__stdout.spilled and self.__stdout.frozen:
+                return self.__stdout.view()
+            return bytearray(self.__stdout.join())
+
+    @property
+    def stdout_bytes(self):  # type: () -> bytes
+        """Stdout as single immutable binary.
+
+        For finalized result in-memory output is joined only once.
+
+        :rtype: bytes
+
+        .. versionadded:: 1.2.0
         """
         with self.lock:
-            return self._get_bytearray_from_array(self.stdout)
+            return self.__stdout.join()
 
     @property
-    def stderr_bin(self):  # type: () -> bytearray
+    def stdout_digest(self):  # type: () -> typing.Optional[str]
+        """Hex digest of received stdout (blake2b, sha256 on python 2).
+
+        Digest is calculated incrementally on data receive and covers
+        output dropped by limits.
+
+        :return: hex digest or None if unknown (restored and appended)
+        :rtype: typing.Optional[str]
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return _hex(self.__stdout.digest)
+
+    @property
+    def stderr_digest(self):  # type: () -> typing.Optional[str]
+        """Hex digest of received stderr (blake2b, sha256 on python 2).
+
+        Digest is calculated incrementally on data receive and covers
+        output dropped by limits.
+
+        :return: hex digest or None if unknown (restored and appended)
+        :rtype: typing.Optional[str]
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return _hex(self.__stderr.digest)
+
+    @property
+    def stdout_view(self):  # type: () -> memoryview
+        """Stdout as read-only memory view.
+
+        For finalized result no data is copied: view is made over cached
+        binary or over memory mapped file for spilled output.
+
+        :rtype: memoryview
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stdout.view()
+
+    @property
+    def stderr_bin(self):  # type: () -> typing.Union[bytearray, memoryview]
         """Stderr in binary format.
 
-        :rtype: bytearray
+        :rtype: typing.Union[bytearray, memoryview]
+
+        .. versionchanged:: 1.2.0 read-only memoryview for spilled output
+        """
+        with self.lock:
+            if self.__stderr.spilled and self.__stderr.frozen:
+                return self.__stderr.view()
+            return bytearray(self.__stderr.join())
+
+    @property
+    def stderr_bytes(self):  # type: () -> bytes
+        """Stderr as single immutable binary.
+
+        For finalized result in-memory output is joined only once.
+
+        :rtype: bytes
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stderr.join()
+
+    @property
+    def stderr_view(self):  # type: () -> memoryview
+        """Stderr as read-only memory view.
+
+        For finalized result no data is copied: view is made over cached
+        binary or over memory mapped file for spilled output.
+
+        :rtype: memoryview
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stderr.view()
+
+    @property
+    def spilled(self):  # type: () -> bool
+        """Output is stored in temporary file instead of memory.
+
+        :rtype: bool
+
+        .. versionadded:: 1.2.0
         """
         with self.lock:
-            return self._get_bytearray_from_array(self.stderr)
+            return self.__stdout.spilled or self.__stderr.spilled
 
     @property
     def stdout_str(self):  # type: () -> str
         """Stdout output as string.
 
         :rtype: str
+
+        .. versionchanged:: 1.2.0 only new data is decoded on access
         """
         with self.lock:
-            if self.__stdout_str is None:
-                self.__stdout_str = self._get_str_from_bin(self.stdout_bin)
-            return self.__stdout_str
+            return self.__stdout_text.get(self.__stdout)
 
     @property
     def stderr_str(self):  # type: () -> str
         """Stderr output as string.
 
         :rtype: str
+
+        .. versionchanged:: 1.2.0 only new data is decoded on access
         """
         with self.lock:
-            if self.__stderr_str is None:
-                self.__stderr_str = self._get_str_from_bin(self.stderr_bin)
-            return self.__stderr_str
+            return self.__stderr_text.get(self.__stderr)
 
     @property
     def stdout_brief(self):  # type: () -> str
         """Brief stdout output (mostly for exceptions).
 
         :rtype: str
+
+        .. versionchanged:: 1.2.0 amount of dropped output is reported
         """
         with self.lock:
             if self.__stdout_brief is None:
-                self.__stdout_brief = self._get_brief(self.stdout)
+                self.__stdout_brief = self.__get_buffer_brief(self.__stdout)
             return self.__stdout_brief
 
     @property
@@ -301,12 +1296,78 @@ class ExecResult(object):
         """Brief stderr output (mostly for exceptions).
 
         :rtype: str
+
+        .. versionchanged:: 1.2.0 amount of dropped output is reported
         """
         with self.lock:
             if self.__stderr_brief is None:
-                self.__stderr_brief = self._get_brief(self.stderr)
+                self.__stderr_brief = self.__get_buffer_brief(self.__stderr)
             return self.__stderr_brief
 
+    @property
+    def stdout_lines(self):  # type: () -> OutputLines
+        """Lazy lines access for stdout.
+
+        :rtype: OutputLines
+
+        .. versionadded:: 1.2.0
+        """
+        return OutputLines(self.lock, self.__stdout)
+
+    @property
+    def stderr_lines(self):  # type: () -> OutputLines
+        """Lazy lines access for stderr.
+
+        :rtype: OutputLines
+
+        .. versionadded:: 1.2.0
+        """
+        return OutputLines(self.lock, self.__stderr)
+
+    @property
+    def stdout_dropped_lines(self):  # type: () -> int
+        """Number of stdout lines dropped due to output limits.
+
+        :rtype: int
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stdout.dropped_lines
+
+    @property
+    def stderr_dropped_lines(self):  # type: () -> int
+        """Number of stderr lines dropped due to output limits.
+
+        :rtype: int
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stderr.dropped_lines
+
+    @property
+    def stdout_dropped_bytes(self):  # type: () -> int
+        """Number of stdout bytes dropped due to output limits.
+
+        :rtype: int
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stdout.dropped_bytes
+
+    @property
+    def stderr_dropped_bytes(self):  # type: () -> int
+        """Number of stderr bytes dropped due to output limits.
+
+        :rtype: int
+
+        .. versionadded:: 1.2.0
+        """
+        with self.lock:
+            return self.__stderr.dropped_bytes
+
     @property
     def exit_code(self):  # type: () -> typing.Union[int, proc_enums.ExitCodes]
         """Return(exit) code of command.
@@ -326,10 +1387,25 @@ class ExecResult(object):
             raise RuntimeError('Exit code is already received.')
         if not isinstance(new_val, six.integer_types):
             raise TypeError('Exit code is strictly int')
-        with self.lock:
+        update = self.__update  # None for result finalized on creation
+        with update if update is not None else _FROZEN_LOCK:
+            if self.timestamp:  # Finalized by other thread
+                raise RuntimeError('Exit code is already received.')
             self.__exit_code = proc_enums.exit_code_to_enum(new_val)
             if self.__exit_code != proc_enums.ExitCodes.EX_INVALID:
                 self.__timestamp = datetime.datetime.utcnow()
+                if self.__timeline is not None:
+                    self.__timeline.finish()
+                self.__stdout.freeze()
+                self.__stderr.freeze()
+                if self.__stdout_json_decoder is not None:
+                    self.__dispatch_stdout_json(
+                        self.__stdout_json_decoder.close
+                    )
+                if update is not None:
+                    update.notify_all()
+                # Read-only since now: drop lock for lock-free reads
+                self.__lock = self.__update = None
 
     def __deserialize(self, fmt):  # type: (str) -> typing.Any
         """Deserialize stdout as data format.
@@ -338,12 +1414,18 @@ class ExecResult(object):
         :rtype: object
         :raises NotImplementedError: fmt deserialization not implemented
         :raises DeserializeValueError: Not valid source format
+
+        .. versionchanged:: 1.2.0 parsers registry is used
         """
+        parser = parsers.get_parser(fmt)
+        if parser is None:
+            msg = '{fmt} deserialize target is not implemented'.format(
+                fmt=fmt
+            )
+            logger.error(msg)
+            raise NotImplementedError(msg)
         try:
-            if fmt == 'json':
-                return json.loads(self.stdout_str, encoding='utf-8')
-            elif fmt == 'yaml':
-                return yaml.safe_load(self.stdout_str)
+            return parser(self.stdout_str)
         except Exception:
             tmpl = (
                 " stdout is not valid {fmt}:\n"
@@ -353,35 +1435,267 @@ class ExecResult(object):
             raise exceptions.DeserializeValueError(
                 self.cmd + tmpl.format(stdout=self.stdout_brief)
             )
-        msg = '{fmt} deserialize target is not implemented'.format(fmt=fmt)
-        logger.error(msg)
-        raise NotImplementedError(msg)
+
+    def parse(self, name):  # type: (str) -> typing.Any
+        """Parse stdout using registered parser.
+
+        For finalized result parsed data is cached: the same object
+        is returned on each call, it is shared and should not be modified.
+
+        :param name: parser name (see exec_helpers.parsers.parser_names)
+        :type name: str
+        :rtype: typing.Any
+        :raises NotImplementedError: parser is not registered
+        :raises DeserializeValueError: Not valid source format
+
+        .. versionadded:: 1.2.0
+        """
+        parsed = self.__parsed
+        if name in parsed:
+            return parsed[name]
+        with self.lock:
+            value = self.__deserialize(fmt=name)
+            if self.timestamp is not None:
+                parsed[name] = value
+            return value
+
+    def __dispatch_stdout_json(
+        self,
+        decode,  # type: typing.Callable[..., typing.List[typing.Any]]
+        *args
+    ):  # type: (...) -> None
+        """Decode stdout data and pass records to callback.
+
+        Errors are logged only: reading should not be interrupted by consumer.
+
+        :param decode: decoder method
+        :type decode: typing.Callable[..., typing.List[typing.Any]]
+        """
+        try:
+            records = decode(*args)
+        except ValueError:
+            logger.exception(
+                '{cmd} stdout is not valid JSON stream'.format(cmd=self.cmd)
+            )
+            return
+        for record in records:
+            try:
+                self.__stdout_json_callback(record)
+            except Exception:
+                logger.exception(
+                    '{cmd} stdout JSON callback failed'.format(cmd=self.cmd)
+                )
+
+    def __on_stdout_chunk(self, chunk):  # type: (bytes) -> None
+        """Process new stdout chunk: streaming JSON and watchers.
+
+        :type chunk: bytes
+        """
+        chunk = _output_buffer.OutputBuffer._to_bytes(chunk)
+        if self.__stdout_json_decoder is not None:
+            self.__dispatch_stdout_json(
+                self.__stdout_json_decoder.feed,
+                chunk
+            )
+        if self.__watchers:
+            self.__watch(OutputTimeline.STDOUT, chunk)
+
+    def __on_stderr_chunk(self, chunk):  # type: (bytes) -> None
+        """Process new stderr chunk: watchers.
+
+        :type chunk: bytes
+        """
+        self.__watch(
+            OutputTimeline.STDERR,
+            _output_buffer.OutputBuffer._to_bytes(chunk)
+        )
+
+    @staticmethod
+    def __iter_patterns(
+        patterns  # type: _type_watch_patterns
+    ):  # type: (...) -> typing.Iterator
+        """Normalize single pattern or iterable of patterns.
+
+        :type patterns: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :rtype: typing.Iterator
+        """
+        if patterns is None:
+            return iter(())
+        if isinstance(
+            patterns, (six.text_type, six.binary_type)
+        ) or hasattr(patterns, 'search'):
+            return iter((patterns,))
+        return iter(patterns)
+
+    def __watch(self, stream, chunk):  # type: (int, bytes) -> None
+        """Check chunk by watchers, the first match is recorded only.
+
+        :type stream: int
+        :type chunk: bytes
+        """
+        if self.__watch_match is not None:
+            return
+        for watcher in self.__watchers:
+            matched = watcher.check(stream, chunk)
+            if matched is not None:
+                self.__watch_match = (
+                    watcher.kind,
+                    OutputTimeline._stream_names[stream],
+                    matched,
+                )
+                logger.debug(
+                    '{cmd} {stream} matched {kind} watcher: {match!r}'.format(
+                        cmd=self.cmd,
+                        stream=OutputTimeline._stream_names[stream],
+                        kind=watcher.kind,
+                        match=matched,
+                    )
+                )
+                if self.__watch_callback is not None:
+                    self.__watch_callback(self)
+                return
+
+    @property
+    def watch_match(
+        self
+    ):  # type: () -> typing.Optional[typing.Tuple[str, str, bytes]]
+        """The first output watchers match: (kind, stream name, matched data).
+
+        Kind is 'stop_on' or 'fail_on', stream name is 'stdout' or 'stderr'.
+
+        :rtype: typing.Optional[typing.Tuple[str, str, bytes]]
+
+        .. versionadded:: 1.2.0
+        """
+        return self.__watch_match
+
+    def iter_stdout_json(
+        self,
+        timeout=None  # type: typing.Optional[float]
+    ):  # type: (...) -> typing.Iterator[typing.Any]
+        """Iterate over JSON records from stdout (NDJSON or JSON-seq).
+
+        Records are decoded incrementally: for running command records are
+        yielded as soon as received. Iteration ends, when exit code received.
+        For bounded output only stored part is decoded after command end.
+
+        :param timeout: timeout for waiting of new data
+        :type timeout: typing.Optional[float]
+        :rtype: typing.Iterator[typing.Any]
+        :raises DeserializeValueError: Not valid JSON record
+        :raises ExecHelperTimeoutError: No new data received in time
+
+        .. versionadded:: 1.2.0
+        """
+        decoder = _JSONStreamDecoder()
+        index = 0
+        while True:
+            update = self.__update  # None for finalized result
+            with update if update is not None else _FROZEN_LOCK:
+                deadline = None if timeout is None else time.time() + timeout
+                while True:
+                    final = self.timestamp is not None
+                    available = len(self.__stdout)
+                    if final or (
+                        not self.__stdout.bounded and available > index
+                    ):
+                        break
+                    if deadline is None:
+                        update.wait()
+                        continue
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise exceptions.ExecHelperTimeoutError(
+                            'Wait for {cmd} stdout JSON records '
+                            'timed out after {timeout!s} seconds'.format(
+                                cmd=self.cmd,
+                                timeout=timeout
+                            )
+                        )
+                    update.wait(remaining)
+                chunks = self.__stdout[index:available]
+                index = available
+
+            try:
+                records = []
+                for chunk in chunks:
+                    records.extend(decoder.feed(chunk))
+                if final:
+                    records.extend(decoder.close())
+            except ValueError as e:
+                raise exceptions.DeserializeValueError(
+                    '{cmd} stdout is not valid JSON stream: {err!s}'.format(
+                        cmd=self.cmd,
+                        err=e
+                    )
+                )
+            for record in records:
+                yield record
+            if final:
+                return
+
+    @property
+    def stdout_ndjson(self):  # type: () -> typing.List[typing.Any]
+        """JSON records from stdout (NDJSON or JSON-seq).
+
+        :rtype: typing.List[typing.Any]
+        :raises DeserializeValueError: Not valid JSON record
+
+        .. versionadded:: 1.2.0
+        """
+        decoder = _JSONStreamDecoder()
+        try:
+            with self.lock:
+                records = []
+                for chunk in self.__stdout:
+                    records.extend(decoder.feed(chunk))
+            records.extend(decoder.close())
+            return records
+        except ValueError as e:
+            raise exceptions.DeserializeValueError(
+                '{cmd} stdout is not valid JSON stream: {err!s}'.format(
+                    cmd=self.cmd,
+                    err=e
+                )
+            )
 
     @property
     def stdout_json(self):  # type: () -> typing.Any
         """JSON from stdout.
 
         :rtype: object
+
+        .. versionchanged:: 1.2.0 cached for finalized result (shared)
         """
-        with self.lock:
-            return self.__deserialize(fmt='json')
+        return self.parse('json')
 
     @property
     def stdout_yaml(self):  # type: () -> typing.Any
         """YAML from stdout.
 
         :rtype: Union(list, dict, None)
+
+        .. versionchanged:: 1.2.0 libyaml loader if available, cached
+                             (shared)
         """
-        with self.lock:
-            return self.__deserialize(fmt='yaml')
+        return self.parse('yaml')
 
     def __dir__(self):
         """Override dir for IDE and as source for getitem checks."""
         return [
             'cmd', 'stdout', 'stderr', 'exit_code',
             'stdout_bin', 'stderr_bin',
+            'stdout_bytes', 'stderr_bytes', 'stdout_view', 'stderr_view',
+            'stdout_digest', 'stderr_digest',
             'stdout_str', 'stderr_str', 'stdout_brief', 'stderr_brief',
-            'stdout_json', 'stdout_yaml',
+            'stdout_json', 'stdout_yaml', 'stdout_ndjson',
+            'spilled', 'timeline', 'watch_match', 'compressed_size',
+            'wall_time', 'resource_usage',
+            'stdout_lines', 'stderr_lines',
+            'stdout_dropped_lines', 'stderr_dropped_lines',
+            'stdout_dropped_bytes', 'stderr_dropped_bytes',
             'lock'
         ]
 
@@ -422,8 +1736,250 @@ class ExecResult(object):
             )
         )
 
+    def compress(self, method='zlib'):  # type: (str) -> int
+        """Compress output of finalized result to reduce memory usage.
+
+        Output is decompressed on the first access.
+        Spilled output is not compressed: it is not stored in memory.
+
+        :param method: compression method: 'zlib' or 'lzma' (python 3)
+        :type method: str
+        :return: total compressed size of output
+        :rtype: int
+        :raises RuntimeError: exit code is not received
+        :raises ValueError: compression method is not supported
+
+        .. versionadded:: 1.2.0
+        """
+        if self.timestamp is None:
+            raise RuntimeError('Only finalized result can be compressed.')
+        sizes = [
+            self.__stdout.compress(method),
+            self.__stderr.compress(method),
+        ]
+        # Drop decoded text: it is decoded again from compressed data
+        self.__stdout_text = _TextView()
+        self.__stderr_text = _TextView()
+        return sum(size for size in sizes if size is not None)
+
+    @property
+    def compressed_size(self):  # type: () -> typing.Optional[int]
+        """Total compressed size of output or None if it is not compressed.
+
+        Output is decompressed on the first access.
+
+        :rtype: typing.Optional[int]
+
+        .. versionadded:: 1.2.0
+        """
+        sizes = [
+            size for size in (
+                self.__stdout.compressed_size,
+                self.__stderr.compressed_size,
+            ) if size is not None
+        ]
+        return sum(sizes) if sizes else None
+
+    def to_bytes(self):  # type: () -> bytes
+        """Serialize execution result to compact binary.
+
+        Layout: fixed size header, cmd and stdin in UTF-8, output buffers
+        as chunk lengths followed by data, so lines are not pickled one by one,
+        and optional fields (tag, size, payload) for set attributes only.
+        Callbacks and spill threshold are not serialized.
+
+        :rtype: bytes
+
+        .. versionadded:: 1.2.0
+        .. versionchanged:: 1.2.0 optional fields (format version 3)
+        """
+        with self.lock:
+            timestamp = -1
+            if self.timestamp is not None:
+                delta = self.timestamp - _EPOCH
+                timestamp = (
+                    (delta.days * 86400 + delta.seconds) * 1000000 +
+                    delta.microseconds
+                )
+            cmd = self.cmd.encode('utf-8')
+            stdin = (
+                self.stdin.encode('utf-8') if self.stdin is not None else b''
+            )
+            return b''.join((
+                _HEADER.pack(
+                    _MAGIC,
+                    _FORMAT_VERSION,
+                    int(self.exit_code),
+                    timestamp,
+                    len(cmd),
+                    len(stdin) if self.stdin is not None else -1,
+                ),
+                cmd,
+                stdin,
+                self.__stdout.to_bytes(),
+                self.__stderr.to_bytes(),
+            ) + tuple(
+                _FIELD.pack(tag, len(payload)) + payload
+                for tag, payload in self.__optional_fields()
+            ))
+
+    def __optional_fields(
+        self
+    ):  # type: () -> typing.Iterator[typing.Tuple[int, bytes]]
+        """Serialized optional fields, which are set: (tag, payload).
+
+        :rtype: typing.Iterator[typing.Tuple[int, bytes]]
+        """
+        if self.__timeline is not None:
+            yield _FIELD_TIMELINE, self.__timeline.to_bytes()
+        if self.__watch_match is not None:
+            kind, stream, matched = self.__watch_match
+            kind, stream = kind.encode('utf-8'), stream.encode('utf-8')
+            yield _FIELD_WATCH_MATCH, b''.join((
+                _WATCH_MATCH.pack(len(kind), len(stream)),
+                kind,
+                stream,
+                matched,
+            ))
+        if self.__wall_time is not None:
+            yield _FIELD_WALL_TIME, _WALL_TIME.pack(self.__wall_time)
+        if self.__resource_usage is not None:
+            yield (
+                _FIELD_RESOURCE_USAGE,
+                _RESOURCE_USAGE.pack(*self.__resource_usage)
+            )
+
+    def __restore_field(
+        self,
+        tag,  # type: int
+        payload,  # type: bytes
+    ):  # type: (...) -> None
+        """Restore optional field: unknown tags are skipped.
+
+        :type tag: int
+        :type payload: bytes
+        :raises ValueError: payload is malformed
+        """
+        if tag == _FIELD_TIMELINE:
+            self.__timeline = OutputTimeline.from_bytes(payload)
+        elif tag == _FIELD_WATCH_MATCH:
+            try:
+                kind_len, stream_len = _WATCH_MATCH.unpack_from(payload)
+            except struct.error as e:
+                raise ValueError('Malformed watch match data: {!s}'.format(e))
+            offset = _WATCH_MATCH.size
+            kind = payload[offset:offset + kind_len].decode('utf-8')
+            offset += kind_len
+            stream = payload[offset:offset + stream_len].decode('utf-8')
+            self.__watch_match = (kind, stream, payload[offset + stream_len:])
+        elif tag in (_FIELD_WALL_TIME, _FIELD_RESOURCE_USAGE):
+            try:
+                if tag == _FIELD_WALL_TIME:
+                    self.__wall_time, = _WALL_TIME.unpack(payload)
+                else:
+                    self.__resource_usage = ResourceUsage(
+                        *_RESOURCE_USAGE.unpack(payload)
+                    )
+            except struct.error as e:
+                raise ValueError(
+                    'Malformed execution result data: {!s}'.format(e)
+                )
+
+    @classmethod
+    def from_bytes(cls, data):  # type: (bytes) -> ExecResult
+        """Restore execution result serialized by to_bytes.
+
+        :param data: serialized execution result
+        :type data: bytes
+        :rtype: ExecResult
+        :raises ValueError: data is not serialized execution result
+
+        .. versionadded:: 1.2.0
+        .. versionchanged:: 1.2.0 optional fields (format version 3),
+                            format version 2 is supported
+        """
+        try:
+            (
+                magic, version, exit_code, timestamp, cmd_len, stdin_len
+            ) = _HEADER.unpack_from(data)
+        except struct.error as e:
+            raise ValueError(
+                'Malformed execution result data: {!s}'.format(e)
+            )
+        if magic != _MAGIC or version not in _FORMAT_VERSIONS:
+            raise ValueError(
+                'Not serialized execution result or unsupported version'
+            )
+        offset = _HEADER.size
+        cmd = data[offset:offset + cmd_len].decode('utf-8')
+        offset += cmd_len
+        stdin = None
+        if stdin_len >= 0:
+            stdin = data[offset:offset + stdin_len].decode('utf-8')
+            offset += stdin_len
+
+        result = cls(cmd=cmd, stdin=stdin)
+        result.__stdout, offset = _output_buffer.OutputBuffer.from_bytes(
+            data, offset
+        )
+        result.__stderr, offset = _output_buffer.OutputBuffer.from_bytes(
+            data, offset
+        )
+        if exit_code != proc_enums.ExitCodes.EX_INVALID:
+            result.exit_code = exit_code
+        while version >= 3 and offset < len(data):
+            try:
+                tag, size = _FIELD.unpack_from(data, offset)
+            except struct.error as e:
+                raise ValueError(
+                    'Malformed execution result data: {!s}'.format(e)
+                )
+            offset += _FIELD.size
+            if offset + size > len(data):
+                raise ValueError('Malformed execution result data: truncated')
+            result.__restore_field(tag, data[offset:offset + size])
+            offset += size
+        if timestamp >= 0:
+            result.__timestamp = _EPOCH + datetime.timedelta(
+                microseconds=timestamp
+            )
+        return result
+
+    def __reduce__(self):
+        """Pickle support: compact binary serialization.
+
+        .. versionadded:: 1.2.0
+        """
+        return _restore, (self.__class__, self.to_bytes())
+
+    def __digests(self):  # type: () -> typing.Optional[typing.Tuple]
+        """Output digests of finalized result.
+
+        :return: stdout and stderr digests or None if not applicable
+        :rtype: typing.Optional[typing.Tuple[bytes, bytes]]
+        """
+        if self.timestamp is None:
+            return None
+        digests = self.__stdout.digest, self.__stderr.digest
+        if None in digests:
+            return None
+        return digests
+
     def __eq__(self, other):
-        """Comparision."""
+        """Comparision.
+
+        .. versionchanged:: 1.2.0 finalized results are compared by digests
+        """
+        if isinstance(other, ExecResult):
+            digests = self.__digests()
+            # noinspection PyProtectedMember
+            other_digests = other._ExecResult__digests()
+            if digests is not None and other_digests is not None:
+                return (
+                    self.cmd == other.cmd and
+                    self.exit_code == other.exit_code and
+                    digests == other_digests
+                )
         return all(
             (
                 getattr(self, val) == getattr(other, val)
@@ -436,9 +1992,39 @@ class ExecResult(object):
         return not self.__eq__(other)
 
     def __hash__(self):
-        """Hash for usage as dict key and in sets."""
+        """Hash for usage as dict key and in sets.
+
+        .. versionchanged:: 1.2.0 finalized results are hashed by digests
+        """
+        digests = self.__digests()
+        if digests is not None:
+            return hash((self.__class__, self.cmd, digests, self.exit_code))
         return hash(
             (
                 self.__class__, self.cmd, self.stdout, self.stderr,
                 self.exit_code
             ))
+
+
+def _hex(digest):  # type: (typing.Optional[bytes]) -> typing.Optional[str]
+    """Digest as hex string.
+
+    :type digest: typing.Optional[bytes]
+    :rtype: typing.Optional[str]
+    """
+    if digest is None:
+        return None
+    return binascii.hexlify(digest).decode('ascii')
+
+
+def _restore(
+    cls,  # type: typing.Type[ExecResult]
+    data  # type: bytes
+):  # type: (...) -> ExecResult
+    """Restore pickled execution result.
+
+    :type cls: typing.Type[ExecResult]
+    :type data: bytes
+    :rtype: ExecResult
+    """
+    return cls.from_bytes(data)
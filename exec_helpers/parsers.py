@@ -0,0 +1,233 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Structured output parsers registry.
+
+Parser is callable, which receives text output and returns parsed data.
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import csv
+import json
+import typing  # noqa  # pylint: disable=unused-import
+
+import six
+import yaml
+
+__all__ = (
+    'register_parser',
+    'get_parser',
+    'parser_names',
+)
+
+# libyaml based loader is much faster, if available
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+_registry = {}  # type: typing.Dict[str, typing.Callable[[str], typing.Any]]
+
+
+def register_parser(
+    name,  # type: str
+    parser,  # type: typing.Callable[[str], typing.Any]
+    override=False  # type: bool
+):  # type: (...) -> None
+    """Register parser for ExecResult.parse.
+
+    :param name: parser name
+    :type name: str
+    :param parser: callable, which receives text and returns parsed data
+    :type parser: typing.Callable[[str], typing.Any]
+    :param override: replace already registered parser
+    :type override: bool
+    :raises ValueError: parser with the same name is already registered
+    """
+    if name in _registry and not override:
+        raise ValueError('Parser {!r} is already registered'.format(name))
+    _registry[name] = parser
+
+
+def get_parser(
+    name  # type: str
+):  # type: (...) -> typing.Optional[typing.Callable[[str], typing.Any]]
+    """Get registered parser.
+
+    :param name: parser name
+    :type name: str
+    :return: parser or None if not registered
+    :rtype: typing.Optional[typing.Callable[[str], typing.Any]]
+    """
+    return _registry.get(name)
+
+
+def parser_names():  # type: () -> typing.List[str]
+    """Names of registered parsers.
+
+    :rtype: typing.List[str]
+    """
+    return sorted(_registry)
+
+
+def _parse_json(text):  # type: (str) -> typing.Any
+    """Parse JSON.
+
+    :type text: str
+    :rtype: typing.Any
+    """
+    return json.loads(text)
+
+
+def _parse_yaml(text):  # type: (str) -> typing.Any
+    """Parse YAML document.
+
+    :type text: str
+    :rtype: typing.Any
+    """
+    return yaml.load(text, Loader=_YamlLoader)
+
+
+def _parse_yaml_all(text):  # type: (str) -> typing.List[typing.Any]
+    """Parse multi-document YAML.
+
+    :type text: str
+    :rtype: typing.List[typing.Any]
+    """
+    return list(yaml.load_all(text, Loader=_YamlLoader))
+
+
+def _read_csv(
+    text,  # type: str
+    delimiter  # type: str
+):  # type: (...) -> typing.List[typing.List[str]]
+    """Read CSV rows, empty rows are skipped.
+
+    :type text: str
+    :type delimiter: str
+    :rtype: typing.List[typing.List[str]]
+    """
+    lines = text.splitlines()
+    if six.PY2:  # pragma: no cover
+        # csv module in python 2 does not support unicode
+        reader = csv.reader(
+            [line.encode('utf-8') for line in lines],
+            delimiter=str(delimiter)
+        )
+        rows = [[cell.decode('utf-8') for cell in row] for row in reader]
+    else:
+        rows = list(csv.reader(lines, delimiter=delimiter))
+    return [row for row in rows if row]
+
+
+def _header_rows(
+    rows  # type: typing.List[typing.List[str]]
+):  # type: (...) -> typing.List[typing.Dict[str, str]]
+    """Convert rows to dicts using the first row as header.
+
+    :type rows: typing.List[typing.List[str]]
+    :rtype: typing.List[typing.Dict[str, str]]
+    """
+    if not rows:
+        return []
+    header = rows[0]
+    return [dict(zip(header, row)) for row in rows[1:]]
+
+
+def _parse_csv(text):  # type: (str) -> typing.List[typing.Dict[str, str]]
+    """Parse CSV with header.
+
+    :type text: str
+    :rtype: typing.List[typing.Dict[str, str]]
+    """
+    return _header_rows(_read_csv(text, ','))
+
+
+def _parse_tsv(text):  # type: (str) -> typing.List[typing.Dict[str, str]]
+    """Parse TSV with header.
+
+    :type text: str
+    :rtype: typing.List[typing.Dict[str, str]]
+    """
+    return _header_rows(_read_csv(text, '\t'))
+
+
+def _parse_kv(text):  # type: (str) -> typing.Dict[str, str]
+    """Parse key=value lines (os-release, env and similar).
+
+    Empty lines and comments are skipped, quotes around value are removed.
+
+    :type text: str
+    :rtype: typing.Dict[str, str]
+    :raises ValueError: line without '='
+    """
+    result = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '=' not in line:
+            raise ValueError('Not key=value line: {!r}'.format(line))
+        key, value = line.split('=', 1)
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        result[key.strip()] = value
+    return result
+
+
+def _parse_table(text):  # type: (str) -> typing.List[typing.Dict[str, str]]
+    """Parse whitespace separated table with header (ps, df and similar).
+
+    The last column value can contain whitespaces (like ps COMMAND).
+    The last column name can contain whitespaces (like df "Mounted on"):
+    if all rows have less fields, than header words, trailing header words
+    are joined.
+
+    :type text: str
+    :rtype: typing.List[typing.Dict[str, str]]
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    header = lines[0].split()
+    rows = lines[1:]
+    width = max([len(line.split()) for line in rows] or [len(header)])
+    if width < len(header):
+        header[width - 1:] = [' '.join(header[width - 1:])]
+    return [
+        dict(zip(header, line.split(None, len(header) - 1)))
+        for line in rows
+    ]
+
+
+def _parse_columns(text):  # type: (str) -> typing.List[typing.List[str]]
+    """Parse whitespace separated columns without header (ip -o and similar).
+
+    :type text: str
+    :rtype: typing.List[typing.List[str]]
+    """
+    return [line.split() for line in text.splitlines() if line.strip()]
+
+
+register_parser('json', _parse_json)
+register_parser('yaml', _parse_yaml)
+register_parser('yaml_all', _parse_yaml_all)
+register_parser('csv', _parse_csv)
+register_parser('tsv', _parse_tsv)
+register_parser('kv', _parse_kv)
+register_parser('table', _parse_table)
+register_parser('columns', _parse_columns)
@@ -0,0 +1,495 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Persistent local shell session (posix only).
+
+.. versionadded:: 1.2.0
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import concurrent.futures
+import io
+import logging
+import os
+import shutil
+import subprocess  # nosec  # Expected usage
+import tempfile
+import threading
+import time
+import typing  # noqa  # pylint: disable=unused-import
+import uuid
+
+import six
+
+from exec_helpers import _api
+from exec_helpers import constants
+from exec_helpers import exceptions
+from exec_helpers import exec_result
+from exec_helpers import _log_templates
+from exec_helpers import _reactor
+from exec_helpers import _spawn
+
+__all__ = ('ShellSession',)
+
+logger = logging.getLogger(__name__)
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# Command is executed via eval: syntax errors do not stop the shell.
+# Exit code is reported on stdout after the command end marker.
+# STDIN FIFO opening is reported on stderr before the command start.
+_SCRIPT = (
+    "{{ {opened}eval {command}; }} <{stdin}\n"
+    "printf '%s %d\\n' {marker} \"$?\"\n"
+    "printf '%s\\n' {marker} >&2\n"
+)
+
+# ExecResult options supported by the session: output storage only.
+# Process options (cwd, env, open_stdout, ...) and output watchers
+# can not be applied to a command running in the shared shell.
+_RESULT_OPTIONS = frozenset((
+    'spill_threshold',
+    'max_output_lines',
+    'max_output_bytes',
+    'output_strategy',
+    'stdout_json_callback',
+    'record_timeline',
+    'intern_lines',
+))
+
+
+class _Command(object):
+    """Running command state."""
+
+    __slots__ = (
+        'marker',
+        'stdin_marker',
+        'stdin_keeper',
+        'lock',
+        'result',
+        'verbose',
+        'exit_code',
+        'stdout_done',
+        'stderr_done',
+        'done',
+        'started',
+    )
+
+    def __init__(
+        self,
+        result,  # type: exec_result.ExecResult
+        verbose,  # type: bool
+    ):  # type: (...) -> None
+        """Running command state.
+
+        :type result: exec_result.ExecResult
+        :type verbose: bool
+        """
+        uid = uuid.uuid4().hex
+        self.marker = '__exec_helpers_{}__'.format(uid)
+        self.stdin_marker = '__exec_helpers_{}_stdin__'.format(uid)
+        # STDIN FIFO descriptor, which is opened until shell opens FIFO
+        self.stdin_keeper = None  # type: typing.Optional[int]
+        self.lock = threading.Lock()
+        self.result = result
+        self.verbose = verbose
+        self.exit_code = None  # type: typing.Optional[int]
+        self.stdout_done = False
+        self.stderr_done = False
+        self.done = threading.Event()
+        self.started = _monotonic()
+
+    def feed(
+        self,
+        lines,  # type: typing.List[bytes]
+        stderr,  # type: bool
+    ):  # type: (...) -> None
+        """Store output lines until the end marker.
+
+        Command output, which is not terminated by newline, is followed
+        by marker in the same line.
+
+        :type lines: typing.List[bytes]
+        :param stderr: lines are from stderr
+        :type stderr: bool
+        """
+        if self.stderr_done if stderr else self.stdout_done:
+            return  # Output of background jobs: nobody waits for it
+        marker = self.marker.encode('ascii')
+        stdin_marker = self.stdin_marker.encode('ascii')
+        output = []
+        for line in lines:
+            if stderr and self.stdin_keeper is not None:
+                pos = line.find(stdin_marker)
+                if pos != -1:  # Shell has opened STDIN FIFO
+                    line = line[:pos] + line[pos + len(stdin_marker) + 1:]
+                    self.release_stdin()
+                    if not line:
+                        continue
+            pos = line.find(marker)
+            if pos == -1:
+                output.append(line)
+                continue
+            if pos:
+                output.append(line[:pos])
+            if stderr:
+                self.stderr_done = True
+            else:
+                self.exit_code = int(line[pos + len(marker):])
+                self.stdout_done = True
+            break
+
+        if stderr:
+            self.result.read_stderr(
+                src=output, log=logger, verbose=self.verbose
+            )
+        else:
+            self.result.read_stdout(
+                src=output, log=logger, verbose=self.verbose
+            )
+        if self.stdout_done and self.stderr_done:
+            self.result.wall_time = _monotonic() - self.started
+            self.result.exit_code = self.exit_code
+            self.done.set()
+
+    def release_stdin(self):  # type: () -> None
+        """Close STDIN FIFO keeper: the end of data is sent on writing end."""
+        with self.lock:
+            keeper, self.stdin_keeper = self.stdin_keeper, None
+        if keeper is not None:
+            os.close(keeper)
+
+    def stdin_done(self, future):  # type: (concurrent.futures.Future) -> None
+        """Stop waiting for the command on STDIN data source failure.
+
+        :param future: STDIN writing future
+        :type future: concurrent.futures.Future
+        """
+        if future.exception() is not None:
+            self.done.set()
+
+
+class ShellSession(_api.ExecHelper):
+    """Persistent local shell session.
+
+    Commands are sent to the single long-lived shell process, so shell
+    state (working directory, variables) is shared between commands and
+    command execution does not start new process.
+    Commands of the session are executed sequentially.
+    """
+
+    __slots__ = (
+        '__shell',
+        '__cwd',
+        '__env',
+        '__process',
+        '__future',
+        '__command',
+    )
+
+    def __init__(
+        self,
+        log_mask_re=None,  # type: typing.Optional[str]
+        shell='/bin/bash',  # type: str
+        cwd=None,  # type: typing.Optional[str]
+        env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    ):  # type: (...) -> None
+        """Persistent local shell session.
+
+        Shell is started on the first command execution.
+
+        :param log_mask_re: regex lookup rule to mask command for logger.
+                            all MATCHED groups will be replaced by '<*masked*>'
+        :type log_mask_re: typing.Optional[str]
+        :param shell: shell executable
+        :type shell: str
+        :param cwd: initial working directory
+        :type cwd: typing.Optional[str]
+        :param env: environment variables dict
+        :type env: typing.Optional[typing.Dict[str, typing.Any]]
+        """
+        super(ShellSession, self).__init__(
+            logger=logger,
+            log_mask_re=log_mask_re
+        )
+        self.__shell = shell
+        self.__cwd = cwd
+        self.__env = env
+        self.__process = None  # type: typing.Optional[subprocess.Popen]
+        self.__future = None  # type: typing.Optional[typing.Any]
+        self.__command = None  # type: typing.Optional[_Command]
+
+    def __enter__(self):  # type: () -> ShellSession
+        """Context manager usage: session is closed on exit."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Context manager usage: close session."""
+        self.close()
+
+    def __del__(self):
+        """Destructor. Kill shell, if it running."""
+        process = self.__process
+        if process is not None and process.poll() is None:
+            try:
+                process.kill()
+            except OSError:  # pragma: no cover
+                pass  # Process has been completed
+
+    @property
+    def alive(self):  # type: () -> bool
+        """Shell process is running.
+
+        :rtype: bool
+        """
+        return self.__future is not None and not self.__future.done()
+
+    def __on_stdout(self, lines):  # type: (typing.List[bytes]) -> None
+        """Store stdout lines of running command."""
+        command = self.__command
+        if command is not None:
+            command.feed(lines, stderr=False)
+
+    def __on_stderr(self, lines):  # type: (typing.List[bytes]) -> None
+        """Store stderr lines of running command."""
+        command = self.__command
+        if command is not None:
+            command.feed(lines, stderr=True)
+
+    def __on_exit(self, _):  # type: (concurrent.futures.Future) -> None
+        """Finish running command on shell exit."""
+        command = self.__command
+        if command is not None:
+            command.done.set()
+
+    def __start(self):  # type: () -> None
+        """Start shell process."""
+        if _spawn.spawn_supported(cwd=self.__cwd):
+            process = _spawn.SpawnProcess(
+                args=[self.__shell],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=self.__env,
+            )
+        else:
+            process = subprocess.Popen(
+                args=[self.__shell],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.__cwd,
+                env=self.__env,
+                universal_newlines=False,
+            )
+        self.__process = process
+        self.__future = _reactor.get_reactor().register(
+            process,
+            on_stdout=self.__on_stdout,
+            on_stderr=self.__on_stderr,
+            on_exit=lambda exit_code, rusage: None,
+        )
+        self.__future.add_done_callback(self.__on_exit)
+
+    @staticmethod
+    def __stream_stdin(
+        running,  # type: _Command
+        path,  # type: str
+        chunks,  # type: typing.Iterator[bytes]
+    ):  # type: (...) -> concurrent.futures.Future
+        """Create FIFO and start writing of STDIN data to it.
+
+        FIFO is opened for reading and writing until the shell opens it,
+        so the shell does not wait for writer and data is not lost,
+        if it is written before the shell opens FIFO.
+
+        :param running: running command state
+        :type running: _Command
+        :param path: FIFO path
+        :type path: str
+        :param chunks: data chunks
+        :type chunks: typing.Iterator[bytes]
+        :return: writing future
+        :rtype: concurrent.futures.Future
+        """
+        os.mkfifo(path, 0o600)
+        running.stdin_keeper = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        pipe = io.open(
+            os.open(path, os.O_WRONLY | os.O_NONBLOCK), 'wb', buffering=0
+        )
+        writing = _reactor.get_reactor().write(pipe, chunks)
+        writing.add_done_callback(running.stdin_done)
+        return writing
+
+    def __kill(self):  # type: () -> None
+        """Kill shell process and wait for polling end."""
+        try:
+            self.__process.kill()  # kill -9
+        except OSError:  # pragma: no cover
+            pass  # Process has been completed
+        concurrent.futures.wait([self.__future], 5)
+        # Force stop polling if no exit code after kill
+        _reactor.get_reactor().unregister(self.__future)
+
+    def close(self):  # type: () -> None
+        """Close session: shell exits on the end of input."""
+        with self.lock:
+            if not self.alive:
+                return
+            try:
+                self.__process.stdin.close()
+            except (IOError, OSError):  # pragma: no cover
+                pass  # Shell has been completed
+            done, _ = concurrent.futures.wait([self.__future], 5)
+            if not done:
+                self.__kill()
+
+    def execute(
+        self,
+        command,  # type: _api._type_command
+        verbose=False,  # type: bool
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        **kwargs
+    ):  # type: (...) -> exec_result.ExecResult
+        """Execute command in the session and wait for return code.
+
+        Shell is started (or restarted, if it exited) on demand.
+        On timeout shell is killed: session state is lost.
+
+        :param command: Command for execution: string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
+        :param verbose: Produce log.info records for command call and output
+        :type verbose: bool
+        :param timeout: Timeout for command execution.
+        :type timeout: typing.Optional[int]
+        :rtype: ExecResult
+        :raises ExecHelperTimeoutError: Timeout exceeded
+        :raises NotImplementedError: option is not supported by the session
+        """
+        result = self.__exec_command(
+            command=command, timeout=timeout, verbose=verbose, **kwargs
+        )
+        message = _log_templates.CMD_RESULT.format(result=result)
+        self.logger.log(
+            level=logging.INFO if verbose else logging.DEBUG,
+            msg=message
+        )
+        return result
+
+    def __exec_command(
+        self,
+        command,  # type: _api._type_command
+        timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
+        verbose=False,  # type: bool
+        log_mask_re=None,  # type: typing.Optional[str]
+        stdin=None,  # type: _api._type_stdin
+        **kwargs
+    ):  # type: (...) -> exec_result.ExecResult
+        """Command executor helper.
+
+        :type command: typing.Union[str, typing.Sequence[str]]
+        :type timeout: typing.Optional[int]
+        :param verbose: use INFO log level instead of DEBUG
+        :type verbose: bool
+        :param log_mask_re: regex lookup rule to mask command for logger.
+                            all MATCHED groups will be replaced by '<*masked*>'
+        :type log_mask_re: typing.Optional[str]
+        :param stdin: STDIN data, file object, path or iterable of chunks
+        :type stdin: typing.Union[
+            str, bytes, bytearray, typing.IO, os.PathLike, typing.Iterable
+        ]
+        :param kwargs: ExecResult output storage options
+                       (spill_threshold, max_output_lines, etc.)
+        :rtype: ExecResult
+        :raises NotImplementedError: option is not supported by the session
+        """
+        unsupported = sorted(set(kwargs) - _RESULT_OPTIONS)
+        if unsupported:
+            raise NotImplementedError(
+                'Options are not supported by ShellSession: {}'.format(
+                    ', '.join(unsupported)
+                )
+            )
+        command = _api.command_to_str(command)
+        chunks = None if stdin is None else _api.stdin_chunks(stdin)
+        cmd_for_log = self._mask_command(
+            cmd=command,
+            log_mask_re=log_mask_re
+        )
+        result = exec_result.ExecResult(cmd=cmd_for_log, **kwargs)
+
+        with self.lock:
+            self.logger.log(
+                level=logging.INFO if verbose else logging.DEBUG,
+                msg=_log_templates.CMD_EXEC.format(cmd=cmd_for_log)
+            )
+            running = _Command(result=result, verbose=verbose)
+            stdin_dir = writing = None
+            stdin_path, opened = os.devnull, ''
+            try:
+                if chunks is not None:
+                    # Shell stdin carries commands: data is streamed via FIFO
+                    stdin_dir = tempfile.mkdtemp(prefix='exec_helpers_')
+                    stdin_path = os.path.join(stdin_dir, 'stdin')
+                    writing = self.__stream_stdin(running, stdin_path, chunks)
+                    opened = "printf '%s\\n' {} >&2; ".format(
+                        running.stdin_marker
+                    )
+                script = _SCRIPT.format(
+                    opened=opened,
+                    command=six.moves.shlex_quote(command),
+                    stdin=six.moves.shlex_quote(stdin_path),
+                    marker=running.marker,
+                )
+                if not self.alive:
+                    self.__start()
+                self.__command = running
+                try:
+                    self.__process.stdin.write(script.encode('utf-8'))
+                    self.__process.stdin.flush()
+                except (IOError, OSError):
+                    pass  # Shell has been exited: exit code is used
+                running.done.wait(timeout)
+            finally:
+                self.__command = None
+                if writing is not None:
+                    _reactor.get_reactor().unregister(writing)
+                running.release_stdin()
+                if stdin_dir is not None:
+                    shutil.rmtree(stdin_dir)
+
+            if writing is not None and writing.done() and writing.exception():
+                # Data source failure: command can wait for data
+                if running.exit_code is None and self.alive:
+                    self.__kill()
+                writing.result()
+
+            if running.done.is_set():
+                if running.exit_code is None:  # Shell exited
+                    concurrent.futures.wait([self.__future], 5)
+                    result.wall_time = _monotonic() - running.started
+                    result.exit_code = self.__process.returncode
+                return result
+
+            self.__kill()
+
+        wait_err_msg = _log_templates.CMD_WAIT_ERROR.format(
+            result=result,
+            timeout=timeout
+        )
+        self.logger.debug(wait_err_msg)
+        raise exceptions.ExecHelperTimeoutError(wait_err_msg)
@@ -21,9 +21,10 @@ from __future__ import division
 from __future__ import unicode_literals
 
 import collections
+import concurrent.futures
+import functools
 import logging
 import os
-import select
 import sys
 import subprocess  # nosec  # Expected usage
 import threading
@@ -38,12 +39,17 @@ from exec_helpers import constants
 from exec_helpers import exec_result
 from exec_helpers import exceptions
 from exec_helpers import proc_enums
+from exec_helpers import shell_session
+from exec_helpers import _limits
 from exec_helpers import _log_templates
+from exec_helpers import _reactor
+from exec_helpers import _spawn
 
 logger = logging.getLogger(__name__)
 # noinspection PyUnresolvedReferences
 devnull = open(os.devnull)  # subprocess.DEVNULL is py3.3+
 
+_monotonic = getattr(time, 'monotonic', time.time)
 _win = sys.platform == "win32"
 _posix = 'posix' in sys.builtin_module_names
 _type_exit_codes = typing.Union[int, proc_enums.ExitCodes]
@@ -127,55 +133,159 @@ class Subprocess(six.with_metaclass(SingletonMeta, _api.ExecHelper)):
     """Subprocess helper with timeouts and lock-free FIFO."""
 
     __slots__ = (
-        '__process',
+        '__state',
+        '__processes',
+        '__running',
+        '__max_concurrency',
     )
 
     def __init__(
         self,
         log_mask_re=None,  # type: typing.Optional[str]
+        max_concurrency=None,  # type: typing.Optional[int]
     ):
         """Subprocess helper with timeouts and lock-free FIFO.
 
-        For excluding race-conditions we allow to run 1 command simultaneously
+        Each execution owns its process, so commands can be executed
+        from multiple threads simultaneously.
+        Helper is singleton: arguments are used on the first creation only,
+        concurrency limit can be changed via max_concurrency property.
 
         :param log_mask_re: regex lookup rule to mask command for logger.
                             all MATCHED groups will be replaced by '<*masked*>'
         :type log_mask_re: typing.Optional[str]
+        :param max_concurrency: maximum simultaneous executions
+                                (not limited if None)
+        :type max_concurrency: typing.Optional[int]
+        :raises ValueError: max_concurrency is less than 1
 
         .. versionchanged:: 1.2.0 log_mask_re regex rule for masking cmd
+        .. versionchanged:: 1.2.0 simultaneous executions, max_concurrency
         """
         super(Subprocess, self).__init__(
             logger=logger,
             log_mask_re=log_mask_re
         )
-        self.__process = None
+        # Guards running processes registry and executions counter
+        self.__state = threading.Condition(threading.Lock())
+        # Running process -> ident of thread, which started it
+        self.__processes = {}  # type: typing.Dict[subprocess.Popen, int]
+        self.__running = 0
+        self.__max_concurrency = None  # type: typing.Optional[int]
+        self.max_concurrency = max_concurrency
+
+    @property
+    def max_concurrency(self):  # type: () -> typing.Optional[int]
+        """Maximum simultaneous executions (not limited if None).
+
+        :rtype: typing.Optional[int]
+
+        .. versionadded:: 1.2.0
+        """
+        return self.__max_concurrency
+
+    @max_concurrency.setter
+    def max_concurrency(self, value):  # type: (typing.Optional[int]) -> None
+        """Set maximum simultaneous executions.
+
+        :type value: typing.Optional[int]
+        :raises ValueError: value is less than 1
+        """
+        if value is not None and value < 1:
+            raise ValueError(
+                'max_concurrency should be positive, got {!r}'.format(value)
+            )
+        with self.__state:
+            self.__max_concurrency = value
+            self.__state.notify_all()
+
+    def __acquire_slot(self):  # type: () -> None
+        """Wait for execution slot according to the concurrency limit."""
+        with self.__state:
+            while (
+                self.__max_concurrency is not None and
+                self.__running >= self.__max_concurrency
+            ):
+                self.__state.wait()
+            self.__running += 1
+
+    def __release_slot(
+        self,
+        process  # type: typing.Optional[subprocess.Popen]
+    ):  # type: (...) -> None
+        """Release execution slot and forget process.
+
+        :type process: typing.Optional[subprocess.Popen]
+        """
+        with self.__state:
+            self.__running -= 1
+            self.__processes.pop(process, None)
+            self.__state.notify()
+
+    def __kill_running(
+        self,
+        thread_ident=None  # type: typing.Optional[int]
+    ):  # type: (...) -> None
+        """Kill running processes.
+
+        :param thread_ident: kill only processes started by this thread
+        :type thread_ident: typing.Optional[int]
+        """
+        with self.__state:
+            processes = [
+                process for process, owner in self.__processes.items()
+                if thread_ident is None or owner == thread_ident
+            ]
+        for process in processes:
+            try:
+                process.kill()
+            except OSError:  # pragma: no cover
+                pass  # Process has been completed
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        """Context manager usage."""
-        if self.__process:
-            self.__process.kill()
+        """Context manager usage.
+
+        .. versionchanged:: 1.2.0 processes of other threads are not killed
+        """
+        self.__kill_running(threading.current_thread().ident)
         super(Subprocess, self).__exit__(exc_type, exc_val, exc_tb)
 
     def __del__(self):
-        """Destructor. Kill running subprocess, if it running."""
-        if self.__process:
-            self.__process.kill()
+        """Destructor. Kill running subprocesses, if it running."""
+        self.__kill_running()
 
     def __exec_command(
         self,
-        command,  # type: str
+        command,  # type: _api._type_command
         cwd=None,  # type: typing.Optional[str]
         env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
         timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
         verbose=False,  # type: bool
         log_mask_re=None,  # type: typing.Optional[str]
-        stdin=None,  # type: typing.Union[six.text_type, six.binary_type, None]
+        stdin=None,  # type: _api._type_stdin
         open_stdout=True,  # type: bool
         open_stderr=True,  # type: bool
+        spill_threshold=None,  # type: typing.Optional[int]
+        max_output_lines=None,  # type: typing.Optional[int]
+        max_output_bytes=None,  # type: typing.Optional[int]
+        output_strategy='head+tail',  # type: str
+        stdout_json_callback=None,  # type: typing.Optional[typing.Callable]
+        record_timeline=False,  # type: bool
+        stop_on=None,  # type: exec_result._type_watch_patterns
+        fail_on=None,  # type: exec_result._type_watch_patterns
+        watch_action='kill',  # type: str
+        intern_lines=False,  # type: bool
+        shell=None,  # type: typing.Union[bool, str, None]
+        rlimits=None,  # type: typing.Optional[typing.Dict]
+        nice=None,  # type: typing.Optional[int]
+        ionice=None,  # type: typing.Union[str, typing.Tuple[str, int], None]
+        cgroup=None,  # type: typing.Optional[str]
+        cgroup_limits=None,  # type: typing.Optional[typing.Dict[str, str]]
     ):
         """Command executor helper.
 
-        :type command: str
+        :param command: command string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
         :type cwd: str
         :type env: dict
         :type timeout: int
@@ -184,148 +294,352 @@ class Subprocess(six.with_metaclass(SingletonMeta, _api.ExecHelper)):
         :param log_mask_re: regex lookup rule to mask command for logger.
                             all MATCHED groups will be replaced by '<*masked*>'
         :type log_mask_re: typing.Optional[str]
-        :type stdin: typing.Union[six.text_type, six.binary_type, None]
+        :param stdin: STDIN data, file object, path or iterable of chunks
+        :type stdin: typing.Union[
+            str, bytes, bytearray, typing.IO, os.PathLike, typing.Iterable
+        ]
         :param open_stdout: open STDOUT stream for read
         :type open_stdout: bool
         :param open_stderr: open STDERR stream for read
         :type open_stderr: bool
+        :param spill_threshold: output size in bytes per stream,
+                                after which output is stored in temporary file
+        :type spill_threshold: typing.Optional[int]
+        :param max_output_lines: maximum stored lines per stream
+        :type max_output_lines: typing.Optional[int]
+        :param max_output_bytes: maximum stored bytes per stream
+        :type max_output_bytes: typing.Optional[int]
+        :param output_strategy: part of output to keep if limits are set:
+                                'head', 'tail' or 'head+tail'
+        :type output_strategy: str
+        :param stdout_json_callback: callback for JSON records from stdout
+        :type stdout_json_callback: typing.Optional[typing.Callable]
+        :param record_timeline: record arrival time of output chunks
+        :type record_timeline: bool
+        :param stop_on: pattern(s) in output to stop waiting (expected state)
+        :type stop_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param fail_on: pattern(s) in output to stop waiting (failure)
+        :type fail_on: typing.Union[
+            str, bytes, typing.Pattern, typing.Iterable, None
+        ]
+        :param watch_action: action on pattern match: 'kill' or 'detach'
+        :type watch_action: str
+        :param intern_lines: store repeated output lines as single object
+        :type intern_lines: bool
+        :param shell: execute via shell: True, False, 'auto' or None
+                      (shell for command string, direct exec for argv)
+        :type shell: typing.Union[bool, str, None]
+        :param rlimits: resource limits: name ('cpu', 'as', 'nofile', etc.)
+                        as key, limit or (soft, hard) as value
+        :type rlimits: typing.Optional[typing.Dict]
+        :param nice: niceness increment
+        :type nice: typing.Optional[int]
+        :param ionice: IO scheduling class ('rt', 'be', 'idle')
+                       or (class, level) tuple
+        :type ionice: typing.Union[str, typing.Tuple[str, int], None]
+        :param cgroup: cgroup v2 directory (relative to /sys/fs/cgroup)
+        :type cgroup: typing.Optional[str]
+        :param cgroup_limits: cgroup control files content
+        :type cgroup_limits: typing.Optional[typing.Dict[str, str]]
         :rtype: ExecResult
+        :raises ValueError: unknown watch_action, shell mode or limit
+        :raises NotImplementedError: limit is not supported on the platform
 
         .. versionchanged:: 1.2.0 open_stdout and open_stderr flags
         .. versionchanged:: 1.2.0 default timeout 1 hour
         .. versionchanged:: 1.2.0 log_mask_re regex rule for masking cmd
+        .. versionchanged:: 1.2.0 spill_threshold for huge outputs
+        .. versionchanged:: 1.2.0 bounded output capture
+        .. versionchanged:: 1.2.0 stdout_json_callback for streaming JSON
+        .. versionchanged:: 1.2.0 record_timeline for output timeline
+        .. versionchanged:: 1.2.0 stop_on and fail_on output watchers
+        .. versionchanged:: 1.2.0 intern_lines for repeated lines
+        .. versionchanged:: 1.2.0 output polling without fixed read tick
+        .. versionchanged:: 1.2.0 shared polling thread for all processes
+        .. versionchanged:: 1.2.0 argv and execution without shell
+        .. versionchanged:: 1.2.0 posix_spawn process creation
+        .. versionchanged:: 1.2.0 streaming stdin from files and iterators
+        .. versionchanged:: 1.2.0 wall time and resource usage
+        .. versionchanged:: 1.2.0 resource limits and cgroup placement
         """
+        if watch_action not in constants.WATCH_ACTIONS:
+            raise ValueError(
+                'watch_action {!r} is not in {!r}'.format(
+                    watch_action, constants.WATCH_ACTIONS
+                )
+            )
+        limits = None  # type: typing.Optional[_limits.ProcessLimits]
+        if (
+            rlimits or cgroup or cgroup_limits or
+            nice is not None or ionice is not None
+        ):
+            limits = _limits.ProcessLimits(
+                rlimits=rlimits,
+                nice=nice,
+                ionice=ionice,
+                cgroup=cgroup,
+                cgroup_limits=cgroup_limits,
+            )
+
         def poll_streams(
             result,  # type: exec_result.ExecResult
             stdout,  # type: io.TextIOWrapper
             stderr,  # type: io.TextIOWrapper
-        ):
-            """Poll streams to the result object."""
-            if _win:  # pragma: no cover
-                # select.select is not supported on windows
-                result.read_stdout(src=stdout, log=logger, verbose=verbose)
-                result.read_stderr(src=stderr, log=logger, verbose=verbose)
-            else:  # pragma: no cover
-                rlist, _, _ = select.select(
-                    [item for item in (stdout, stderr) if item is not None],
-                    [],
-                    [])
-                if rlist:
-                    if stdout in rlist:
-                        result.read_stdout(
-                            src=stdout,
-                            log=logger,
-                            verbose=verbose
-                        )
-                    if stderr in rlist:
-                        result.read_stderr(
-                            src=stderr,
-                            log=logger,
-                            verbose=verbose
-                        )
+        ):  # pragma: no cover
+            """Poll streams to the result object (select is not supported)."""
+            result.read_stdout(src=stdout, log=logger, verbose=verbose)
+            result.read_stderr(src=stderr, log=logger, verbose=verbose)
 
         @threaded.threaded(started=True, daemon=True)
-        def poll_pipes(
+        def write_stdin_win(
+            pipe,  # type: typing.Any
+            chunks,  # type: typing.Iterator[bytes]
+        ):  # pragma: no cover
+            """Write STDIN data by chunks and close pipe on windows.
+
+            :type pipe: typing.Any
+            :type chunks: typing.Iterator[bytes]
+            """
+            try:
+                for chunk in chunks:
+                    pipe.write(chunk)
+            except (IOError, OSError):
+                pass  # Process does not read stdin
+            finally:
+                try:
+                    pipe.close()
+                except (IOError, OSError):
+                    pass  # Broken pipe on flush
+
+        @threaded.threaded(started=True, daemon=True)
+        def poll_pipes_win(
             result,  # type: exec_result.ExecResult
-            stop  # type: threading.Event
-        ):
-            """Polling task for FIFO buffers.
+            stop,  # type: threading.Event
+            future,  # type: concurrent.futures.Future
+            process,  # type: subprocess.Popen
+        ):  # pragma: no cover
+            """Polling task for FIFO buffers on windows.
 
             :type result: exec_result.ExecResult
             :type stop: threading.Event
+            :param future: future for exit code (None if stopped)
+            :type future: concurrent.futures.Future
+            :type process: subprocess.Popen
             """
             while not stop.isSet():
                 time.sleep(0.1)
                 if open_stdout or open_stderr:
                     poll_streams(
                         result=result,
-                        stdout=self.__process.stdout,
-                        stderr=self.__process.stderr,
+                        stdout=process.stdout,
+                        stderr=process.stderr,
                     )
 
-                self.__process.poll()
+                process.poll()
 
-                if self.__process.returncode is not None:
+                if process.returncode is not None:
                     result.read_stdout(
-                        src=self.__process.stdout,
+                        src=process.stdout,
                         log=logger,
                         verbose=verbose
                     )
                     result.read_stderr(
-                        src=self.__process.stderr,
+                        src=process.stderr,
                         log=logger,
                         verbose=verbose
                     )
-                    result.exit_code = self.__process.returncode
+                    result.wall_time = _monotonic() - started
+                    result.exit_code = process.returncode
+                    future.set_result(process.returncode)
+                    return
+            future.set_result(None)
 
-                    stop.set()
+        def poll_pipes(
+            result,  # type: exec_result.ExecResult
+            process,  # type: subprocess.Popen
+            chunks,  # type: typing.Optional[typing.Iterator[bytes]]
+        ):  # type: (...) -> typing.Tuple[typing.Any, typing.Callable]
+            """Start polling of FIFO buffers and process exit.
 
-        # 1 Command per run
-        with self.lock:
-            cmd_for_log = self._mask_command(
-                cmd=command,
-                log_mask_re=log_mask_re
+            Output and exit of all running processes are polled by
+            shared reactor thread without delay, result is updated from
+            shared callbacks threads (sequentially for the command).
+            STDIN is written by the reactor thread, when process reads it.
+
+            :type result: exec_result.ExecResult
+            :type process: subprocess.Popen
+            :param chunks: STDIN data chunks
+            :type chunks: typing.Optional[typing.Iterator[bytes]]
+            :return: future for exit code and callback to stop polling
+            :rtype: typing.Tuple[concurrent.futures.Future, typing.Callable]
+            """
+            if _win:  # pragma: no cover
+                if chunks is not None:
+                    write_stdin_win(process.stdin, chunks)
+                future = concurrent.futures.Future()
+                stop = threading.Event()
+                poll_pipes_win(result, stop, future, process)
+                return future, stop.set
+
+            def on_stdout(lines):  # type: (typing.List[bytes]) -> None
+                """Store stdout lines."""
+                result.read_stdout(src=lines, log=logger, verbose=verbose)
+
+            def on_stderr(lines):  # type: (typing.List[bytes]) -> None
+                """Store stderr lines."""
+                result.read_stderr(src=lines, log=logger, verbose=verbose)
+
+            def on_exit(
+                exit_code,  # type: int
+                rusage,  # type: typing.Any
+            ):  # type: (...) -> None
+                """Store exit code, wall time and resource usage."""
+                result.wall_time = _monotonic() - started
+                if rusage is not None:
+                    result.resource_usage = (
+                        exec_result.ResourceUsage.from_rusage(rusage)
+                    )
+                result.exit_code = exit_code
+
+            reactor = _reactor.get_reactor()
+            future = reactor.register(
+                process,
+                on_stdout=on_stdout if open_stdout else None,
+                on_stderr=on_stderr if open_stderr else None,
+                on_exit=on_exit,
+                stdin=chunks,
             )
+            return future, functools.partial(reactor.unregister, future)
+
+        args, use_shell = _api.resolve_command(command, shell)
+        if limits is not None:
+            if shell == 'auto' and isinstance(command, six.string_types):
+                args, use_shell = command, True  # Shell is started anyway
+            elif not use_shell:
+                # Gate shell would hide missing executable as exit code 127
+                _limits.check_executable(args[0], env=env, cwd=cwd)
+            # Command is started after limits applying
+            args, use_shell = limits.gate(args, use_shell), False
+        chunks = None if stdin is None else _api.stdin_chunks(stdin)
+
+        cmd_for_log = self._mask_command(
+            cmd=_api.command_to_str(command),
+            log_mask_re=log_mask_re
+        )
 
-            # Store command with hidden data
-            result = exec_result.ExecResult(cmd=cmd_for_log)
-            stop_event = threading.Event()
+        # Set on process end or on output watcher match
+        done_event = threading.Event()
+
+        # Store command with hidden data
+        result = exec_result.ExecResult(
+            cmd=cmd_for_log,
+            spill_threshold=spill_threshold,
+            max_output_lines=max_output_lines,
+            max_output_bytes=max_output_bytes,
+            output_strategy=output_strategy,
+            stdout_json_callback=stdout_json_callback,
+            record_timeline=record_timeline,
+            stop_on=stop_on,
+            fail_on=fail_on,
+            watch_callback=lambda _: done_event.set(),
+            intern_lines=intern_lines,
+        )
 
+        self.__acquire_slot()
+        process = None  # type: typing.Optional[subprocess.Popen]
+        future = None  # type: typing.Optional[concurrent.futures.Future]
+        try:
             logger.log(
                 level=logging.INFO if verbose else logging.DEBUG,
                 msg=_log_templates.CMD_EXEC.format(cmd=cmd_for_log)
             )
 
             # Run
-            self.__process = subprocess.Popen(
-                args=[command],
-                stdout=subprocess.PIPE if open_stdout else devnull,
-                stderr=subprocess.PIPE if open_stderr else devnull,
-                stdin=subprocess.PIPE,
-                shell=True,
-                cwd=cwd,
-                env=env,
-                universal_newlines=False,
-            )
-            if stdin is not None:
-                if not isinstance(stdin, six.binary_type):
-                    stdin = stdin.encode(encoding='utf-8')
-                self.__process.stdin.write(stdin)
-                self.__process.stdin.close()
+            started = _monotonic()
+            if _spawn.spawn_supported(cwd=cwd):
+                # Creation time does not depend on the parent memory size
+                popen = functools.partial(
+                    _spawn.SpawnProcess,
+                    stdout=subprocess.PIPE if open_stdout else devnull,
+                    stderr=subprocess.PIPE if open_stderr else devnull,
+                    stdin=subprocess.PIPE,
+                    env=env,
+                )
+            else:
+                popen = functools.partial(
+                    subprocess.Popen,
+                    stdout=subprocess.PIPE if open_stdout else devnull,
+                    stderr=subprocess.PIPE if open_stderr else devnull,
+                    stdin=subprocess.PIPE,
+                    cwd=cwd,
+                    env=env,
+                    universal_newlines=False,
+                )
+            if use_shell:
+                process = popen(args=[args], shell=True)
+            elif shell == 'auto':
+                try:
+                    process = popen(args=args, shell=False)
+                except OSError:
+                    # Not an executable (shell builtin, etc): use shell
+                    process = popen(args=[command], shell=True)
+            else:
+                process = popen(args=args, shell=False)
+            if limits is not None:
+                try:
+                    limits.apply(process)
+                except BaseException:
+                    # Do not leave the process running without limits
+                    process.kill()
+                    process.wait()
+                    raise
+            with self.__state:
+                self.__processes[process] = threading.current_thread().ident
 
             # Poll output
 
             if open_stdout:
-                set_nonblocking_pipe(self.__process.stdout)
+                set_nonblocking_pipe(process.stdout)
             if open_stderr:
-                set_nonblocking_pipe(self.__process.stderr)
-            # pylint: disable=assignment-from-no-return
-            poll_thread = poll_pipes(
-                result,
-                stop_event
-            )  # type: threading.Thread
-            # pylint: enable=assignment-from-no-return
+                set_nonblocking_pipe(process.stderr)
+            future, stop_polling = poll_pipes(result, process, chunks)
+            # Detached process holds the slot until the end of polling
+            future.add_done_callback(
+                lambda _: self.__release_slot(process)
+            )
+            if limits is not None:
+                future.add_done_callback(lambda _: limits.release())
+            future.add_done_callback(lambda _: done_event.set())
             # wait for process close
-            stop_event.wait(timeout)
+            done_event.wait(timeout)
 
             # Process closed?
-            if stop_event.isSet():
-                stop_event.clear()
-                self.__process = None
+            if future.done():
+                if future.exception() is not None:
+                    # Output processing or stdin reading error
+                    self.__kill_watched(process, future, stop_polling)
+                    future.result()
+                return result
+
+            if result.watch_match is not None:
+                if watch_action == 'kill':
+                    self.__kill_watched(process, future, stop_polling)
+                # detach: polling continues until process end
                 return result
+
             # Kill not ended process and wait for close
             try:
-                self.__process.kill()  # kill -9
-                stop_event.wait(5)
-                # Force stop cycle if no exit code after kill
-                stop_event.set()
-                poll_thread.join(5)
+                process.kill()  # kill -9
+                concurrent.futures.wait([future], 5)
+                # Force stop polling if no exit code after kill
+                stop_polling()
             except OSError:
                 # Nothing to kill
                 logger.warning(
                     u"{!s} has been completed just after timeout: "
-                    "please validate timeout.".format(command))
-            self.__process = None
+                    "please validate timeout.".format(cmd_for_log))
 
             wait_err_msg = _log_templates.CMD_WAIT_ERROR.format(
                 result=result,
@@ -333,20 +647,78 @@ class Subprocess(six.with_metaclass(SingletonMeta, _api.ExecHelper)):
             )
             logger.debug(wait_err_msg)
             raise exceptions.ExecHelperTimeoutError(wait_err_msg)
+        finally:
+            if future is None:  # Process or polling has not been started
+                self.__release_slot(process)
+                if limits is not None:
+                    limits.release()
+
+    @staticmethod
+    def __kill_watched(
+        process,  # type: subprocess.Popen
+        future,  # type: concurrent.futures.Future
+        stop_polling,  # type: typing.Callable[[], None]
+    ):  # type: (...) -> None
+        """Kill process after output watcher match and wait for exit code.
+
+        :type process: subprocess.Popen
+        :param future: future for exit code
+        :type future: concurrent.futures.Future
+        :param stop_polling: callback to stop polling
+        :type stop_polling: typing.Callable[[], None]
+        """
+        try:
+            process.kill()  # kill -9
+            concurrent.futures.wait([future], 5)
+        except OSError:
+            pass  # Process has been completed just after match
+        # Force stop polling if no exit code after kill
+        stop_polling()
+
+    def session(
+        self,
+        shell='/bin/bash',  # type: str
+        cwd=None,  # type: typing.Optional[str]
+        env=None,  # type: typing.Optional[typing.Dict[str, typing.Any]]
+    ):  # type: (...) -> shell_session.ShellSession
+        """Persistent shell session for sequential commands (posix only).
+
+        Commands are executed by single long-lived shell process,
+        so shell state (working directory, variables) is kept between them.
+        Usage: ``with runner.session() as session: session.execute(cmd)``
+
+        :param shell: shell executable
+        :type shell: str
+        :param cwd: initial working directory
+        :type cwd: typing.Optional[str]
+        :param env: environment variables dict
+        :type env: typing.Optional[typing.Dict[str, typing.Any]]
+        :rtype: ShellSession
+
+        .. versionadded:: 1.2.0
+        """
+        return shell_session.ShellSession(
+            log_mask_re=self.log_mask_re,
+            shell=shell,
+            cwd=cwd,
+            env=env,
+        )
 
     def execute(
         self,
-        command,  # type: str
+        command,  # type: _api._type_command
         verbose=False,  # type: bool
         timeout=constants.DEFAULT_TIMEOUT,  # type: typing.Optional[int]
         **kwargs
     ):  # type: (...) -> exec_result.ExecResult
         """Execute command and wait for return code.
 
-        Timeout limitation: read tick is 100 ms.
+        Resource limits (rlimits, nice, ionice) and cgroup v2 placement
+        (cgroup, cgroup_limits) are set via keyword arguments: limits are
+        applied without preexec_fn before the command start.
 
-        :param command: Command for execution
-        :type command: str
+        :param command: Command for execution: string or argv
+        :type command: typing.Union[str, typing.Sequence[str]]
         :param verbose: Produce log.info records for command call and output
         :type verbose: bool
         :param timeout: Timeout for command execution.
@@ -355,6 +727,8 @@ class Subprocess(six.with_metaclass(SingletonMeta, _api.ExecHelper)):
         :raises ExecHelperTimeoutError: Timeout exceeded
 
         .. versionchanged:: 1.2.0 default timeout 1 hour
+        .. versionchanged:: 1.2.0 argv and shell keyword argument
+        .. versionchanged:: 1.2.0 resource limits and cgroup placement
         """
         result = self.__exec_command(command=command, timeout=timeout,
                                      verbose=verbose, **kwargs)
@@ -65,16 +65,27 @@ def _extension(modpath):
 requires_optimization = [
     _extension('exec_helpers._api'),
     _extension('exec_helpers.constants'),
+    _extension('exec_helpers._limits'),
     _extension('exec_helpers._log_templates'),
     _extension('exec_helpers.exceptions'),
     _extension('exec_helpers.exec_result'),
+    _extension('exec_helpers._output_buffer'),
+    _extension('exec_helpers.parsers'),
     _extension('exec_helpers.proc_enums'),
+    _extension('exec_helpers._reactor'),
+    _extension('exec_helpers._spawn'),
     _extension('exec_helpers._ssh_client_base'),
     _extension('exec_helpers.ssh_auth'),
     _extension('exec_helpers.ssh_client'),
+    _extension('exec_helpers.shell_session'),
     _extension('exec_helpers.subprocess_runner'),
 ]
 
+if sys.version_info >= (3, 5):
+    requires_optimization.append(
+        _extension('exec_helpers.async_subprocess')
+    )
+
 if 'win32' != sys.platform:
     requires_optimization.append(
         _extension('exec_helpers.__init__')
@@ -268,6 +279,7 @@ setup_args = dict(
     extras_require={
         ':python_version == "2.7"': [
             'futures>=1.0',
+            'selectors2>=2.0',
         ],
     },
     install_requires=required,
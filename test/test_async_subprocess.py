@@ -0,0 +1,218 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import subprocess
+import sys
+import unittest
+
+import mock
+
+import exec_helpers
+
+if sys.version_info >= (3, 5):
+    import asyncio
+
+command = 'ls ~\nline 2\nline 3\nline с кирилицей'
+stdout_list = [b' \n', b'2\n', b'3\n', b' \n']
+stderr_list = [b' \n', b'0\n', b'1\n', b' \n']
+
+
+class FakeProcess(object):
+    """asyncio process with prepared output."""
+    def __init__(self, loop, stdout, stderr, returncode, finished=True):
+        self.loop = loop
+        self.stdout = asyncio.StreamReader()
+        self.stdout.feed_data(b''.join(stdout))
+        self.stderr = asyncio.StreamReader()
+        self.stderr.feed_data(b''.join(stderr))
+        self.stdin = mock.Mock()
+        self.stdin.drain.side_effect = lambda: self.done(None)
+        self.returncode = loop.create_future()
+        self.kill = mock.Mock(side_effect=lambda: self.finish(-9))
+        if finished:
+            self.finish(returncode)
+
+    def done(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def finish(self, returncode):
+        self.stdout.feed_eof()
+        self.stderr.feed_eof()
+        self.returncode.set_result(returncode)
+
+    def wait(self):
+        return self.returncode
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio syntax is required')
+@mock.patch('exec_helpers.async_subprocess.logger', autospec=True)
+@mock.patch('asyncio.create_subprocess_shell', new_callable=mock.Mock)
+class TestAsyncSubprocess(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def prepare(self, create, ec=0, **kwargs):
+        process = FakeProcess(
+            self.loop, stdout_list, stderr_list, ec, **kwargs)
+        create.side_effect = lambda *args, **kw: process.done(process)
+        return process
+
+    def run_sync(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_call(self, create, logger):
+        self.prepare(create)
+        runner = exec_helpers.AsyncSubprocess()
+        result = self.run_sync(runner.execute(command))
+        self.assertEqual(
+            result,
+            exec_helpers.ExecResult(
+                cmd=command,
+                stdout=stdout_list,
+                stderr=stderr_list,
+                exit_code=0,
+            )
+        )
+        create.assert_called_once_with(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            cwd=None,
+            env=None,
+        )
+
+    @mock.patch('asyncio.create_subprocess_exec', new_callable=mock.Mock)
+    def test_argv(self, create_exec, create, logger):
+        self.prepare(create)
+        create_exec.side_effect = create.side_effect
+        runner = exec_helpers.AsyncSubprocess()
+        result = self.run_sync(runner.execute(['echo', 'a b']))
+        self.assertEqual(result.cmd, "echo 'a b'")
+        create_exec.assert_called_once_with(
+            'echo', 'a b',
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            cwd=None,
+            env=None,
+        )
+        create.assert_not_called()
+
+        # Not an executable: fallback to shell
+        create_exec.side_effect = OSError()
+        self.prepare(create)
+        self.run_sync(runner.execute('cd /tmp', shell='auto'))
+        create.assert_called_once_with(
+            'cd /tmp',
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            cwd=None,
+            env=None,
+        )
+
+    def test_stdin(self, create, logger):
+        process = self.prepare(create)
+        runner = exec_helpers.AsyncSubprocess()
+        self.run_sync(runner.execute(command, stdin='data'))
+        process.stdin.write.assert_called_once_with(b'data')
+        process.stdin.close.assert_called_once()
+
+    def test_stdin_source_error(self, create, logger):
+        process = self.prepare(create, finished=False)
+
+        def source():
+            yield b'data'
+            raise ValueError('failed')
+
+        runner = exec_helpers.AsyncSubprocess()
+        with self.assertRaises(ValueError):
+            self.run_sync(runner.execute(command, stdin=source(), timeout=5))
+        process.kill.assert_called_once()
+        self.assertTrue(process.returncode.done())
+        process.stdin.close.assert_called()
+
+    def test_mask(self, create, logger):
+        self.prepare(create)
+        runner = exec_helpers.AsyncSubprocess(
+            log_mask_re=r"secret\s*=\s*([A-Z-a-z0-9_\-]+)")
+        result = self.run_sync(
+            runner.execute("USE='secret=secret_pass' do task"))
+        self.assertEqual(result.cmd, "USE='secret=<*masked*>' do task")
+
+    def test_timeout(self, create, logger):
+        process = self.prepare(create, finished=False)
+        runner = exec_helpers.AsyncSubprocess()
+        with self.assertRaises(exec_helpers.ExecHelperTimeoutError):
+            self.run_sync(runner.execute(command, timeout=0.1))
+        process.kill.assert_called_once()
+
+    def test_watch_kill(self, create, logger):
+        process = self.prepare(create, finished=False)
+        runner = exec_helpers.AsyncSubprocess()
+        result = self.run_sync(
+            runner.execute(command, timeout=10, fail_on='1'))
+        self.assertEqual(result.watch_match, ('fail_on', 'stderr', b'1'))
+        process.kill.assert_called_once()
+        self.assertEqual(result.exit_code, -9)
+
+    def test_check_call(self, create, logger):
+        self.prepare(create, ec=1)
+        runner = exec_helpers.AsyncSubprocess()
+        with self.assertRaises(exec_helpers.CalledProcessError):
+            self.run_sync(runner.check_call(command))
+        result = self.run_sync(runner.check_call(command, expected=[1]))
+        self.assertEqual(result.exit_code, 1)
+
+    def test_check_call_stop_on(self, create, logger):
+        process = self.prepare(create, finished=False)
+        runner = exec_helpers.AsyncSubprocess()
+        result = self.run_sync(
+            runner.check_call(command, timeout=10, stop_on='2'))
+        self.assertEqual(result.watch_match, ('stop_on', 'stdout', b'2'))
+        process.kill.assert_called_once()
+        self.assertEqual(result.exit_code, -9)
+
+    def test_check_stderr(self, create, logger):
+        self.prepare(create)
+        runner = exec_helpers.AsyncSubprocess()
+        with self.assertRaises(exec_helpers.CalledProcessError):
+            self.run_sync(runner.check_stderr(command))
+
+    def test_concurrency(self, create, logger):
+        with self.assertRaises(ValueError):
+            exec_helpers.AsyncSubprocess(max_concurrency=0)
+        runner = exec_helpers.AsyncSubprocess(max_concurrency=2)
+        self.assertEqual(runner.max_concurrency, 2)
+
+        def start(*args, **kwargs):
+            process = FakeProcess(self.loop, stdout_list, stderr_list, 0)
+            return process.done(process)
+
+        create.side_effect = start
+        results = self.run_sync(
+            asyncio.gather(*[runner.execute(command) for _ in range(5)]))
+        self.assertEqual([result.exit_code for result in results], [0] * 5)
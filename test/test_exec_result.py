@@ -20,11 +20,16 @@ from __future__ import unicode_literals
 
 # pylint: disable=no-self-use
 
+import codecs
+import sys
+import threading
+import time
 import unittest
 
 import mock
 
 import exec_helpers
+from exec_helpers import exec_result
 
 
 cmd = "ls -la | awk \'{print $1}\'"
@@ -182,6 +187,14 @@ class TestExecResult(unittest.TestCase):
         result = exec_helpers.ExecResult('test', stdout=[b'{"test": true}'])
         self.assertEqual(result.stdout_json, {'test': True})
 
+    def test_parsed_cache(self):
+        """Cached parsed data of finalized result is shared."""
+        result = exec_helpers.ExecResult(
+            'test', stdout=[b'{"test": [1]}'], exit_code=0)
+        self.assertIs(result.stdout_json, result.stdout_json)
+        self.assertIs(result.stdout_yaml, result.stdout_yaml)
+        self.assertEqual(result.stdout_yaml, {'test': [1]})
+
     @mock.patch('exec_helpers.exec_result.logger', autospec=True)
     def test_wrong_result(self, logger):
         """Test logging exception if stdout if not a correct json"""
@@ -238,3 +251,658 @@ class TestExecResult(unittest.TestCase):
 
         with self.assertRaises(RuntimeError):
             result.read_stderr([b'err'])
+
+    def test_chunked_read(self):
+        """Output is accumulated over multiple reads without data loss."""
+        result = exec_helpers.ExecResult(cmd)
+        chunks = [
+            [b'line %d\n' % idx for idx in range(start, start + 10)]
+            for start in range(0, 100, 10)
+        ]
+        for chunk in chunks:
+            result.read_stdout(chunk)
+            result.read_stderr(chunk[:1])
+        expected = tuple(line for chunk in chunks for line in chunk)
+        self.assertEqual(result.stdout, expected)
+        self.assertEqual(result.stderr, tuple(chunk[0] for chunk in chunks))
+        self.assertEqual(result.stdout_bin, bytearray(b''.join(expected)))
+
+        result.exit_code = 0
+        # Tuple view is cached for final result
+        self.assertIs(result.stdout, result.stdout)
+        self.assertEqual(
+            result.stdout_brief,
+            b''.join(expected[:3] + (b'...\n',) + expected[-3:]).strip(
+            ).decode('utf-8')
+        )
+
+    def test_text_chunks(self):
+        """Text and bytearray chunks are stored as bytes."""
+        result = exec_helpers.ExecResult(
+            cmd,
+            stdout=[u'text\n', bytearray(b'binary\n')],
+        )
+        self.assertEqual(result.stdout, (b'text\n', b'binary\n'))
+        self.assertEqual(result.stdout_str, 'text\nbinary')
+
+    def test_spill(self):
+        """Huge output is moved to temporary file."""
+        lines = [b'line %d\n' % idx for idx in range(100)]
+        result = exec_helpers.ExecResult(cmd, spill_threshold=64)
+        self.assertFalse(result.spilled)
+        result.read_stdout(lines[:50])
+        self.assertTrue(result.spilled)
+        result.read_stdout(lines[50:])
+        result.read_stderr([b' err\n'])
+        self.assertEqual(result.stdout, tuple(lines))
+        self.assertEqual(result.stdout_bin, bytearray(b''.join(lines)))
+        result.exit_code = 0
+
+        self.assertIsInstance(result.stdout_bin, memoryview)
+        self.assertTrue(result.stdout_bin.readonly)
+        self.assertEqual(result.stdout_bin, b''.join(lines))
+        self.assertEqual(result.stderr_bin, bytearray(b' err\n'))
+        self.assertEqual(result.stdout, tuple(lines))
+        self.assertEqual(result.stdout[-1], lines[-1])
+        self.assertEqual(
+            result.stdout_str,
+            b''.join(lines).strip().decode('utf-8')
+        )
+        self.assertEqual(
+            result.stdout_brief,
+            b''.join(lines[:3] + [b'...\n'] + lines[-3:]).strip(
+            ).decode('utf-8')
+        )
+        self.assertEqual(result.stderr_str, 'err')
+        self.assertEqual(
+            result,
+            exec_helpers.ExecResult(
+                cmd, stdout=lines, stderr=[b' err\n'], exit_code=0)
+        )
+        self.assertEqual(result.stdout_view.obj, result.stdout_bin.obj)
+        self.assertEqual(result.stdout_bytes, b''.join(lines))
+
+    def test_views(self):
+        """Finalized output is joined once and shared without copies."""
+        result = exec_helpers.ExecResult(cmd, stdout=[b' 1\n', b'2\n'])
+        self.assertEqual(result.stdout_bytes, b' 1\n2\n')
+        self.assertIsNot(result.stdout_bytes, result.stdout_bytes)
+        result.read_stdout([b'3\n'])
+        self.assertEqual(result.stdout_view, b' 1\n2\n3\n')
+        result.exit_code = 0
+
+        data = result.stdout_bytes
+        self.assertIs(result.stdout_bytes, data)
+        view = result.stdout_view
+        self.assertIs(view.obj, data)
+        self.assertTrue(view.readonly)
+        self.assertEqual(view[1:2], b'1')
+        self.assertEqual(result.stdout_bin, bytearray(data))
+        self.assertEqual(result.stdout_str, '1\n2\n3')
+        self.assertEqual(result.stderr_view, b'')
+
+    def test_joined_storage(self):
+        """Joined binary replaces chunks of finalized output."""
+        lines = [b'line %d\n' % idx for idx in range(20)]
+        for kwargs in ({}, {'max_output_lines': 6}):
+            result = exec_helpers.ExecResult(
+                cmd, stdout=lines, exit_code=0, **kwargs)
+            expected = exec_helpers.ExecResult(
+                cmd, stdout=lines, exit_code=0, **kwargs)
+            data = result.stdout_bytes
+            storage = result._ExecResult__stdout._OutputBuffer__storage
+            self.assertIsNone(storage.chunks)
+            self.assertIs(storage.joined, data)
+
+            self.assertEqual(result.stdout, expected.stdout)
+            # Tuple view is sliced once and cached
+            self.assertIs(result.stdout, result.stdout)
+            self.assertEqual(result.stdout[-1], expected.stdout[-1])
+            self.assertEqual(
+                result.stdout_lines[2:4], expected.stdout_lines[2:4])
+            self.assertEqual(result.stdout_brief, expected.stdout_brief)
+            self.assertEqual(result.stdout_str, expected.stdout_str)
+            result.compress()
+            self.assertEqual(result.stdout, expected.stdout)
+            self.assertEqual(result.stdout_brief, expected.stdout_brief)
+
+    def test_joined_keeps_tuple(self):
+        """Cached tuple view survives joining of finalized output."""
+        lines = [b'line %d\n' % idx for idx in range(20)]
+        result = exec_helpers.ExecResult(cmd, stdout=lines, exit_code=0)
+        stdout = result.stdout
+        self.assertEqual(result.stdout_bytes, b''.join(lines))
+        storage = result._ExecResult__stdout._OutputBuffer__storage
+        self.assertIsNone(storage.chunks)
+        self.assertIs(result.stdout, stdout)
+
+    def test_bounded_head_tail(self):
+        """Only first and last lines are stored with output limits."""
+        lines = [b'line %d\n' % idx for idx in range(100)]
+        result = exec_helpers.ExecResult(cmd, max_output_lines=6)
+        for line in lines:
+            result.read_stdout([line])
+        result.exit_code = 0
+        self.assertEqual(result.stdout, tuple(lines[:3] + lines[-3:]))
+        self.assertEqual(result.stdout_dropped_lines, 94)
+        self.assertEqual(
+            result.stdout_dropped_bytes,
+            len(b''.join(lines[3:-3]))
+        )
+        self.assertEqual(result.stderr_dropped_lines, 0)
+        self.assertEqual(
+            result.stdout_brief,
+            'line 0\nline 1\nline 2\n'
+            '... (94 lines, {} bytes dropped)\n'
+            'line 97\nline 98\nline 99'.format(len(b''.join(lines[3:-3])))
+        )
+        self.assertIn('94 lines', str(result))
+
+    def test_bounded_strategies(self):
+        lines = [b'line %d\n' % idx for idx in range(10)]
+
+        result = exec_helpers.ExecResult(
+            cmd, stdout=lines, max_output_lines=4, output_strategy='head')
+        self.assertEqual(result.stdout, tuple(lines[:4]))
+        self.assertEqual(result.stdout_dropped_lines, 6)
+
+        result = exec_helpers.ExecResult(
+            cmd, stdout=lines, max_output_lines=4, output_strategy='tail')
+        self.assertEqual(result.stdout, tuple(lines[-4:]))
+        self.assertEqual(result.stdout_dropped_lines, 6)
+        self.assertTrue(
+            result.stdout_brief.startswith('... (6 lines, 42 bytes dropped)'))
+
+        # 7 bytes per line: 3 lines in head half, 2 lines in the rest
+        result = exec_helpers.ExecResult(
+            cmd, stdout=lines, max_output_bytes=35)
+        self.assertEqual(result.stdout, tuple(lines[:2] + lines[-3:]))
+        self.assertEqual(result.stdout_dropped_bytes, 35)
+
+        result = exec_helpers.ExecResult(
+            cmd, stdout=lines, max_output_lines=100)
+        self.assertEqual(result.stdout, tuple(lines))
+        self.assertEqual(result.stdout_dropped_lines, 0)
+
+        with self.assertRaises(ValueError):
+            exec_helpers.ExecResult(cmd, output_strategy='middle')
+        with self.assertRaises(ValueError):
+            exec_helpers.ExecResult(
+                cmd, max_output_lines=1, spill_threshold=1)
+
+    def test_lines(self):
+        """Lines are accessible without full output decoding."""
+        chunks = [b'first\nsec', b'ond\n', b'', b'third\r\n', b'\xff err\n',
+                  b'last']
+        lines = ['first', 'second', 'third', '\\xff err', 'last']
+        for spill_threshold in (None, 8):
+            result = exec_helpers.ExecResult(
+                cmd, spill_threshold=spill_threshold)
+            result.read_stdout(chunks)
+            for final in (False, True):
+                if final:
+                    result.exit_code = 0
+                stdout_lines = result.stdout_lines
+                self.assertEqual(stdout_lines.line_count, 5)
+                self.assertEqual(len(stdout_lines), 5)
+                self.assertEqual(list(stdout_lines), lines)
+                self.assertEqual(stdout_lines.line(1), 'second')
+                self.assertEqual(stdout_lines[-1], 'last')
+                self.assertEqual(stdout_lines[1:3], lines[1:3])
+                self.assertEqual(stdout_lines[::-2], lines[::-2])
+                self.assertEqual(stdout_lines[3:1:-1], lines[3:1:-1])
+                self.assertEqual(stdout_lines.tail(2), lines[-2:])
+                self.assertEqual(stdout_lines.tail(0), [])
+                self.assertEqual(stdout_lines.grep('ir'), ['first', 'third'])
+                self.assertEqual(stdout_lines.grep(b'\xff'), ['\\xff err'])
+                with self.assertRaises(IndexError):
+                    stdout_lines.line(5)
+        self.assertEqual(result.stderr_lines.line_count, 0)
+
+        result = exec_helpers.ExecResult(
+            cmd,
+            stdout=[b'%d\n' % idx for idx in range(10)],
+            max_output_lines=4
+        )
+        self.assertEqual(result.stdout_lines[:], ['0', '1', '8', '9'])
+        self.assertEqual(result.stdout_lines.line(2), '8')
+
+    def test_ndjson(self):
+        """JSON records are decoded from NDJSON and JSON-seq streams."""
+        chunks = [b'{"a": 1}\n{"b"', b': [1, 2]}\n', b'\n', b'{\n',
+                  b'  "c": 3\n', b'}\n', b'\x1e"seq"\n', b'\x1e4']
+        records = [{'a': 1}, {'b': [1, 2]}, {'c': 3}, 'seq', 4]
+        result = exec_helpers.ExecResult(cmd)
+        result.read_stdout(chunks)
+        result.exit_code = 0
+        self.assertEqual(result.stdout_ndjson, records)
+        self.assertEqual(list(result.iter_stdout_json()), records)
+
+        result = exec_helpers.ExecResult(cmd, stdout=[b'{"a": 1}\n', b'{\n'])
+        result.exit_code = 0
+        with self.assertRaises(exec_helpers.exceptions.DeserializeValueError):
+            result.stdout_ndjson
+
+    def test_ndjson_live(self):
+        """Records are available before command end."""
+        received = []
+        result = exec_helpers.ExecResult(
+            cmd, stdout_json_callback=received.append)
+        records = result.iter_stdout_json(timeout=0.01)
+        result.read_stdout([b'{"a": 1}\n', b'[2'])
+        self.assertEqual(received, [{'a': 1}])
+        self.assertEqual(next(records), {'a': 1})
+        with self.assertRaises(exec_helpers.ExecHelperTimeoutError):
+            next(records)
+
+        records = result.iter_stdout_json()
+        self.assertEqual(next(records), {'a': 1})
+        result.read_stdout([b']\n', b'3'])
+        self.assertEqual(received, [{'a': 1}, [2]])
+        self.assertEqual(next(records), [2])
+        result.exit_code = 0
+        self.assertEqual(received, [{'a': 1}, [2], 3])
+        self.assertEqual(list(records), [3])
+
+    @mock.patch('exec_helpers.exec_result.logger')
+    def test_ndjson_callback_error(self, logger):
+        """Callback errors do not break reading."""
+        callback = mock.Mock(side_effect=RuntimeError)
+        result = exec_helpers.ExecResult(cmd, stdout_json_callback=callback)
+        result.read_stdout([b'1\n', b'{\n', b'{\n'])
+        callback.assert_called_once_with(1)
+        self.assertEqual(logger.exception.call_count, 2)
+        self.assertEqual(len(result.stdout), 3)
+
+    def test_incremental_text(self):
+        """Only new data is decoded, strip is applied to the view only."""
+        result = exec_helpers.ExecResult(cmd, stdout=[b'\n  \xd1'])
+        self.assertEqual(result.stdout_str, '\\xd1')
+        result.read_stdout([b'\x8f\n', b' \n'])
+        self.assertEqual(result.stdout_str, 'я')
+        with mock.patch('codecs.decode') as decode:
+            self.assertEqual(result.stdout_str, 'я')
+        decode.assert_not_called()
+        result.read_stdout([b'next \xff\n'])
+        self.assertEqual(result.stdout_str, 'я\n \nnext \\xff')
+        result.exit_code = 0
+        self.assertEqual(
+            result.stdout_str,
+            b'\n  \xd1\x8f\n \nnext \xff\n'.strip().decode(
+                'utf-8', errors='backslashreplace')
+        )
+
+        result = exec_helpers.ExecResult(
+            cmd, stdout=[b'%d\n' % idx for idx in range(10)],
+            max_output_lines=2
+        )
+        self.assertEqual(result.stdout_str, '0\n9')
+        result.read_stdout([b'10\n'])
+        self.assertEqual(result.stdout_str, '0\n10')
+
+    def test_incremental_text_decode_count(self):
+        """Each chunk is decoded once, finalized text is joined once."""
+        decoder_cls = codecs.getincrementaldecoder('utf-8')
+        decoded = []
+
+        class Decoder(decoder_cls):
+            def decode(self, data, final=False):
+                decoded.append(bytes(data))
+                return decoder_cls.decode(self, data, final)
+
+        lines = [b'line %d\n' % idx for idx in range(200)]
+        with mock.patch('codecs.getincrementaldecoder', return_value=Decoder):
+            result = exec_helpers.ExecResult(cmd)
+            for line in lines:
+                result.read_stdout([line])
+                self.assertTrue(result.stdout_str.endswith(line.decode()[:-1]))
+            result.exit_code = 0
+            text = result.stdout_str
+            for _ in range(10):
+                self.assertIs(result.stdout_str, text)
+        self.assertEqual(b''.join(decoded), b''.join(lines))
+        self.assertEqual(len([data for data in decoded if data]), len(lines))
+        self.assertEqual(text, b''.join(lines).decode().strip())
+
+    def test_serialization(self):
+        """Result survives binary serialization and pickle."""
+        import pickle
+
+        lines = [b'line %d\n' % idx for idx in range(20)]
+        for kwargs in (
+            {},
+            {'spill_threshold': 16},
+            {'max_output_lines': 4},
+            {'max_output_bytes': 30, 'output_strategy': 'tail'},
+        ):
+            result = exec_helpers.ExecResult(
+                cmd, stdin=b'input', stdout=lines, stderr=[b'err\n', b''],
+                **kwargs
+            )
+            restored = exec_helpers.ExecResult.from_bytes(result.to_bytes())
+            self.assertEqual(restored.stdin, 'input')
+            self.assertEqual(restored.stdout, result.stdout)
+            self.assertEqual(restored.stderr, result.stderr)
+            self.assertIsNone(restored.timestamp)
+            restored.read_stdout([b'more\n'])
+
+            result.exit_code = 1
+            for restored in (
+                exec_helpers.ExecResult.from_bytes(result.to_bytes()),
+                pickle.loads(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)),
+            ):
+                self.assertEqual(restored, result)
+                self.assertEqual(restored.timestamp, result.timestamp)
+                self.assertEqual(restored.stdout_brief, result.stdout_brief)
+                self.assertEqual(
+                    restored.stdout_dropped_lines, result.stdout_dropped_lines)
+                self.assertEqual(
+                    restored.stdout_lines.line_count,
+                    result.stdout_lines.line_count)
+                with self.assertRaises(RuntimeError):
+                    restored.read_stdout([b'more\n'])
+
+        restored = pickle.loads(pickle.dumps(exec_helpers.ExecResult(cmd)))
+        self.assertIsNone(restored.stdin)
+        self.assertEqual(restored.exit_code, exec_helpers.ExitCodes.EX_INVALID)
+        with self.assertRaises(ValueError):
+            exec_helpers.ExecResult.from_bytes(b'garbage')
+        with self.assertRaises(ValueError):
+            exec_helpers.ExecResult.from_bytes(result.to_bytes()[:-1])
+
+    def test_serialization_attributes(self):
+        """All public attributes survive serialization."""
+        import pickle
+
+        result = exec_helpers.ExecResult(
+            cmd, stdin='input', record_timeline=True, stop_on='ready')
+        result.read_stdout([b'{"state": "ready"}\n'])
+        result.read_stderr([b'err\n'])
+        result.wall_time = 1.25
+        result.resource_usage = exec_result.ResourceUsage(
+            0.5, 0.25, 2048, 8, 16, 3, 4)
+        result.exit_code = 0
+
+        def value(res, name):
+            data = getattr(res, name)
+            if isinstance(data, exec_result.OutputTimeline):
+                return list(data), data.wall_time
+            if isinstance(data, (exec_result.OutputLines, memoryview)):
+                return list(data)
+            return data
+
+        for restored in (
+            exec_helpers.ExecResult.from_bytes(result.to_bytes()),
+            pickle.loads(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)),
+        ):
+            for name in set(dir(result)) - {'lock'}:
+                self.assertEqual(
+                    value(restored, name), value(result, name), name)
+        self.assertIsNotNone(result.timeline)
+        self.assertEqual(result.watch_match, ('stop_on', 'stdout', b'ready'))
+        self.assertEqual(restored.wall_time, 1.25)
+        self.assertIsInstance(
+            restored.resource_usage, exec_result.ResourceUsage)
+
+        # Format version 2 has no optional fields
+        result = exec_helpers.ExecResult(cmd, stdout=[b'1\n'], exit_code=0)
+        data = bytearray(result.to_bytes())
+        data[4] = 2
+        self.assertEqual(
+            exec_helpers.ExecResult.from_bytes(bytes(data)), result)
+        data[4] = 9
+        with self.assertRaises(ValueError):
+            exec_helpers.ExecResult.from_bytes(bytes(data))
+
+    def test_frozen_lock(self):
+        """Finalized result is read without lock."""
+        import threading
+
+        result = exec_helpers.ExecResult(cmd, stdout=[b'\xd1'])
+        live_lock = result.lock
+        self.assertIsInstance(live_lock, type(threading.RLock()))
+        self.assertEqual(result.stdout_str, '\\xd1')
+        result.read_stdout([b'\x8f\n'])
+        result.exit_code = 0
+        self.assertIsNot(result.lock, live_lock)
+        with result.lock:
+            self.assertEqual(result.stdout_str, 'я')
+        self.assertTrue(result.lock.acquire())
+        result.lock.release()
+
+        result = exec_helpers.ExecResult(cmd, stdout=[b'1\n'], exit_code=0)
+        self.assertIs(
+            result.lock, exec_helpers.ExecResult(cmd, exit_code=1).lock)
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(result.stdout_str))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['1'] * 10)
+
+    def test_timeline(self):
+        """Output arrival time is recorded on demand."""
+        self.assertIsNone(exec_helpers.ExecResult(cmd).timeline)
+
+        clock = mock.Mock(side_effect=[10.0, 11.0, 11.5, 14.0, 15.0])
+        with mock.patch('exec_helpers.exec_result._monotonic', clock):
+            result = exec_helpers.ExecResult(cmd, record_timeline=True)
+            timeline = result.timeline
+            self.assertIsNone(timeline.time_to_first_byte)
+            result.read_stdout([b'', b'abc\n'])
+            result.read_stderr([b'err\n'])
+            result.exit_code = 0
+        self.assertEqual(
+            list(timeline),
+            [(1.0, 'stdout', 0), (1.5, 'stdout', 4), (4.0, 'stderr', 4)]
+        )
+        self.assertEqual(len(timeline), 3)
+        self.assertEqual(timeline.time_to_first_byte, 1.5)
+        self.assertEqual(timeline.wall_time, 5.0)
+        self.assertEqual(timeline.total_bytes, 8)
+        self.assertEqual(timeline.throughput, 1.6)
+        self.assertEqual(timeline.longest_silence, 2.5)
+        self.assertEqual(result['timeline'], timeline)
+
+    def test_watchers(self):
+        """Output patterns are matched while reading."""
+        import re
+
+        callback = mock.Mock()
+        result = exec_helpers.ExecResult(
+            cmd,
+            stop_on=re.compile(r'Server\s+started'),
+            fail_on=[b'Traceback', 'Error'],
+            watch_callback=callback
+        )
+        result.read_stdout([b'Starting\n', b'Server '])
+        result.read_stderr([b'Warn\n'])
+        self.assertIsNone(result.watch_match)
+        callback.assert_not_called()
+        result.read_stdout([b'started\n', b'Error\n'])
+        self.assertEqual(
+            result.watch_match, ('stop_on', 'stdout', b'Server started'))
+        callback.assert_called_once_with(result)
+        self.assertEqual(result['watch_match'], result.watch_match)
+
+        result = exec_helpers.ExecResult(cmd, stop_on='ok', fail_on='Err')
+        result.read_stderr([b'Er'])
+        result.read_stdout([b'r ok\n'])
+        self.assertEqual(result.watch_match, ('stop_on', 'stdout', b'ok'))
+
+    def test_compress(self):
+        """Output of finalized result is compressed and restored lazily."""
+        lines = [b'repeated output line %d\n' % (idx % 10)
+                 for idx in range(500)]
+        result = exec_helpers.ExecResult(cmd, stdout=lines, stderr=[b'err\n'])
+        with self.assertRaises(RuntimeError):
+            result.compress()
+        result.exit_code = 0
+        expected = exec_helpers.ExecResult(
+            cmd, stdout=lines, stderr=[b'err\n'], exit_code=0)
+        self.assertEqual(result.stdout_str, expected.stdout_str)
+        self.assertIsNone(result.compressed_size)
+
+        size = result.compress()
+        self.assertEqual(result.compressed_size, size)
+        self.assertLess(size * 10, len(b''.join(lines)))
+        self.assertEqual(result.stdout_lines.line_count, 500)
+        self.assertEqual(result.compressed_size, size)
+        self.assertEqual(result.stdout_str, expected.stdout_str)
+        self.assertEqual(result.stdout, expected.stdout)
+        self.assertEqual(result.stdout_lines[-1], 'repeated output line 9')
+        self.assertLess(result.compressed_size, size)  # stderr only
+        self.assertEqual(result.stderr_bin, expected.stderr_bin)
+        self.assertIsNone(result.compressed_size)
+
+        with self.assertRaises(ValueError):
+            result.compress('unknown')
+
+        for kwargs in ({'max_output_lines': 5}, {'spill_threshold': 10}):
+            result = exec_helpers.ExecResult(
+                cmd, stdout=lines, exit_code=0, **kwargs)
+            brief = result.stdout_brief
+            result.compress()
+            self.assertEqual(
+                result.stdout,
+                exec_helpers.ExecResult(
+                    cmd, stdout=lines, exit_code=0, **kwargs).stdout
+            )
+            self.assertEqual(result.stdout_brief, brief)
+
+    def test_read_concurrent_finalize(self):
+        """Output is not accepted after finalization by other thread."""
+        result = exec_helpers.ExecResult(cmd)
+        started = threading.Event()
+        errors = []
+
+        def read():
+            started.set()
+            try:
+                result.read_stdout([b'late\n'])
+            except RuntimeError as e:
+                errors.append(e)
+
+        reader = threading.Thread(target=read)
+        with result.lock:
+            reader.start()
+            started.wait(5)
+            time.sleep(0.05)  # Reader waits for the lock
+            result.exit_code = 0
+        reader.join(5)
+        self.assertEqual(
+            [str(error) for error in errors], ['Final exit code received.'])
+        self.assertEqual(result.stdout, ())
+        with self.assertRaises(RuntimeError):
+            result.exit_code = 1
+
+    def test_compress_concurrent_read(self):
+        """Reader without lock does not see partially compressed output."""
+        lines = [b'line %d\n' % idx for idx in range(200)]
+        expected = bytearray(b''.join(lines))
+        result = exec_helpers.ExecResult(cmd, stdout=lines, exit_code=0)
+        paused = threading.Event()
+        resume = threading.Event()
+        data = []
+
+        def trace(frame, event, arg):
+            """Pause reader inside OutputBuffer.join after data load."""
+            code = frame.f_code
+            if (
+                code.co_name != 'join' or
+                not code.co_filename.endswith('_output_buffer.py')
+            ):
+                return None
+            seen = []
+
+            def trace_lines(frame, event, arg):
+                if event == 'line':
+                    seen.append(frame.f_lineno)
+                    if len(seen) == 2 and not paused.is_set():
+                        paused.set()
+                        resume.wait(5)
+                return trace_lines
+            return trace_lines
+
+        def read():
+            sys.settrace(trace)
+            try:
+                data.append(result.stdout_bin)
+            finally:
+                sys.settrace(None)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        if not paused.wait(5):  # pragma: no cover
+            resume.set()
+            reader.join()
+            self.skipTest('OutputBuffer is compiled: tracing is not possible')
+        try:
+            self.assertIsNotNone(result.compress())
+        finally:
+            resume.set()
+            reader.join()
+        self.assertEqual(data, [expected])
+        self.assertEqual(result.stdout_bin, expected)
+
+    def test_digest(self):
+        """Finalized results are hashed and compared by output digests."""
+        lines = [b'line %d\n' % idx for idx in range(100)]
+        result = exec_helpers.ExecResult(cmd, stdout=lines[:50])
+        partial = result.stdout_digest
+        result.read_stdout(lines[50:])
+        self.assertNotEqual(result.stdout_digest, partial)
+        result.exit_code = 0
+
+        same = exec_helpers.ExecResult(
+            cmd, stdout=[b''.join(lines)], exit_code=0)
+        self.assertEqual(result.stdout_digest, same.stdout_digest)
+        self.assertEqual(result.stderr_digest, same.stderr_digest)
+        self.assertEqual(len(result.stdout_digest), 64)
+        self.assertEqual(result, same)
+        self.assertEqual(hash(result), hash(same))
+        self.assertEqual(len({result, same}), 1)
+
+        other = exec_helpers.ExecResult(
+            cmd, stdout=lines[:-1], exit_code=0)
+        self.assertNotEqual(result, other)
+        self.assertNotEqual(
+            result, exec_helpers.ExecResult(cmd, stdout=lines, exit_code=1))
+
+        # Dropped output is covered by digest
+        limited = exec_helpers.ExecResult(
+            cmd, stdout=lines, exit_code=0, max_output_lines=10)
+        self.assertEqual(limited.stdout_digest, result.stdout_digest)
+
+        restored = exec_helpers.ExecResult.from_bytes(limited.to_bytes())
+        self.assertEqual(restored.stdout_digest, result.stdout_digest)
+        result.compress()
+        self.assertEqual(result.stdout_digest, same.stdout_digest)
+
+    def test_intern_lines(self):
+        """Repeated lines are stored as single object."""
+        lines = [
+            ('progress {}%\n'.format(idx % 4 * 25)).encode('utf-8')
+            for idx in range(100)
+        ]
+        result = exec_helpers.ExecResult(cmd, intern_lines=True)
+        result.read_stdout(lines)
+        result.exit_code = 0
+        expected = exec_helpers.ExecResult(cmd, stdout=lines, exit_code=0)
+        self.assertEqual(result.stdout, expected.stdout)
+        self.assertEqual(result.stdout_str, expected.stdout_str)
+        self.assertEqual(len({id(line) for line in result.stdout}), 4)
+        self.assertEqual(result, expected)
+
+        restored = exec_helpers.ExecResult.from_bytes(expected.to_bytes())
+        self.assertEqual(restored.stdout, expected.stdout)
+        self.assertEqual(len({id(line) for line in restored.stdout}), 4)
+
+        bounded = exec_helpers.ExecResult(
+            cmd, stdout=lines, exit_code=0,
+            intern_lines=True, max_output_lines=10)
+        self.assertEqual(bounded.stdout_dropped_lines, 90)
@@ -0,0 +1,171 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+import exec_helpers
+from exec_helpers import _limits
+
+
+class TestProcessLimits(unittest.TestCase):
+    def test_validation(self):
+        with self.assertRaises(ValueError):
+            _limits.ProcessLimits(ionice='fast')
+        with self.assertRaises(ValueError):
+            _limits.ProcessLimits(ionice=('be', 8))
+        with self.assertRaises(ValueError):
+            _limits.ProcessLimits(cgroup_limits={'memory.max': '1M'})
+
+        tmp = tempfile.mkdtemp()
+        try:
+            with self.assertRaises(ValueError):
+                _limits.ProcessLimits(cgroup=os.path.join(tmp, 'group'))
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_gate(self):
+        self.assertEqual(
+            _limits.ProcessLimits.gate('echo 1', shell=True),
+            ['/bin/sh', '-c', _limits._GATE + '\necho 1']
+        )
+        self.assertEqual(
+            _limits.ProcessLimits.gate(['echo', '1'], shell=False),
+            ['/bin/sh', '-c', _limits._GATE + '; exec "$@"', '/bin/sh',
+             'echo', '1']
+        )
+
+    def test_check_executable(self):
+        _limits.check_executable('sh')
+        _limits.check_executable('/bin/sh')
+        with self.assertRaises(OSError):
+            _limits.check_executable('sh', env={'PATH': '/nonexistent'})
+        tmp = tempfile.mkdtemp()
+        try:
+            open(os.path.join(tmp, 'script'), 'w').close()
+            with self.assertRaises(OSError) as context:
+                _limits.check_executable('./script', cwd=tmp)
+            self.assertEqual(context.exception.errno, errno.EACCES)
+        finally:
+            shutil.rmtree(tmp)
+
+
+@unittest.skipIf(_limits._prlimit is None, 'prlimit is required')
+class TestSubprocessLimits(unittest.TestCase):
+    def test_rlimits(self):
+        runner = exec_helpers.Subprocess()
+        with self.assertRaises(ValueError):
+            runner.execute('true', rlimits={'unknown': 1})
+
+        result = runner.execute(
+            'ulimit -n; ulimit -Hn', rlimits={'nofile': (64, 128)})
+        self.assertEqual(result.stdout_str, '64\n128')
+
+        result = runner.execute(
+            ['sh', '-c', 'ulimit -t'], rlimits={'cpu': 5})
+        self.assertEqual(result.stdout_str, '5')
+
+    def test_stdin_exit_code(self):
+        runner = exec_helpers.Subprocess()
+        result = runner.execute(
+            'cat; exit 3', stdin='data', rlimits={'cpu': 5})
+        self.assertEqual(result.stdout_str, 'data')
+        self.assertEqual(result.exit_code, 3)
+
+    def test_missing_executable(self):
+        runner = exec_helpers.Subprocess()
+        with self.assertRaises(OSError) as context:
+            runner.execute(['no-such-executable', '1'], rlimits={'cpu': 5})
+        self.assertEqual(context.exception.errno, errno.ENOENT)
+        with self.assertRaises(OSError):
+            runner.execute(['./no-such-executable'], rlimits={'cpu': 5})
+
+        result = runner.execute(['sh', '-c', 'exit 3'], rlimits={'cpu': 5})
+        self.assertEqual(result.exit_code, 3)
+
+    def test_nice(self):
+        runner = exec_helpers.Subprocess()
+        result = runner.execute('nice', nice=3)
+        self.assertEqual(int(result.stdout_str), os.nice(0) + 3)
+
+    @mock.patch('exec_helpers._limits._ioprio_set')
+    def test_ionice(self, ioprio_set):
+        runner = exec_helpers.Subprocess()
+        runner.execute('true', ionice=('be', 5))
+        ioprio_set.assert_called_once_with(mock.ANY, 2 << 13 | 5)
+
+    def test_cgroup(self):
+        root = tempfile.mkdtemp()
+        try:
+            # Directory with cgroup.procs is treated as cgroup v2
+            open(os.path.join(root, 'cgroup.procs'), 'w').close()
+            group = os.path.join(root, 'group')
+            runner = exec_helpers.Subprocess()
+            result = runner.execute(
+                'true', cgroup=group, cgroup_limits={'memory.max': '1M'})
+            self.assertEqual(result.exit_code, 0)
+            with open(os.path.join(group, 'memory.max')) as control:
+                self.assertEqual(control.read(), '1M')
+            with open(os.path.join(group, 'cgroup.procs')) as procs:
+                self.assertTrue(procs.read().isdigit())
+        finally:
+            shutil.rmtree(root)
+
+    def test_cgroup_release(self):
+        root = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(root, 'existing'))
+            open(os.path.join(root, 'existing', 'cgroup.procs'), 'w').close()
+            read_fd, write_fd = os.pipe()
+            self.addCleanup(os.close, read_fd)
+            self.addCleanup(os.close, write_fd)
+            process = mock.Mock(pid=os.getpid())
+            process.stdin.fileno.return_value = write_fd
+            parent = os.path.join(root, 'existing', 'parent')
+            group = os.path.join(parent, 'group')
+            limits = _limits.ProcessLimits(cgroup=group)
+            limits.apply(process)
+            self.assertTrue(os.path.isdir(group))
+            # Emulate cgroupfs: process is moved out, control files vanish
+            os.remove(os.path.join(group, 'cgroup.procs'))
+            limits.release()
+            self.assertFalse(os.path.exists(parent))
+            self.assertTrue(os.path.isdir(os.path.join(root, 'existing')))
+
+            # Used cgroup is kept
+            limits = _limits.ProcessLimits(cgroup=group)
+            limits.apply(process)
+            limits.release()
+            self.assertTrue(os.path.isdir(group))
+        finally:
+            shutil.rmtree(root)
+
+    @mock.patch(
+        'exec_helpers._limits._prlimit',
+        side_effect=OSError(errno.EPERM, 'Operation not permitted')
+    )
+    def test_apply_error(self, prlimit):
+        runner = exec_helpers.Subprocess()
+        with self.assertRaises(OSError):
+            runner.execute('touch should_not_exist', rlimits={'cpu': 5})
+        self.assertFalse(os.path.exists('should_not_exist'))
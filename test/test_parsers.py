@@ -0,0 +1,147 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import unittest
+
+import mock
+
+import exec_helpers
+from exec_helpers import parsers
+
+
+cmd = 'ps'
+
+
+class TestParsers(unittest.TestCase):
+    def parse(self, name, stdout):
+        return exec_helpers.ExecResult(
+            cmd, stdout=[stdout], exit_code=0).parse(name)
+
+    def test_registry(self):
+        for name in (
+            'json', 'yaml', 'yaml_all', 'csv', 'tsv', 'kv', 'table', 'columns'
+        ):
+            self.assertIn(name, parsers.parser_names())
+        self.assertIsNone(parsers.get_parser('unknown'))
+        with self.assertRaises(ValueError):
+            parsers.register_parser('json', len)
+
+        parsers.register_parser('length', len)
+        try:
+            self.assertEqual(self.parse('length', b' 123\n'), 3)
+            parsers.register_parser('length', lambda text: 0, override=True)
+            self.assertEqual(self.parse('length', b'123'), 0)
+        finally:
+            del parsers._registry['length']
+
+    def test_structured(self):
+        self.assertEqual(self.parse('json', b'{"a": [1]}'), {'a': [1]})
+        self.assertEqual(self.parse('yaml', b'a: [1]\n'), {'a': [1]})
+        self.assertEqual(
+            self.parse('yaml_all', b'a: 1\n---\nb: 2\n'),
+            [{'a': 1}, {'b': 2}]
+        )
+
+    def test_tabular(self):
+        self.assertEqual(
+            self.parse('csv', b'name,value\n"a, b",1\n\nc,2\n'),
+            [{'name': 'a, b', 'value': '1'}, {'name': 'c', 'value': '2'}]
+        )
+        self.assertEqual(
+            self.parse('tsv', b'name\tvalue\na b\t1\n'),
+            [{'name': 'a b', 'value': '1'}]
+        )
+        self.assertEqual(
+            self.parse(
+                'table',
+                b'  PID TTY          TIME CMD\n'
+                b'    1 ?        00:00:01 /sbin/init splash\n'
+            ),
+            [{
+                'PID': '1', 'TTY': '?', 'TIME': '00:00:01',
+                'CMD': '/sbin/init splash'
+            }]
+        )
+        self.assertEqual(
+            self.parse('columns', b'1: lo    inet 127.0.0.1/8\n\n'),
+            [['1:', 'lo', 'inet', '127.0.0.1/8']]
+        )
+        self.assertEqual(self.parse('table', b''), [])
+        self.assertEqual(
+            self.parse(
+                'table',
+                b'Filesystem     1024-blocks     Used Available Capacity '
+                b'Mounted on\n'
+                b'devtmpfs           3071996        0   3071996       0% '
+                b'/dev\n'
+                b'/dev/vda         264212084 18741144  83554984      19% /\n'
+            ),
+            [
+                {
+                    'Filesystem': 'devtmpfs', '1024-blocks': '3071996',
+                    'Used': '0', 'Available': '3071996', 'Capacity': '0%',
+                    'Mounted on': '/dev',
+                },
+                {
+                    'Filesystem': '/dev/vda', '1024-blocks': '264212084',
+                    'Used': '18741144', 'Available': '83554984',
+                    'Capacity': '19%', 'Mounted on': '/',
+                },
+            ]
+        )
+        self.assertEqual(
+            self.parse('table', b'Mounted on\n'), [])
+
+    def test_kv(self):
+        self.assertEqual(
+            self.parse(
+                'kv',
+                b'# os-release\nNAME="Ubuntu"\n\n'
+                b'ID=ubuntu\nEMPTY=\nQ=\'x=y\'\n'
+            ),
+            {'NAME': 'Ubuntu', 'ID': 'ubuntu', 'EMPTY': '', 'Q': 'x=y'}
+        )
+        with mock.patch('exec_helpers.exec_result.logger', autospec=True):
+            with self.assertRaises(
+                exec_helpers.exceptions.DeserializeValueError
+            ):
+                self.parse('kv', b'not kv')
+
+    def test_cache(self):
+        parser = mock.Mock(side_effect=lambda text: [text])
+        parsers.register_parser('mocked', parser)
+        try:
+            result = exec_helpers.ExecResult(cmd, stdout=[b'1\n'])
+            self.assertEqual(result.parse('mocked'), ['1'])
+            result.read_stdout([b'2\n'])
+            self.assertEqual(result.parse('mocked'), ['1\n2'])
+            self.assertEqual(parser.call_count, 2)
+
+            result.exit_code = 0
+            parsed = result.parse('mocked')
+            self.assertIs(result.parse('mocked'), parsed)
+            self.assertEqual(parser.call_count, 3)
+        finally:
+            del parsers._registry['mocked']
+
+        result = exec_helpers.ExecResult(
+            cmd, stdout=[b'{"a": 1}'], exit_code=0)
+        self.assertEqual(result.stdout_json, result.stdout_json)
+        with mock.patch('exec_helpers.exec_result.logger', autospec=True):
+            with self.assertRaises(NotImplementedError):
+                result.parse('unknown')
@@ -0,0 +1,133 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import sys
+import unittest
+
+import mock
+
+import exec_helpers
+
+
+@unittest.skipIf(
+    sys.platform == 'win32' or not os.path.exists('/bin/bash'),
+    'posix shell is required'
+)
+@mock.patch('exec_helpers.shell_session.logger', autospec=True)
+class TestShellSession(unittest.TestCase):
+    def setUp(self):
+        self.session = exec_helpers.Subprocess().session()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_state(self, logger):
+        with self.session as session:
+            self.assertFalse(session.alive)
+            session.execute('cd /; VALUE="a b"')
+            self.assertTrue(session.alive)
+            result = session.execute('pwd; echo "$VALUE"')
+            self.assertEqual(result.stdout, (b'/\n', b'a b\n'))
+            self.assertEqual(result.exit_code, 0)
+        self.assertFalse(session.alive)
+
+    def test_framing(self, logger):
+        result = self.session.execute(
+            'echo out; echo -n tail; echo -n err >&2; exit_code=3; '
+            'return_code() { return $1; }; return_code $exit_code'
+        )
+        self.assertEqual(result.stdout, (b'out\n', b'tail'))
+        self.assertEqual(result.stderr, (b'err',))
+        self.assertEqual(result.exit_code, 3)
+        self.assertEqual(self.session.execute('true').stdout, ())
+
+    def test_syntax_error(self, logger):
+        result = self.session.execute('echo "not closed')
+        self.assertEqual(result.exit_code, 2)
+        self.assertTrue(result.stderr)
+        self.assertEqual(self.session.execute('echo ok').stdout, (b'ok\n',))
+
+    def test_stdin(self, logger):
+        result = self.session.execute('cat', stdin='line\ndata')
+        self.assertEqual(result.stdout, (b'line\n', b'data'))
+        # stdin of the shell is not available for commands
+        self.assertEqual(self.session.execute('cat').stdout, ())
+
+    def test_stdin_stream(self, logger):
+        size = 8 << 20  # Exceeds FIFO buffer: data is streamed
+        result = self.session.execute(
+            'wc -c; echo -n err >&2',
+            stdin=(b'x' * 1024 for _ in range(size // 1024)),
+        )
+        self.assertEqual(result.stdout_str.strip(), str(size))
+        self.assertEqual(result.stderr, (b'err',))
+        # Command does not read data
+        result = self.session.execute('true', stdin=[b'x' * (1 << 20)])
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(self.session.execute('echo ok').stdout, (b'ok\n',))
+
+    def test_stdin_source_error(self, logger):
+        def source():
+            yield b'data'
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            self.session.execute('sleep 10', stdin=source(), timeout=5)
+        self.assertFalse(self.session.alive)
+
+    def test_exit(self, logger):
+        result = self.session.execute('echo bye; exit 7')
+        self.assertEqual(result.stdout, (b'bye\n',))
+        self.assertEqual(result.exit_code, 7)
+        self.assertFalse(self.session.alive)
+        # Restarted
+        self.assertEqual(self.session.execute('echo ok').exit_code, 0)
+
+    def test_timeout(self, logger):
+        self.session.execute('VALUE=1')
+        with self.assertRaises(exec_helpers.ExecHelperTimeoutError):
+            self.session.execute('sleep 10', timeout=0.1)
+        self.assertFalse(self.session.alive)
+        # Restarted: state is lost
+        result = self.session.execute('echo "$VALUE"')
+        self.assertEqual(result.stdout, (b'\n',))
+
+    def test_options(self, logger):
+        result = self.session.execute('seq 5', max_output_lines=2)
+        self.assertEqual(result.stdout, (b'1\n', b'5\n'))
+        for options in (
+            {'stop_on': 'ready'},
+            {'open_stdout': False},
+            {'cwd': '/tmp', 'env': {}},
+        ):
+            with self.assertRaises(NotImplementedError):
+                self.session.execute('echo ok', **options)
+        self.assertEqual(self.session.execute('echo ok').stdout, (b'ok\n',))
+
+    def test_mask_check(self, logger):
+        session = exec_helpers.ShellSession(
+            log_mask_re=r"secret\s*=\s*([A-Z-a-z0-9_\-]+)"
+        )
+        with session:
+            result = session.check_call('echo secret=pass')
+            self.assertEqual(result.cmd, 'echo secret=<*masked*>')
+            with self.assertRaises(exec_helpers.CalledProcessError):
+                session.check_call('false')
+            with self.assertRaises(exec_helpers.CalledProcessError):
+                session.check_stderr('echo error >&2')
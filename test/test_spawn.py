@@ -0,0 +1,171 @@
+#    Copyright 2018 Alexey Stepanov aka penguinolog.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+import exec_helpers
+from exec_helpers import _reactor
+from exec_helpers import _spawn
+
+
+@unittest.skipIf(not hasattr(os, 'posix_spawn'), 'posix_spawn is required')
+class TestSpawnProcess(unittest.TestCase):
+    def test_pipes(self):
+        process = _spawn.SpawnProcess(
+            'read line; echo "out $line"; echo err >&2; exit 3',
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        process.stdin.write(b'data\n')
+        process.stdin.close()
+        self.assertEqual(process.stdout.read(), b'out data\n')
+        self.assertEqual(process.stderr.read(), b'err\n')
+        self.assertEqual(process.wait(), 3)
+        self.assertEqual(process.poll(), 3)
+        process.stdout.close()
+        process.stderr.close()
+
+    def test_argv_env(self):
+        process = _spawn.SpawnProcess(
+            ['sh', '-c', 'echo "$VALUE"'],
+            stdout=subprocess.PIPE,
+            env={'VALUE': 'a b', 'PATH': os.environ.get('PATH', '')},
+        )
+        self.assertEqual(process.stdout.read(), b'a b\n')
+        self.assertEqual(process.wait(), 0)
+        process.stdout.close()
+
+    def test_kill(self):
+        process = _spawn.SpawnProcess(['sleep', '10'])
+        self.assertIsNone(process.poll())
+        with self.assertRaises(subprocess.TimeoutExpired):
+            process.wait(timeout=0.01)
+        process.kill()
+        self.assertEqual(process.wait(), -9)
+        process.kill()  # Completed: nothing to do
+
+    def test_reap(self):
+        process = _spawn.SpawnProcess(['sh', '-c', 'exit 3'])
+        with process._waitpid_lock:  # Other thread waits for the process
+            time.sleep(0.1)
+            self.assertIsNone(_reactor.reap(process))
+            self.assertIsNone(process.returncode)
+        rusage = _reactor.reap(process)
+        self.assertEqual(process.returncode, 3)
+        if hasattr(os, 'wait4'):
+            self.assertIsNotNone(rusage)
+
+    def test_reap_poll_race(self):
+        for _ in range(20):
+            process = _spawn.SpawnProcess(['sh', '-c', 'exit 3'])
+            codes = []
+            stop = threading.Event()
+
+            def poll():
+                while not stop.is_set():
+                    codes.append(process.poll())
+
+            thread = threading.Thread(target=poll)
+            thread.start()
+            try:
+                while process.returncode is None:
+                    _reactor.reap(process)
+            finally:
+                stop.set()
+                thread.join()
+            self.assertEqual({code for code in codes if code is not None}, {3})
+            self.assertEqual(process.wait(), 3)
+
+    def test_env_path(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        program = os.path.join(directory, 'program')
+        with open(program, 'w') as script:
+            script.write('#!/bin/sh\necho found\n')
+        os.chmod(program, 0o755)
+        process = _spawn.SpawnProcess(
+            ['program'],
+            stdout=subprocess.PIPE,
+            env={'PATH': directory},
+        )
+        self.assertEqual(process.stdout.read(), b'found\n')
+        self.assertEqual(process.wait(), 0)
+        process.stdout.close()
+        # PATH of the parent is not used
+        with self.assertRaises(FileNotFoundError):
+            _spawn.SpawnProcess(['sh', '-c', 'true'], env={'PATH': directory})
+
+    def test_reaped_outside(self):
+        process = _spawn.SpawnProcess(['sh', '-c', 'exit 3'])
+        os.waitpid(process.pid, 0)  # Exit code is lost for the object
+        with self.assertRaises(ChildProcessError):
+            process.poll()
+        with self.assertRaises(ChildProcessError):
+            _reactor.reap(process)
+        self.assertIsNone(process.returncode)
+
+    def test_close_fds(self):
+        read_fd, write_fd = os.pipe()
+        os.set_inheritable(write_fd, True)
+        try:
+            process = _spawn.SpawnProcess(
+                ['sh', '-c', 'echo 1 >&{}'.format(write_fd)],
+                stderr=subprocess.PIPE,
+            )
+            self.assertEqual(process.wait(), 2)
+            process.stderr.close()
+        finally:
+            os.close(read_fd)
+            os.close(write_fd)
+
+    def test_not_found(self):
+        before = len(os.listdir('/proc/self/fd'))
+        with self.assertRaises(OSError):
+            _spawn.SpawnProcess(
+                ['/not/existing/program'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+        self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+
+    def test_supported(self):
+        with mock.patch('exec_helpers._spawn.SPAWN_ENABLED', True):
+            self.assertTrue(_spawn.spawn_supported())
+            self.assertFalse(_spawn.spawn_supported(cwd='/tmp'))
+        with mock.patch('exec_helpers._spawn.SPAWN_ENABLED', False):
+            self.assertFalse(_spawn.spawn_supported())
+
+    @mock.patch('exec_helpers._spawn.SPAWN_ENABLED', True)
+    def test_subprocess(self):
+        runner = exec_helpers.Subprocess()
+        result = runner.execute('cat; echo err >&2', stdin='data')
+        self.assertEqual(result.stdout_bin, bytearray(b'data'))
+        self.assertEqual(result.stderr_bin, bytearray(b'err\n'))
+        self.assertEqual(result.exit_code, 0)
+        with self.assertRaises(exec_helpers.ExecHelperTimeoutError):
+            runner.execute('sleep 10', timeout=0.1)
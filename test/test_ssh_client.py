@@ -33,6 +33,7 @@ import mock
 import paramiko
 
 import exec_helpers
+from exec_helpers import _ssh_client_base
 from exec_helpers import constants
 from exec_helpers import exec_result
 
@@ -547,6 +548,42 @@ class TestExecute(unittest.TestCase):
             ]
         )
 
+    @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_resource_usage(
+        self,
+        execute_async,
+        client, policy, logger
+    ):
+        (
+            chan, _stdin, exp_result, _, stdout
+        ) = self.get_patched_execute_async_retval()
+        is_set = mock.Mock(return_value=True)
+        chan.status_event.attach_mock(is_set, 'is_set')
+        marker = '__exec_helpers_usage_{}__'.format('0' * 32)
+        stderr = FakeStream(*(
+            stderr_list + [
+                b'Command exited with non-zero status 1\n',
+                marker.encode('ascii') + b' 1.50 0.25 0.10 2048 8 16 3 4\n',
+            ]
+        ))
+        execute_async.return_value = chan, _stdin, stderr, stdout
+
+        ssh = self.get_ssh()
+
+        with mock.patch('uuid.uuid4', return_value=mock.Mock(hex='0' * 32)):
+            result = ssh.execute(command=command, resource_usage=True)
+
+        self.assertEqual(result, exp_result)
+        self.assertEqual(result.stderr, tuple(stderr_list))
+        self.assertEqual(result.wall_time, 1.5)
+        self.assertEqual(
+            result.resource_usage,
+            exec_result.ResourceUsage(0.25, 0.1, 2048, 8, 16, 3, 4)
+        )
+        remote_command = execute_async.call_args[0][0]
+        self.assertTrue(remote_command.startswith('/usr/bin/time -f '))
+        self.assertIn(marker, remote_command)
+
     @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
     def test_execute_verbose(
             self,
@@ -786,6 +823,82 @@ class TestExecute(unittest.TestCase):
         execute_async.assert_called_once_with(command, verbose=False)
         chan.assert_has_calls((mock.call.status_event.is_set(), ))
 
+    @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_watch_kill(
+            self,
+            execute_async,
+            client, policy, logger):
+        (
+            chan, _stdin, _, stderr, stdout
+        ) = self.get_patched_execute_async_retval()
+        chan.status_event.attach_mock(
+            mock.Mock(return_value=False), 'is_set')
+        # Killed by signal: channel is closed without exit status
+        chan.configure_mock(eof_received=True)
+        execute_async.return_value = chan, _stdin, stderr, stdout
+
+        ssh = self.get_ssh()
+
+        with mock.patch(
+            'exec_helpers._ssh_client_base._signal_channel'
+        ) as signal_channel:
+            # noinspection PyTypeChecker
+            result = ssh.execute(command=command, timeout=10, fail_on='1')
+
+        signal_channel.assert_called_once_with(chan, 'KILL')
+        self.assertEqual(result.watch_match, ('fail_on', 'stderr', b'1'))
+        chan.close.assert_called()
+        self.assertEqual(result.exit_code, exec_helpers.ExitCodes.EX_SIGKILL)
+        self.assertIsNotNone(result.timestamp)
+        self.assertIsNotNone(result.wall_time)
+        self.assertEqual(result.stdout, tuple(stdout_list))
+
+    @mock.patch('exec_helpers._ssh_client_base._KILL_WAIT', 0.2)
+    @mock.patch('exec_helpers._ssh_client_base._signal_channel')
+    @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_watch_kill_status(
+            self,
+            execute_async,
+            signal_channel,
+            client, policy, logger):
+        (
+            chan, _stdin, _, stderr, stdout
+        ) = self.get_patched_execute_async_retval()
+        is_set = mock.Mock(return_value=False)
+        chan.status_event.attach_mock(is_set, 'is_set')
+        chan.configure_mock(eof_received=False, closed=False)
+        execute_async.return_value = chan, _stdin, stderr, stdout
+
+        ssh = self.get_ssh()
+
+        # Signal is not supported by server: channel is closed
+        # noinspection PyTypeChecker
+        result = ssh.execute(command=command, timeout=10, fail_on='1')
+        self.assertEqual(result.exit_code, exec_helpers.ExitCodes.EX_SIGHUP)
+
+        # Exit status is received
+        (
+            chan, _stdin, _, stderr, stdout
+        ) = self.get_patched_execute_async_retval(ec=9)
+        chan.status_event.attach_mock(is_set, 'is_set')
+        chan.configure_mock(eof_received=False, closed=False)
+        execute_async.return_value = chan, _stdin, stderr, stdout
+        signal_channel.side_effect = lambda *args: is_set.configure_mock(
+            return_value=True)
+        is_set.configure_mock(return_value=False)
+        # noinspection PyTypeChecker
+        result = ssh.execute(command=command, timeout=10, fail_on='1')
+        self.assertEqual(result.exit_code, 9)
+
+    def test_signal_channel(self, client, policy, logger):
+        chan = mock.Mock(remote_chanid=3)
+        _ssh_client_base._signal_channel(chan, 'KILL')
+        message = chan.transport._send_user_message.call_args[0][0]
+        self.assertEqual(
+            message.asbytes(),
+            b'b\0\0\0\x03\0\0\0\x06signal\0\0\0\0\x04KILL'
+        )
+
     @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
     def test_execute_mask_command(
         self,
@@ -890,6 +1003,54 @@ class TestExecute(unittest.TestCase):
             exec_helpers.SSHClient.execute_together(
                 remotes=remotes, command=command, expected=[1])
 
+    @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_together_watchers(
+        self,
+        execute_async,
+        client, policy, logger
+    ):
+        ssh = self.get_ssh()
+        with self.assertRaises(NotImplementedError):
+            # noinspection PyTypeChecker
+            exec_helpers.SSHClient.execute_together(
+                remotes=[ssh], command=command, stop_on='ready')
+        execute_async.assert_not_called()
+
+    @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_together_resource_usage(
+        self,
+        execute_async,
+        client, policy, logger
+    ):
+        (
+            chan, _stdin, _, _, stdout
+        ) = self.get_patched_execute_async_retval()
+        marker = '__exec_helpers_usage_{}__'.format('0' * 32)
+        stderr = FakeStream(*(
+            stderr_list +
+            [marker.encode('ascii') + b' 1.50 0.25 0.10 2048 8 16 3 4\n']
+        ))
+        execute_async.return_value = chan, _stdin, stderr, stdout
+
+        ssh = self.get_ssh()
+
+        with mock.patch('uuid.uuid4', return_value=mock.Mock(hex='0' * 32)):
+            # noinspection PyTypeChecker
+            results = exec_helpers.SSHClient.execute_together(
+                remotes=[ssh], command=command, resource_usage=True)
+
+        result = results[(ssh.hostname, ssh.port)]
+        self.assertEqual(result.cmd, command)
+        self.assertEqual(result.stderr, tuple(stderr_list))
+        self.assertEqual(result.wall_time, 1.5)
+        self.assertEqual(
+            result.resource_usage,
+            exec_result.ResourceUsage(0.25, 0.1, 2048, 8, 16, 3, 4)
+        )
+        remote_command = execute_async.call_args[0][0]
+        self.assertTrue(remote_command.startswith('/usr/bin/time -f '))
+        self.assertNotIn('resource_usage', execute_async.call_args[1])
+
     @mock.patch('exec_helpers.ssh_client.SSHClient.execute_async')
     def test_execute_together_exceptions(
         self,
@@ -1316,6 +1477,41 @@ class TestExecuteThrowHost(unittest.TestCase):
             mock.call.close()
         ))
 
+    def test_execute_through_host_resource_usage(
+            self, transp, client, policy, logger):
+        (
+            open_session, transport, channel, get_transport,
+            open_channel, intermediate_channel
+        ) = self.prepare_execute_through_host(transp, client, exit_code=0)
+        marker = '__exec_helpers_usage_{}__'.format('0' * 32)
+        channel.makefile_stderr.return_value = FakeStream(
+            b' \n', b'0\n',
+            marker.encode('ascii') + b' 1.50 0.25 0.10 2048 8 16 3 4\n'
+        )
+
+        # noinspection PyTypeChecker
+        ssh = exec_helpers.SSHClient(
+            host=host,
+            port=port,
+            auth=exec_helpers.SSHAuth(
+                username=username,
+                password=password
+            ))
+
+        with mock.patch('uuid.uuid4', return_value=mock.Mock(hex='0' * 32)):
+            result = ssh.execute_through_host(
+                '127.0.0.2', command, resource_usage=True)
+        self.assertEqual(result.cmd, command)
+        self.assertEqual(result.stderr, (b' \n', b'0\n'))
+        self.assertEqual(result.wall_time, 1.5)
+        self.assertEqual(
+            result.resource_usage,
+            exec_result.ResourceUsage(0.25, 0.1, 2048, 8, 16, 3, 4)
+        )
+        remote_command = channel.exec_command.call_args[0][0]
+        self.assertTrue(remote_command.startswith('/usr/bin/time -f '))
+        self.assertIn(marker, remote_command)
+
 
 @mock.patch('exec_helpers._ssh_client_base.logger', autospec=True)
 @mock.patch(
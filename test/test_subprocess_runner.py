@@ -20,13 +20,22 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import unicode_literals
 
+import concurrent.futures
+import io
 import logging
+import os
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
 import mock
 
 import exec_helpers
+from exec_helpers import _api
+from exec_helpers import _reactor
 from exec_helpers import subprocess_runner
 
 command = 'ls ~\nline 2\nline 3\nline с кирилицей'
@@ -37,22 +46,29 @@ print_stdin = 'read line; echo "$line"'
 
 
 class FakeFileStream(object):
+    """Pipe with written data and closed write end."""
     def __init__(self, *args):
-        self.__src = list(args)
-
-    def __iter__(self):
-        for _ in range(len(self.__src)):
-            yield self.__src.pop(0)
+        self.__fd, write_fd = os.pipe()
+        os.write(write_fd, b''.join(args))
+        os.close(write_fd)
 
     def fileno(self):
-        return hash(tuple(self.__src))
+        return self.__fd
+
+    def __del__(self):
+        os.close(self.__fd)
 
 
 # TODO(AStepanov): Cover negative scenarios (timeout)
 
 
+@mock.patch('exec_helpers._spawn.SPAWN_ENABLED', False)
+@mock.patch('exec_helpers._reactor._wait4', None)
 @mock.patch('exec_helpers.subprocess_runner.logger', autospec=True)
-@mock.patch('select.select', autospec=True)
+@mock.patch(
+    'exec_helpers._reactor.open_pidfd',
+    autospec=True, return_value=None
+)
 @mock.patch(
     'exec_helpers.subprocess_runner.set_nonblocking_pipe', autospec=True
 )
@@ -107,9 +123,8 @@ class TestSubprocessRunner(unittest.TestCase):
         return ("Command exit code '{code!s}':\n{cmd!s}\n"
                 .format(cmd=result.cmd.rstrip(), code=result.exit_code))
 
-    def test_call(self, popen, _, select, logger):
+    def test_call(self, popen, _, pidfd, logger):
         popen_obj, exp_result = self.prepare_close(popen)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -154,9 +169,8 @@ class TestSubprocessRunner(unittest.TestCase):
             mock.call.poll(), popen_obj.mock_calls
         )
 
-    def test_call_verbose(self, popen, _, select, logger):
+    def test_call_verbose(self, popen, _, pidfd, logger):
         popen_obj, _ = self.prepare_close(popen)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -182,9 +196,8 @@ class TestSubprocessRunner(unittest.TestCase):
                     msg=self.gen_cmd_result_log_message(result)),
             ])
 
-    def test_context_manager(self, popen, _, select, logger):
+    def test_context_manager(self, popen, _, pidfd, logger):
         popen_obj, exp_result = self.prepare_close(popen)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         subprocess_runner.SingletonMeta._instances.clear()
 
@@ -203,15 +216,12 @@ class TestSubprocessRunner(unittest.TestCase):
 
         subprocess_runner.SingletonMeta._instances.clear()
 
-    @mock.patch('time.sleep', autospec=True)
     def test_execute_timeout_fail(
         self,
-        sleep,
-        popen, _, select, logger
+        popen, _, pidfd, logger
     ):
         popen_obj, exp_result = self.prepare_close(popen)
         popen_obj.configure_mock(returncode=None)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -234,9 +244,180 @@ class TestSubprocessRunner(unittest.TestCase):
             ),
         ))
 
-    def test_execute_no_stdout(self, popen, _, select, logger):
+    def test_execute_spill(self, popen, _, pidfd, logger):
+        popen_obj, exp_result = self.prepare_close(popen)
+
+        runner = exec_helpers.Subprocess()
+
+        # noinspection PyTypeChecker
+        result = runner.execute(command, spill_threshold=4)
+        self.assertTrue(result.spilled)
+        self.assertEqual(result, exp_result)
+        self.assertEqual(result.stdout_bin, exp_result.stdout_bin)
+
+    def test_execute_argv(self, popen, _, pidfd, logger):
+        argv = ['echo', 'secret=pass; rm -rf']
+        popen_obj, exp_result = self.prepare_close(
+            popen,
+            cmd_in_result="echo 'secret=<*masked*>; rm -rf'"
+        )
+
+        runner = exec_helpers.Subprocess()
+
+        # noinspection PyTypeChecker
+        result = runner.execute(argv, log_mask_re=r"secret=(\w+)")
+        self.assertEqual(result, exp_result)
+        popen.assert_called_once_with(
+            args=argv,
+            cwd=None,
+            env=None,
+            shell=False,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=False,
+        )
+
+        popen.reset_mock()
+        runner.execute('echo "a b"', shell=False)
+        self.assertEqual(popen.call_args[1]['args'], ['echo', 'a b'])
+        self.assertFalse(popen.call_args[1]['shell'])
+
+        with self.assertRaises(ValueError):
+            runner.execute(argv, shell='bash')
+
+    def test_execute_shell_auto(self, popen, _, pidfd, logger):
+        popen_obj, exp_result = self.prepare_close(popen)
+
+        runner = exec_helpers.Subprocess()
+
+        runner.execute('ls -la /tmp', shell='auto')
+        self.assertEqual(popen.call_args[1]['args'], ['ls', '-la', '/tmp'])
+        self.assertFalse(popen.call_args[1]['shell'])
+
+        for cmd in (command, 'ls | wc', 'VAR=1 ls', 'ls ~', 'echo $HOME'):
+            popen.reset_mock()
+            runner.execute(cmd, shell='auto')
+            self.assertEqual(popen.call_args[1]['args'], [cmd])
+            self.assertTrue(popen.call_args[1]['shell'])
+
+        # Not an executable: fallback to shell
+        popen.reset_mock()
+        popen.side_effect = [OSError(), popen_obj]
+        runner.execute('cd /tmp', shell='auto')
+        popen.assert_has_calls((
+            mock.call(
+                args=['cd', '/tmp'],
+                cwd=None,
+                env=None,
+                shell=False,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                universal_newlines=False,
+            ),
+            mock.call(
+                args=['cd /tmp'],
+                cwd=None,
+                env=None,
+                shell=True,
+                stderr=subprocess.PIPE,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                universal_newlines=False,
+            ),
+        ))
+
+    def test_execute_concurrency(self, popen, _, pidfd, logger):
+        state_lock = threading.Lock()
+        running = []
+        peak = []
+
+        def start(*args, **kwargs):
+            popen_obj, _ = self.prepare_close(mock.Mock())
+            popen_obj.configure_mock(returncode=None)
+            started = time.time()
+
+            def poll():
+                if time.time() - started > 0.05:
+                    with state_lock:
+                        if popen_obj in running:
+                            running.remove(popen_obj)
+                    popen_obj.configure_mock(returncode=0)
+
+            popen_obj.poll.side_effect = poll
+            with state_lock:
+                running.append(popen_obj)
+                peak.append(len(running))
+            return popen_obj
+
+        popen.side_effect = start
+
+        subprocess_runner.SingletonMeta._instances.clear()
+        runner = exec_helpers.Subprocess()
+        with self.assertRaises(ValueError):
+            runner.max_concurrency = 0
+        runner.max_concurrency = 2
+        try:
+            results = []
+            threads = [
+                threading.Thread(
+                    target=lambda: results.append(runner.execute(command))
+                )
+                for _ in range(6)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        finally:
+            subprocess_runner.SingletonMeta._instances.clear()
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(max(peak), 2)
+        for result in results:
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(result.stdout, tuple(stdout_list))
+
+    def test_execute_watch_detach(self, popen, _, pidfd, logger):
+        popen_obj, exp_result = self.prepare_close(popen)
+        popen_obj.configure_mock(returncode=None)
+
+        runner = exec_helpers.Subprocess()
+
+        # noinspection PyTypeChecker
+        result = runner.execute(
+            command, timeout=10, stop_on=[b'3'], fail_on=[b'Traceback'],
+            watch_action='detach'
+        )
+        self.assertEqual(result.watch_match, ('stop_on', 'stdout', b'3'))
+        self.assertEqual(result.exit_code, exec_helpers.ExitCodes.EX_INVALID)
+        popen_obj.kill.assert_not_called()
+
+        popen_obj.configure_mock(returncode=0)
+        self.assertEqual(list(result.iter_stdout_json(timeout=5)), [2, 3])
+        self.assertEqual(result.exit_code, 0)
+
+    def test_execute_watch_kill(self, popen, _, pidfd, logger):
+        popen_obj, exp_result = self.prepare_close(popen)
+        popen_obj.configure_mock(returncode=None)
+        popen_obj.kill.side_effect = lambda: popen_obj.configure_mock(
+            returncode=-9)
+
+        runner = exec_helpers.Subprocess()
+
+        # noinspection PyTypeChecker
+        result = runner.execute(command, timeout=10, fail_on='1')
+        self.assertEqual(result.watch_match, ('fail_on', 'stderr', b'1'))
+        popen_obj.kill.assert_called_once()
+        self.assertEqual(result.exit_code, -9)
+        self.assertEqual(result.stdout, exp_result.stdout)
+
+        with self.assertRaises(ValueError):
+            runner.execute(command, watch_action='ignore')
+
+    def test_execute_no_stdout(self, popen, _, pidfd, logger):
         popen_obj, exp_result = self.prepare_close(popen, open_stdout=False)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -272,9 +453,8 @@ class TestSubprocessRunner(unittest.TestCase):
             mock.call.poll(), popen_obj.mock_calls
         )
 
-    def test_execute_no_stderr(self, popen, _, select, logger):
+    def test_execute_no_stderr(self, popen, _, pidfd, logger):
         popen_obj, exp_result = self.prepare_close(popen, open_stderr=False)
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -311,13 +491,12 @@ class TestSubprocessRunner(unittest.TestCase):
             mock.call.poll(), popen_obj.mock_calls
         )
 
-    def test_execute_no_stdout_stderr(self, popen, _, select, logger):
+    def test_execute_no_stdout_stderr(self, popen, _, pidfd, logger):
         popen_obj, exp_result = self.prepare_close(
             popen,
             open_stdout=False,
             open_stderr=False
         )
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -348,7 +527,7 @@ class TestSubprocessRunner(unittest.TestCase):
             mock.call.poll(), popen_obj.mock_calls
         )
 
-    def test_execute_mask_global(self, popen, _, select, logger):
+    def test_execute_mask_global(self, popen, _, pidfd, logger):
         cmd = "USE='secret=secret_pass' do task"
         log_mask_re = r"secret\s*=\s*([A-Z-a-z0-9_\-]+)"
         masked_cmd = "USE='secret=<*masked*>' do task"
@@ -359,7 +538,6 @@ class TestSubprocessRunner(unittest.TestCase):
             cmd=cmd,
             cmd_in_result=masked_cmd
         )
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess(
             log_mask_re=log_mask_re
@@ -406,7 +584,7 @@ class TestSubprocessRunner(unittest.TestCase):
             mock.call.poll(), popen_obj.mock_calls
         )
 
-    def test_execute_mask_local(self, popen, _, select, logger):
+    def test_execute_mask_local(self, popen, _, pidfd, logger):
         cmd = "USE='secret=secret_pass' do task"
         log_mask_re = r"secret\s*=\s*([A-Z-a-z0-9_\-]+)"
         masked_cmd = "USE='secret=<*masked*>' do task"
@@ -417,7 +595,6 @@ class TestSubprocessRunner(unittest.TestCase):
             cmd=cmd,
             cmd_in_result=masked_cmd
         )
-        select.return_value = [popen_obj.stdout, popen_obj.stderr], [], []
 
         runner = exec_helpers.Subprocess()
 
@@ -671,3 +848,281 @@ class TestSubprocessRunnerHelpers(unittest.TestCase):
             stdin=stdin)
         self.assertEqual(result, expected_result)
         assert result == expected_result
+
+
+class TestStdinChunks(unittest.TestCase):
+    def test_data(self):
+        self.assertEqual(list(_api.stdin_chunks(u'data')), [b'data'])
+        self.assertEqual(list(_api.stdin_chunks(b'data')), [b'data'])
+        self.assertEqual(
+            list(_api.stdin_chunks(bytearray(b'data'))), [b'data']
+        )
+        self.assertEqual(list(_api.stdin_chunks(b'')), [])
+
+    def test_file(self):
+        src = io.BytesIO(b'x' * (_api._STDIN_CHUNK + 1))
+        self.assertEqual(
+            [len(chunk) for chunk in _api.stdin_chunks(src)],
+            [_api._STDIN_CHUNK, 1]
+        )
+        self.assertEqual(
+            list(_api.stdin_chunks(io.StringIO(u'text'))), [b'text']
+        )
+
+    def test_iterable(self):
+        self.assertEqual(
+            list(_api.stdin_chunks(iter([b'a', u'b', b'', bytearray(b'c')]))),
+            [b'a', b'b', b'c']
+        )
+        with self.assertRaises(TypeError):
+            _api.stdin_chunks(1)
+
+    def test_path(self):
+        if _api.pathlib is None:
+            self.skipTest('pathlib is required')
+        with tempfile.NamedTemporaryFile() as src:
+            src.write(b'data')
+            src.flush()
+            path = _api.pathlib.PurePath(src.name)
+            self.assertEqual(list(_api.stdin_chunks(path)), [b'data'])
+            # String is data
+            self.assertEqual(
+                list(_api.stdin_chunks(src.name)), [src.name.encode()]
+            )
+
+
+@unittest.skipIf(sys.platform == 'win32', 'posix reactor is required')
+class TestSubprocessWatch(unittest.TestCase):
+    def test_check_stop_on(self):
+        runner = exec_helpers.Subprocess()
+        for action in ('kill', 'detach'):
+            result = runner.check_call(
+                'echo ready; sleep 5', stop_on='ready', watch_action=action,
+                timeout=10,
+            )
+            self.assertEqual(
+                result.watch_match, ('stop_on', 'stdout', b'ready'))
+            self.assertEqual(result.stdout_str, 'ready')
+
+        result = runner.check_stderr(
+            'echo ready; sleep 5', stop_on='ready', timeout=10)
+        self.assertNotEqual(result.exit_code, 0)
+
+        with self.assertRaises(exec_helpers.CalledProcessError):
+            runner.check_call(
+                'echo failed; sleep 5', fail_on='failed', timeout=10)
+
+    def test_detach_slot(self):
+        subprocess_runner.SingletonMeta._instances.clear()
+        runner = exec_helpers.Subprocess()
+        try:
+            result = runner.execute(
+                'echo ready; sleep 0.5', stop_on='ready',
+                watch_action='detach', timeout=10,
+            )
+            self.assertEqual(
+                result.exit_code, exec_helpers.ExitCodes.EX_INVALID)
+            # Detached process is still running: slot is held
+            self.assertEqual(runner._Subprocess__running, 1)
+            self.assertEqual(len(runner._Subprocess__processes), 1)
+
+            deadline = time.time() + 5
+            while runner._Subprocess__running and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(result.exit_code, 0)
+            self.assertEqual(runner._Subprocess__running, 0)
+            self.assertEqual(len(runner._Subprocess__processes), 0)
+        finally:
+            subprocess_runner.SingletonMeta._instances.clear()
+
+
+@unittest.skipIf(sys.platform == 'win32', 'posix reactor is required')
+class TestSubprocessStdin(unittest.TestCase):
+    def test_stream(self):
+        size = 8 << 20  # Exceeds pipe buffers: stdin and stdout are polled
+        runner = exec_helpers.Subprocess()
+        result = runner.execute(
+            'cat; echo',
+            stdin=(b'x' * 1023 + b'\n' for _ in range(size // 1024)),
+            max_output_lines=2,
+            output_strategy='tail',
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.stdout, (b'x' * 1023 + b'\n', b'\n'))
+
+    def test_path(self):
+        if not hasattr(os, 'fspath'):
+            self.skipTest('os.PathLike is required')
+        import pathlib
+
+        with tempfile.NamedTemporaryFile() as src:
+            src.write(b'line 1\nline 2\n')
+            src.flush()
+            runner = exec_helpers.Subprocess()
+            result = runner.execute('wc -l', stdin=pathlib.Path(src.name))
+        self.assertEqual(result.stdout_str.strip(), '2')
+        with self.assertRaises(OSError):
+            runner.execute('cat', stdin=pathlib.Path(src.name))
+
+    def test_not_read(self):
+        runner = exec_helpers.Subprocess()
+        result = runner.execute('true', stdin=io.BytesIO(b'x' * (1 << 20)))
+        self.assertEqual(result.exit_code, 0)
+
+    def test_source_error(self):
+        def source():
+            yield b'data'
+            raise ValueError('failed')
+
+        runner = exec_helpers.Subprocess()
+        with self.assertRaises(ValueError):
+            runner.execute('sleep 10', stdin=source(), timeout=5)
+
+
+@unittest.skipIf(sys.platform == 'win32', 'posix reactor is required')
+class TestReactor(unittest.TestCase):
+    def test_threads(self):
+        """STDIN source and callbacks are not called from reactor thread."""
+        threads = set()
+
+        def source():
+            threads.add(threading.current_thread().name)
+            yield b'{"a": 1}\n'
+
+        runner = exec_helpers.Subprocess()
+        result = runner.execute(
+            'cat', stdin=source(),
+            stdout_json_callback=lambda record: threads.add(
+                threading.current_thread().name),
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(
+            threads, {'exec_helpers.stdin', 'exec_helpers.callbacks'})
+
+    def test_nested_execute(self):
+        """Callback can execute other command."""
+        runner = exec_helpers.Subprocess()
+        nested = []
+        result = runner.execute(
+            'echo \'{"a": 1}\'',
+            stdout_json_callback=lambda record: nested.append(
+                runner.execute('echo nested', timeout=5)),
+            timeout=5,
+        )
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(nested), 1)
+        self.assertEqual(nested[0].stdout_str, 'nested')
+
+    def test_slow_callback(self):
+        """Slow callback does not delay other commands."""
+        release = threading.Event()
+        runner = exec_helpers.Subprocess()
+        slow = threading.Thread(
+            target=runner.execute,
+            args=('echo \'{"a": 1}\'',),
+            kwargs={
+                'stdout_json_callback': lambda record: release.wait(10),
+            },
+        )
+        slow.start()
+        try:
+            started = time.time()
+            result = runner.execute('echo \'{"b": 2}\'', timeout=5)
+            self.assertEqual(result.stdout_json, {'b': 2})
+            self.assertLess(time.time() - started, 5)
+        finally:
+            release.set()
+            slow.join(10)
+
+    @mock.patch('exec_helpers._reactor.open_pidfd', return_value=None)
+    @mock.patch('exec_helpers._reactor._EXIT_POLL_MIN', 10)
+    def test_child_signal(self, _):
+        """Process exit is reported via SIGCHLD without pidfd."""
+        if threading.current_thread().name != 'MainThread':
+            self.skipTest('signal handler is installed from main thread')
+        runner = exec_helpers.Subprocess()
+        started = time.time()
+        result = runner.execute('sleep 0.2', timeout=5)
+        self.assertEqual(result.exit_code, 0)
+        self.assertLess(time.time() - started, 2)
+        self.assertTrue(_reactor._child_signal.active)
+
+    def test_write(self):
+        """Data is written to pipe by the reactor thread."""
+        reactor = _reactor.get_reactor()
+        read, write = os.pipe()
+        with io.open(read, 'rb') as reader:
+            future = reactor.write(
+                io.open(write, 'wb', buffering=0),
+                iter([b'x' * (1 << 20), b'end']),
+            )
+            self.assertEqual(len(reader.read()), (1 << 20) + 3)
+        self.assertIs(future.result(5), True)
+
+        # Not read: stopped
+        read, write = os.pipe()
+        future = reactor.write(
+            io.open(write, 'wb', buffering=0), iter([b'x' * (1 << 20)]))
+        self.assertFalse(future.done())
+        reactor.unregister(future)
+        self.assertIs(future.result(5), False)
+        os.close(read)
+
+    def test_reactor_failure(self):
+        """Reactor thread failure is reported to all registered futures."""
+        reactor = _reactor.Reactor()
+        processes = [
+            subprocess.Popen(
+                ['sleep', '5'], stdout=subprocess.PIPE, stdin=subprocess.PIPE)
+            for _ in range(2)
+        ]
+        try:
+            with mock.patch(
+                'exec_helpers._reactor.Reactor._Reactor__timeout',
+                side_effect=RuntimeError('failed')
+            ):
+                futures = [
+                    reactor.register(
+                        process,
+                        on_stdout=mock.Mock(),
+                        on_stderr=None,
+                        on_exit=mock.Mock(),
+                    )
+                    for process in processes
+                ]
+                done, _ = concurrent.futures.wait(futures, 5)
+            self.assertEqual(len(done), 2)
+            for future in futures:
+                self.assertIsInstance(future.exception(), RuntimeError)
+        finally:
+            for process in processes:
+                process.kill()
+                process.wait()
+                process.stdout.close()
+                process.stdin.close()
+
+        # The next registration starts new reactor thread
+        process = subprocess.Popen(['true'], stdout=subprocess.PIPE)
+        on_exit = mock.Mock()
+        future = reactor.register(
+            process, on_stdout=mock.Mock(), on_stderr=None, on_exit=on_exit)
+        self.assertEqual(future.result(5), 0)
+        on_exit.assert_called_once_with(0, mock.ANY)
+        process.stdout.close()
+
+
+@unittest.skipIf(not hasattr(os, 'wait4'), 'os.wait4 is required')
+class TestSubprocessResourceUsage(unittest.TestCase):
+    def test_resource_usage(self):
+        runner = exec_helpers.Subprocess()
+        result = runner.execute('sleep 0.1')
+        self.assertGreaterEqual(result.wall_time, 0.1)
+        usage = result.resource_usage
+        self.assertIsInstance(usage, exec_helpers.exec_result.ResourceUsage)
+        self.assertGreaterEqual(usage.user_time, 0)
+        self.assertGreater(usage.max_rss, 0)
+        self.assertGreater(usage.voluntary_switches, 0)
+        with self.assertRaises(RuntimeError):
+            result.resource_usage = usage
+        with self.assertRaises(RuntimeError):
+            result.wall_time = 0